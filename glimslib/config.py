@@ -11,6 +11,7 @@ output_dir_simulation                   = os.path.join(output_dir, 'simulation')
 output_dir_application                   = os.path.join(output_dir, 'application')
 
 output_dir_temp                         = os.path.join(output_dir, 'temp')
+output_dir_registration_cache           = os.path.join(output_dir, 'registration_cache')
 
 test_dir = os.path.join(base_path, 'test_cases')
 test_data_dir = os.path.join(test_dir, 'data')
@@ -20,5 +21,20 @@ path_to_meshtool = '/home/fenics/software/MESHTOOL_source'
 path_to_meshtool_bin = os.path.join(path_to_meshtool, 'bin', 'MeshTool')
 path_to_meshtool_xsd = os.path.join(path_to_meshtool, 'src', 'xml-io', 'imaging_meshing_schema.xsd')
 
+# registration settings
+# -- reuse outputs of identical ANTs calls from output_dir_registration_cache
+USE_REGISTRATION_CACHE = True
+# -- ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS for each registration call; None -> ITK default
+ITK_NUMBER_OF_THREADS = None
+# -- maximum number of concurrent registration calls
+REGISTRATION_WORKERS = 2
+# -- registration backend used by image based optimization: 'ants' (ANTs binaries) or 'sitk' (in-process SimpleITK)
+REGISTRATION_BACKEND = 'ants'
+
+# number of meshes (with their function spaces) kept in memory by data_io.read_mesh_hdf5; 0 disables the cache
+MESH_CACHE_SIZE = 16
+# number of assembled operators (moment vectors, transfer matrices) kept in memory by image based optimization
+OPERATOR_CACHE_SIZE = 16
+
 # Switch for using adjoint; false by default.
 USE_ADJOINT = False
\ No newline at end of file
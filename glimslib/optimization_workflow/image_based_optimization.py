@@ -1,3 +1,4 @@
+import collections
 import logging
 import os
 import pickle
@@ -16,13 +17,16 @@ config.USE_ADJOINT = True
 
 from glimslib import fenics_local as fenics
 from glimslib.optimization_workflow.path_io import PathIO
+from glimslib.optimization_workflow.stage_manifest import StageManifest, pipeline_stage
+from glimslib.optimization_workflow.results_store import ResultsStore
 from glimslib.utils import file_utils as fu
 import glimslib.utils.data_io as dio
 import glimslib.utils.meshing as meshing
 import glimslib.utils.vtk_utils as vtu
 from glimslib.visualisation import plotting as plott, helpers as vh
 import glimslib.utils.image_registration_utils as reg
-from glimslib.simulation_helpers.helper_classes import SubDomains, Boundary
+import glimslib.utils.registration_backends as regb
+from glimslib.simulation_helpers.helper_classes import SubDomains, Boundary, FieldMetrics
 from glimslib.simulation.simulation_tumor_growth_brain_quad import TumorGrowthBrain
 from ufl import tanh
 
@@ -34,9 +38,45 @@ else:
 
 class ImageBasedOptimizationBase:
 
+    # == Incremental execution of pipeline stages
+    # -- upstream stages of each stage
+    stage_dependencies = {'domain_prep': [],
+                          'forward_sim': ['domain_prep'],
+                          'target_fields': ['domain_prep', 'forward_sim'],
+                          'inverse_sim': ['domain_prep', 'target_fields'],
+                          'optimized_sim': ['inverse_sim']}
+    # -- attributes that determine the result of each stage, in addition to the arguments of the stage call
+    stage_params = {'domain_prep': ['path_to_image_atlas_orig', 'path_to_labels_atlas_orig',
+                                    'image_z_slice', 'dim'],
+                    'forward_sim': ['params_forward'],
+                    'target_fields': ['conc_threshold_levels'],
+                    'inverse_sim': ['params_inverse', 'conc_threshold_levels'],
+                    'optimized_sim': ['params_optimized', 'model_params_optimized']}
+    # -- attributes set by each stage; restored when a stage is skipped
+    stage_outputs = {'domain_prep': ['path_to_domain_image_3d', 'path_to_domain_labels_3d',
+                                     'path_to_domain_meshfct', 'path_to_domain_meshfct_red',
+                                     'path_to_domain_image_2d', 'path_to_domain_labels_2d',
+                                     'path_to_domain_image_2d_fct', 'path_to_domain_labels_2d_fct',
+                                     'path_to_domain_mesh_vtu', 'path_to_domain_meshfct_main',
+                                     'path_to_domain_image_main', 'path_to_domain_labels_main'],
+                     'forward_sim': ['path_forward_conc', 'path_forward_disp'],
+                     'target_fields': ['path_displacement_reconstructed', 'path_to_warped_image_deformed_to_ref',
+                                       'path_conc_T2', 'path_conc_T1'],
+                     'inverse_sim': ['params_optimization', 'model_params_optimized', 'measures',
+                                     'path_optimization_params', 'path_parameters_optimized',
+                                     'path_optimization_progress_pkl', 'path_optimization_progress_xls'],
+                     'optimized_sim': ['path_optimized_conc', 'path_optimized_disp']}
+    # -- increase to invalidate existing results of a stage after changes in its implementation
+    stage_versions = {'domain_prep': 1,
+                      'forward_sim': 1,
+                      'target_fields': 2,
+                      'inverse_sim': 1,
+                      'optimized_sim': 1}
+
     def __init__(self, base_dir,
                  path_to_labels_atlas=None, path_to_image_atlas=None,
-                 image_z_slice=None, plot=False):
+                 image_z_slice=None, plot=False, incremental=True,
+                 case_id=None, path_to_results_db=None, export_pickle=True, registration_backend=None):
         # paths
         self.base_dir = base_dir
         self.data = PathIO(self.base_dir)
@@ -44,6 +84,16 @@ class ImageBasedOptimizationBase:
         self._setup_paths()
         # init steps
         self._setup_loggers()
+        self.incremental = incremental
+        self.stage_manifest = StageManifest(self.path_to_stage_manifest,
+                                            stage_dependencies=self.stage_dependencies)
+        # results store; several cases may share the same database
+        self.case_id = case_id if case_id else os.path.basename(os.path.normpath(self.base_dir))
+        self.export_pickle = export_pickle
+        self.path_to_results_db = os.path.join(self.base_dir, 'results.sqlite')
+        # registration backend; 'ants' or 'sitk', defaults to config.REGISTRATION_BACKEND
+        self.registration_backend = registration_backend if registration_backend else config.REGISTRATION_BACKEND
+        self.registration = regb.get_registration_backend(self.registration_backend)
         if path_to_image_atlas and path_to_labels_atlas:
             self.path_to_image_atlas_orig = path_to_image_atlas
             self.path_to_labels_atlas_orig = path_to_labels_atlas
@@ -57,9 +107,13 @@ class ImageBasedOptimizationBase:
                 self.dim = 2
 
             self.measures = {}
+            if path_to_results_db:
+                self.path_to_results_db = path_to_results_db
             self._save_state()
         else:
             self._load_state()
+            if path_to_results_db:
+                self.path_to_results_db = path_to_results_db
 
     @abstractmethod
     def prepare_domain(self):
@@ -123,6 +177,8 @@ class ImageBasedOptimizationBase:
         self.path_parameters_optimized = self.data.create_params_path(processing=self.steps_sub_path_map['inverse_sim'],
                                                                       datasource='parameters_optimized')
 
+        self.path_to_stage_manifest = os.path.join(self.base_dir, 'stage_manifest.json')
+
     def _setup_loggers(self):
         # logging
         self.logger = logging.getLogger(__name__)
@@ -167,8 +223,26 @@ class ImageBasedOptimizationBase:
         fu.ensure_dir_exists(self.base_dir)
         with open(self.path_to_base_params, 'wb') as handle:
             pickle.dump(base_params, handle, protocol=pickle.HIGHEST_PROTOCOL)
-        with open(self.path_to_measures, 'wb') as handle:
-            pickle.dump(self.measures, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.get_results_store().write_measures(self.case_id, self.measures)
+        if self.export_pickle:
+            with open(self.path_to_measures, 'wb') as handle:
+                pickle.dump(self.measures, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _read_measures(self):
+        measures = self.get_results_store().read_measures(self.case_id)
+        if not measures and os.path.exists(self.path_to_measures):
+            with open(self.path_to_measures, "rb") as f:
+                measures = pickle.load(f)
+        return measures
+
+    def get_results_store(self):
+        """
+        Returns ResultsStore instance for database at `self.path_to_results_db`.
+        """
+        if not hasattr(self, '_results_store') or self._results_store.path_to_db != self.path_to_results_db:
+            self._results_store = ResultsStore(self.path_to_results_db)
+            self._results_store.write_case(self.case_id, base_dir=self.base_dir, case_class=type(self).__name__)
+        return self._results_store
 
     def _load_state(self):
         # load base params
@@ -177,11 +251,72 @@ class ImageBasedOptimizationBase:
                 base_params = pickle.load(f)
             for name, value in base_params.items():
                 setattr(self, name, value)
-        if os.path.exists(self.path_to_measures):
-            self.measures = pickle.load(open(self.path_to_measures, "rb"))
+        measures = self._read_measures()
+        if measures:
+            self.measures = measures
         else:
             self.logger.warning("Cannot initialize ")
 
+    # Functions for incremental execution
+
+    def _get_stage_code_version(self, stage):
+        return {'class': type(self).__name__,
+                'stage_version': self.stage_versions.get(stage),
+                'registration_backend': self.registration_backend,
+                'fenics_version': fenics.__version__}
+
+    def _get_stage_params(self, stage, call_args):
+        params = {'call_args': call_args}
+        for name in self.stage_params.get(stage, []):
+            params[name] = getattr(self, name, None)
+        return params
+
+    def _get_stage_state(self, stage):
+        return {name: getattr(self, name) for name in self.stage_outputs.get(stage, []) if hasattr(self, name)}
+
+    def _restore_stage_state(self, stage):
+        for name, value in self.stage_manifest.get_state(stage).items():
+            current = getattr(self, name, None)
+            if isinstance(current, dict) and isinstance(value, dict):
+                current.update(value)
+            else:
+                setattr(self, name, value)
+
+    def _run_stage(self, stage, method, call_args, force, *args, **kwargs):
+        """
+        Executes method as pipeline stage.
+        The stage is skipped if it has been executed before with the same parameters and inputs, and its outputs
+        are unchanged. In that case, the attributes set by the stage are restored from the stage manifest.
+        """
+        if getattr(self, '_active_stage', None) is not None or not self.incremental:
+            # nested stage call or incremental execution disabled
+            return method(self, *args, **kwargs)
+        params = self._get_stage_params(stage, call_args)
+        fingerprint, input_hashes = self.stage_manifest.compute_fingerprint(stage, params,
+                                                    code_version=self._get_stage_code_version(stage))
+        if not force and self.stage_manifest.is_up_to_date(stage, fingerprint):
+            self.logger.info("== Stage '%s' is up to date, skipping" % stage)
+            self._restore_stage_state(stage)
+            self._save_state()
+            return None
+        self.logger.info("== Running stage '%s'" % stage)
+        self._active_stage = stage
+        try:
+            result = method(self, *args, **kwargs)
+        except:
+            self.stage_manifest.invalidate(stage, downstream=False)
+            raise
+        finally:
+            self._active_stage = None
+        self.stage_manifest.record(stage, fingerprint, input_hashes, self._get_stage_state(stage))
+        return result
+
+    def invalidate_stage(self, stage, downstream=True):
+        """
+        Forces recomputation of stage (and all stages depending on it) on its next call.
+        """
+        self.stage_manifest.invalidate(stage, downstream=downstream)
+
     # Functions for Domain Preparation
 
     def _extract_2d_domain(self,
@@ -249,12 +384,13 @@ class ImageBasedOptimizationBase:
             dio.save_mesh_hdf5(mesh, path_meshfct, subdomains=subdomains.subdomains, boundaries=None)
 
     @staticmethod
-    def _reduce_2d_domain(path_domain_mesh, path_domain_mesh_red, tmp_path):
+    def _reduce_2d_domain(path_domain_mesh, path_domain_mesh_red):
         mesh, subdomains, boundaries = dio.read_mesh_hdf5(path_domain_mesh)
         # -- reduce domain size
-        mesh_thr, subdomains_thr = dio.remove_mesh_subdomain(mesh, subdomains, lower_thr=1, upper_thr=4,
-                                                             temp_dir=tmp_path)
-        dio.save_mesh_hdf5(mesh_thr, path_domain_mesh_red, subdomains=subdomains_thr)
+        mesh_thr, subdomains_thr, boundaries_thr, _, _ = dio.extract_submesh(mesh, subdomains,
+                                                                             lower_thr=1, upper_thr=4,
+                                                                             boundaries=boundaries)
+        dio.save_mesh_hdf5(mesh_thr, path_domain_mesh_red, subdomains=subdomains_thr, boundaries=boundaries_thr)
 
     @staticmethod
     def _mesh_3d_domain(path_to_image, path_to_mesh, tissues_dict=None):
@@ -278,6 +414,7 @@ class ImageBasedOptimizationBase:
                            path_to_meshtool_xsd=config.path_to_meshtool_xsd,
                            path_to_config_file=path_to_xml_file)
 
+    @pipeline_stage('domain_prep')
     def mesh_domain(self, plot=None):
         """
         Creates fenics mesh function from 3d image in
@@ -325,8 +462,7 @@ class ImageBasedOptimizationBase:
                                     plot=plot)
 
             self._reduce_2d_domain(path_domain_mesh=self.path_to_domain_meshfct,
-                                   path_domain_mesh_red=self.path_to_domain_meshfct_red,
-                                   tmp_path=self.data.create_path(processing='tmp'))
+                                   path_domain_mesh_red=self.path_to_domain_meshfct_red)
 
             self.path_to_domain_meshfct_main = self.path_to_domain_meshfct_red
             self.path_to_domain_image_main = self.path_to_domain_image_2d
@@ -372,7 +508,8 @@ class ImageBasedOptimizationBase:
         else:
             self.logger.error("Invalid problem_type '%s'!" % problem_type)
         # -- Initialisation
-        mesh, subdomains, boundaries = dio.read_mesh_hdf5(path_to_domain)
+        # simulation gets its own mesh instance, as it may be deformed in place
+        mesh, subdomains, boundaries = dio.read_mesh_hdf5(path_to_domain, cached=False)
         # initial values
         if len(seed_position) == 2 and self.dim == 2:
             u_0_conc_expr = fenics.Expression('exp(-a*pow(x[0]-x0, 2) - a*pow(x[1]-y0, 2))', degree=1,
@@ -437,8 +574,10 @@ class ImageBasedOptimizationBase:
         attribute_name = "params_%s" % problem_type
         if hasattr(self, attribute_name):
             params_dict = getattr(self, attribute_name)
-            with open(save_path, 'wb') as handle:
-                pickle.dump(params_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            self.get_results_store().write_run_params(self.case_id, problem_type, params_dict)
+            if self.export_pickle:
+                with open(save_path, 'wb') as handle:
+                    pickle.dump(params_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
         else:
             self.logger.warning("Parameters for problem '%s' do not exist" % problem_type)
 
@@ -466,10 +605,12 @@ class ImageBasedOptimizationBase:
         else:
             self.logger.error("Non existing 'problem type'")
 
-        if os.path.exists(save_path):
+        param_dict = self.get_results_store().read_run_params(self.case_id, problem_type)
+        if param_dict is None and os.path.exists(save_path):
             self.logger.info("Loading parameter file for '%s' problem: %s"%(problem_type, save_path))
             with open(save_path, "rb") as f:
                 param_dict = pickle.load(f)
+        if param_dict is not None:
             # check path_to_domain
             new_dir = self._rebase(param_dict['path_to_domain'])
             param_dict['path_to_domain'] = new_dir
@@ -528,6 +669,7 @@ class ImageBasedOptimizationBase:
                                                 problem_type='optimized',
                                                 optimization_type=self.params_inverse['optimization_type'])
 
+    @pipeline_stage('forward_sim')
     def run_forward_sim(self, plot=None):
         if plot is None:
             plot = self.plot
@@ -564,6 +706,7 @@ class ImageBasedOptimizationBase:
         self._save_state()
 
 
+    @pipeline_stage('optimized_sim')
     def run_optimized_sim(self, plot=None):
         if plot is None:
             plot = self.plot
@@ -657,6 +800,7 @@ class ImageBasedOptimizationBase:
             self.logger.error("Error in optimization:")
             self.logger.error(e)
 
+    @pipeline_stage('inverse_sim')
     def run_inverse_problem_n_params(self, params_init_values, params_names, solver_function,
                                      opt_params=None, **kwargs):
         params_init = [fenics.Constant(param) for param in params_init_values]
@@ -758,8 +902,10 @@ class ImageBasedOptimizationBase:
             datasource='optimization_progress', extension='xls')
         self.optimization_progress = opt_df
         self.logger.info(opt_df)
-        opt_df.to_excel(self.path_optimization_progress_xls)
-        opt_df.to_pickle(self.path_optimization_progress_pkl)
+        self.get_results_store().write_optimizer_iterations(self.case_id, opt_df)
+        if self.export_pickle:
+            opt_df.to_excel(self.path_optimization_progress_xls)
+            opt_df.to_pickle(self.path_optimization_progress_pkl)
 
         if fenics.is_version(">2017.2.x"):
             self.sim_inverse.tape.visualise()
@@ -821,7 +967,7 @@ class ImageBasedOptimizationBase:
                                           solver_function=self.sim_inverse.run_for_adjoint,
                                           opt_params=opt_params, output_dir=self.path_inverse_sim)
 
-    def _reload_model_sim(self, problem_type='forward'):
+    def _reload_model_sim(self, problem_type='forward', lazy=False):
         self.logger.info("=== Reloading simulation '%s'." % problem_type)
         param_attr_name = "params_%s" % problem_type
         if hasattr(self, param_attr_name):
@@ -831,7 +977,7 @@ class ImageBasedOptimizationBase:
                 if os.path.exists(data_path):
                     params = getattr(self, param_attr_name)
                     sim = self._init_problem(problem_type=problem_type, save_params=False, **params)
-                    sim.reload_from_hdf5(data_path)
+                    sim.reload_from_hdf5(data_path, lazy=lazy)
                     setattr(self, "sim_%s" % problem_type, sim)
             except:
                 self.logger.error("Non existing 'problem type'")
@@ -839,13 +985,13 @@ class ImageBasedOptimizationBase:
             self.logger.warning("Parameter attribute for simulation '%s' does not exist" % problem_type)
             self.logger.warning("Cannot reload simulation")
 
-    def _reload_forward_sim(self):
+    def _reload_forward_sim(self, lazy=False):
         self._read_problem_run_params(problem_type='forward')
-        self._reload_model_sim(problem_type='forward')
+        self._reload_model_sim(problem_type='forward', lazy=lazy)
 
-    def _reload_inverse_sim(self):
+    def _reload_inverse_sim(self, lazy=False):
         self._read_problem_run_params(problem_type='inverse')
-        self._reload_model_sim(problem_type='inverse')
+        self._reload_model_sim(problem_type='inverse', lazy=lazy)
         # parameters of optimization process
         if os.path.exists(self.path_optimization_params):
             with open(self.path_optimization_params, "rb") as f:
@@ -860,20 +1006,53 @@ class ImageBasedOptimizationBase:
             self.logger.warning(
                 "Cannot load 'model_params_optimized', %s does not exist" % self.path_parameters_optimized)
 
-    def _reload_optimized_sim(self):
+    def _reload_optimized_sim(self, lazy=False):
         self._read_problem_run_params(problem_type='optimized')
-        self._reload_model_sim(problem_type='optimized')
+        self._reload_model_sim(problem_type='optimized', lazy=lazy)
 
-    def reload_state(self):
+    def reload_state(self, lazy=True):
+        """
+        Reloads state, parameters and simulation results of all steps.
+        :param lazy: if True, simulation results are only read from file when accessed
+        """
         self.logger.info("")
-        self._reload_forward_sim()
-        self._reload_inverse_sim()
-        self._reload_optimized_sim()
-        if os.path.exists(self.path_to_measures):
-            with open(self.path_to_measures, "rb") as f:
-                self.measures = pickle.load(f)
+        self._reload_forward_sim(lazy=lazy)
+        self._reload_inverse_sim(lazy=lazy)
+        self._reload_optimized_sim(lazy=lazy)
+        self.measures = self._read_measures()
 
-    def _create_deformed_image(self, path_image_ref, output_path, path_image_warped):
+    def _create_deformed_image(self, path_image_ref, output_path, path_image_warped, in_memory=True):
+        """
+        Creates synthetic deformed image by warping the reference image with the simulated displacement field.
+        Outputs: path_image_warped, and label maps in reference and deformed configuration in output_path.
+        :param in_memory: if True, the displacement is rasterized directly from the fenics solution and images are
+                          warped in memory; else the merged VTU output of the forward simulation is resampled by VTK
+                          and images are warped by the registration backend
+        """
+        if not in_memory:
+            return self._create_deformed_image_from_vtu(path_image_ref, output_path, path_image_warped)
+        ref_image = sitk.ReadImage(path_image_ref)
+        # 1) Rasterize simulated displacement and labels on reference image grid
+        disp, mesh, subdomains, _ = dio.load_function_mesh(self.path_forward_disp, functionspace='vector')
+        point_locations = dio.locate_image_points(mesh, ref_image)
+        disp_img = dio.rasterize_function(disp, ref_image, point_locations=point_locations)
+        label_img = sitk.Cast(dio.rasterize_mesh_function(subdomains, ref_image, point_locations=point_locations),
+                              sitk.sitkUInt8)
+        # 2) Warp image and labels by inverse displacement, approximated by -u(x)
+        disp_img_inv = sitk.GetImageFromArray(-sitk.GetArrayFromImage(disp_img).astype(np.float64), isVector=True)
+        disp_img_inv.CopyInformation(ref_image)
+        transform = sitk.DisplacementFieldTransform(disp_img_inv)
+        image_warped = sitk.Resample(ref_image, ref_image, transform, sitk.sitkLinear, 0.0, ref_image.GetPixelID())
+        label_img_warped = sitk.Resample(label_img, ref_image, transform, sitk.sitkNearestNeighbor, 0,
+                                         label_img.GetPixelID())
+        # 3) Write outputs
+        fu.ensure_dir_exists(path_image_warped)
+        sitk.WriteImage(image_warped, path_image_warped)
+        fu.ensure_dir_exists(output_path)
+        sitk.WriteImage(label_img, os.path.join(output_path, 'label_img_resampledToT1.nii'))
+        sitk.WriteImage(label_img_warped, os.path.join(output_path, 'label_img_resampledToT1_warped.nii'))
+
+    def _create_deformed_image_from_vtu(self, path_image_ref, output_path, path_image_warped):
         # 1) Load reference image
         ref_image = sitk.ReadImage(path_image_ref)
         ref_image_size = ref_image.GetSize()
@@ -920,25 +1099,23 @@ class ImageBasedOptimizationBase:
         sitk.WriteImage(disp_img_RGB_inv, path_disp_img_inv)
 
         # 5) Apply deformation field to warp image
-        os.environ.copy()
-
-        # -- Warp atlas T1 image:
-        # - 1) atlas T1 by deformation field
-        reg.ants_apply_transforms(input_img=path_image_ref, output_file=path_image_warped,
-                                  reference_img=path_image_ref,
-                                  transforms=[path_disp_img_inv], dim=self.dim)
-
-        # - 2) resample label map to T1
         output_label_resampled = os.path.join(output_path, 'label_img_resampledToT1.nii')
-        reg.ants_apply_transforms(input_img=path_label_img, output_file=output_label_resampled,
-                                  reference_img=path_image_ref,
-                                  transforms=[], dim=self.dim)
-
-        # - 3) resample label map to T1
         output_label_resampled_warped = os.path.join(output_path, 'label_img_resampledToT1_warped.nii')
-        reg.ants_apply_transforms(input_img=path_label_img, output_file=output_label_resampled_warped,
-                                  reference_img=path_image_ref,
-                                  transforms=[path_disp_img_inv], dim=self.dim)
+        apply_transforms = self.registration.apply_transforms_files
+        tasks = [  # - 1) atlas T1 by deformation field
+                 (apply_transforms, dict(input_img=path_image_ref, output_file=path_image_warped,
+                                         reference_img=path_image_ref,
+                                         transforms=[path_disp_img_inv], dim=self.dim)),
+                 # - 2) resample label map to T1
+                 (apply_transforms, dict(input_img=path_label_img, output_file=output_label_resampled,
+                                         reference_img=path_image_ref,
+                                         transforms=[], dim=self.dim)),
+                 # - 3) resample label map to T1 and warp by deformation field
+                 (apply_transforms, dict(input_img=path_label_img,
+                                         output_file=output_label_resampled_warped,
+                                         reference_img=path_image_ref,
+                                         transforms=[path_disp_img_inv], dim=self.dim))]
+        reg.run_concurrently(tasks)
 
     def _reconstruct_deformation_field(self, path_to_reference_image, path_to_deformed_image, path_to_warp_field,
                                        path_to_reduced_domain=None, plot=None):
@@ -956,20 +1133,21 @@ class ImageBasedOptimizationBase:
         # -- registration to obtain displacement field
         self.path_to_warped_image_deformed_to_ref = os.path.join(self.path_target_fields,
                                                                  'registered_image_deformed_to_reference')
-        reg.register_ants(path_to_reference_image, path_to_deformed_image, self.path_to_warped_image_deformed_to_ref,
-                          path_to_transform=path_to_warp_field, registration_type='Syn',
-                          image_ext='nii', fixed_mask=None, moving_mask=None, verbose=1, dim=self.dim)
+        self.registration.register_files(path_to_reference_image, path_to_deformed_image,
+                                         self.path_to_warped_image_deformed_to_ref,
+                                         path_to_transform=path_to_warp_field, registration_type='Syn',
+                                         image_ext='nii', fixed_mask=None, moving_mask=None, verbose=1, dim=self.dim)
 
         # -- read registration, convert to fenics function, save
         image_warp = sitk.ReadImage(path_to_warp_field)
-        self.logger.info("== Transforming image to fenics function ... this is very slow...")
-        f_img = dio.create_fenics_function_from_image(image_warp)
+        self.logger.info("== Transforming image to fenics function")
+        f_img = dio.image_to_function(image_warp, function_type='vector')
 
         if path_to_reduced_domain:
             f_img = self._map_field_into_reduced_domain(f_img, path_to_reduced_domain, degree=1, function_type='vector')
 
         dio.save_function_mesh(f_img, self.path_displacement_reconstructed)
-        if plot:
+        if plot and self.dim == 2:
             plott.show_img_seg_f(function=f_img, show=False,
                                  path=os.path.join(self.path_target_fields,
                                                    'displacement_from_registration_fenics.png'),
@@ -994,16 +1172,17 @@ class ImageBasedOptimizationBase:
         self.logger.info("path_to_meshfct_ref_frame:          %s" % path_to_meshfct_ref_frame)
 
         # warp patient data to reference
-        reg.ants_apply_transforms(input_img=path_to_deformed_img,
-                                  output_file=path_to_img_ref_frame,
-                                  reference_img=path_to_deformed_img,
-                                  transforms=[path_to_warp_field], dim=self.dim)
-
-        reg.ants_apply_transforms(input_img=path_to_deformed_labels,
-                                  output_file=path_to_labels_ref_frame,
-                                  reference_img=path_to_deformed_labels,
-                                  transforms=[path_to_warp_field], dim=self.dim,
-                                  interpolation='GenericLabel')
+        apply_transforms = self.registration.apply_transforms_files
+        tasks = [(apply_transforms, dict(input_img=path_to_deformed_img,
+                                         output_file=path_to_img_ref_frame,
+                                         reference_img=path_to_deformed_img,
+                                         transforms=[path_to_warp_field], dim=self.dim)),
+                 (apply_transforms, dict(input_img=path_to_deformed_labels,
+                                         output_file=path_to_labels_ref_frame,
+                                         reference_img=path_to_deformed_labels,
+                                         transforms=[path_to_warp_field], dim=self.dim,
+                                         interpolation='GenericLabel'))]
+        reg.run_concurrently(tasks)
 
         # create fields
         # -- load patient labels
@@ -1011,7 +1190,7 @@ class ImageBasedOptimizationBase:
         if self.dim == 2:
             f_img_label = dio.image2fct2D(image_label)
         else:
-            self.logger.error("cannot convert 3d image to fenics function")
+            f_img_label = dio.image_to_function(image_label, function_type='label')
         f_img_label.rename("label", "label")
 
         # -- load patient image
@@ -1019,11 +1198,11 @@ class ImageBasedOptimizationBase:
         if self.dim == 2:
             f_img = dio.image2fct2D(image)
         else:
-            self.logger.error("cannot convert 3d image to fenics function")
+            f_img = dio.image_to_function(image, mesh=f_img_label.function_space().mesh(), function_type='scalar')
         f_img.rename("imgvalue", "label")
 
         # -- plot
-        if plot:
+        if plot and self.dim == 2:
             plott.show_img_seg_f(image=image, segmentation=image_label, show=True,
                                  path=os.path.join(self.path_target_fields, 'label_from_sitk_image_in_ref_frame.png'))
 
@@ -1082,13 +1261,11 @@ class ImageBasedOptimizationBase:
         self.logger.info("Mapping field into reduced domain:")
         self.logger.info(" - field: '%s'" % field_in)
         self.logger.info(" - path to reduced domain: '%s'" % path_to_reduced_domain)
-        mesh_reduced, subdomains_reduced, boundaries_reduced = dio.read_mesh_hdf5(path_to_reduced_domain)
-        if function_type == 'function':
-            funspace_reduced = fenics.FunctionSpace(mesh_reduced, 'Lagrange', degree)
-        elif function_type == 'vector':
-            funspace_reduced = fenics.VectorFunctionSpace(mesh_reduced, 'Lagrange', degree)
-        else:
+        if function_type not in ['function', 'vector']:
             self.logger.error("Don't understand function_type %s'" % function_type)
+        # same function space instance for each domain, type and degree, so that transfer operators are reused
+        funspace_reduced = dio.read_functionspace_hdf5(path_to_reduced_domain, function_type=function_type,
+                                                       degree=degree)
         field_reduced = self.interpolate_non_matching(field_in, funspace_reduced)
         return field_reduced
 
@@ -1248,7 +1425,9 @@ class ImageBasedOptimizationBase:
             summary.update(item)
         summary['optimization_method'] = self.params_optimization['method']
         summary['optimization_tol'] = self.params_optimization['tol']
-        opt_df = pd.read_pickle(self.path_optimization_progress_pkl)
+        opt_df = self.get_results_store().read_optimizer_iterations(self.case_id)
+        if opt_df is None:
+            opt_df = pd.read_pickle(self.path_optimization_progress_pkl)
         J_start = opt_df.iloc[0].J
         J_end = opt_df.iloc[-1].J
         time_delta = opt_df.iloc[-1].datetime - opt_df.iloc[0].datetime
@@ -1256,8 +1435,11 @@ class ImageBasedOptimizationBase:
         summary['objective_function_end'] = J_end
         summary['total_time_optimization_seconds'] = time_delta.total_seconds()
         summary['number_iterations_optimization'] = opt_df.shape[0]
-        with open(self.path_to_summary, 'wb') as handle:
-            pickle.dump(summary, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.get_results_store().write_summary(self.case_id, summary)
+        if self.export_pickle:
+            with open(self.path_to_summary, 'wb') as handle:
+                pickle.dump(summary, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        return summary
 
     def compute_volume_thresholded(self):
         vol_dict = {'volume_threshold_T2_target': self.path_conc_T2,
@@ -1305,35 +1487,36 @@ class ImageBasedOptimizationBase:
     def post_process(self, sim_list, threshold_list):
         self.compute_volume_thresholded()
         self.compute_com_all()
-        # compute volumes / coms for each time step
+        # compute volumes / coms for each time step, all measures and thresholds in single pass per simulation
+        metrics_dict = {}
+        for problem_type in sim_list:
+            self.logger.info("Trying to compute metrics for '%s' simulation with concentration thresholds '%s'" % (
+                problem_type, threshold_list))
+            self.logger.info("-- This computation is performed in the reference configuration, no deformation! --")
+            metrics_dict[problem_type] = self.compute_metrics_for_each_time_step(threshold_list=threshold_list,
+                                                                                 problem_type=problem_type)
         for measure in ['volume', 'com']:
             results_df = pd.DataFrame()
             for problem_type, threshold in product(
                     *[sim_list, threshold_list]):
-                self.logger.info("Trying to compute '%s' for '%s' simulation with concentration threshold '%.02f'" % (
-                    measure, problem_type, threshold))
-                self.logger.info("-- This computation is performed in the reference configuration, no deformation! --")
-                results_tmp = self.compute_from_conc_for_each_time_step(threshold=threshold, problem_type=problem_type,
-                                                                        computation=measure)
+                if metrics_dict[problem_type] is None:
+                    continue
+                results_tmp = self._metrics_to_wide(metrics_dict[problem_type], threshold, computation=measure)
                 print(results_tmp)
-                if results_tmp is not None:
-                    new_col_names = [
-                        "_".join([problem_type, measure, str(threshold), name.lower()]) if name != 'sim_time_step'
-                        else name.lower() for name in results_tmp.columns]
-                    results_tmp.columns = new_col_names
-                    if results_df.empty:
-                        results_df = results_tmp
-                    else:
-                        results_df = pd.merge(results_df, results_tmp, how='left', on='sim_time_step')
+                new_col_names = [
+                    "_".join([problem_type, measure, str(threshold), name.lower()]) if name != 'sim_time_step'
+                    else name.lower() for name in results_tmp.columns]
+                results_tmp.columns = new_col_names
+                if results_df.empty:
+                    results_df = results_tmp
+                elif not set(new_col_names).issubset(results_df.columns):
+                    results_df = pd.merge(results_df, results_tmp, how='left', on='sim_time_step')
             save_path = os.path.join(self.base_dir, measure + '.pkl')
             results_df.to_pickle(save_path)
             save_path = os.path.join(self.base_dir, measure + '.xls')
             results_df.to_excel(save_path)
 
-    def compute_from_conc_for_each_time_step(self, threshold=None, problem_type='forward', computation='volume'):
-        if not threshold:
-            threshold = self.conc_threshold_levels['T2']
-
+    def _get_sim_for_problem_type(self, problem_type):
         if problem_type == 'forward':
             sim_name = 'sim_forward'
             base_path = self.path_forward_sim
@@ -1345,47 +1528,63 @@ class ImageBasedOptimizationBase:
             base_path = self.path_optimized_sim
         else:
             self.logger.error("Non existing 'problem type'")
+            return None, None, None
+        return sim_name, getattr(self, sim_name, None), base_path
 
-        if hasattr(self, sim_name):
-            sim = getattr(self, sim_name)
-            results = pd.DataFrame()
-            rec_steps = sim.results.get_recording_steps()
-            self.logger.info("Recording steps: %s" % rec_steps)
-            for step in rec_steps:
-                if step % 10 == 0:
-                    self.logger.info("Computing '%s' for '%s' problem, step %03d" % (computation, problem_type, step))
-                conc = sim.results.get_solution_function(subspace_id=1, recording_step=step)
-                q = fenics.conditional(fenics.ge(conc, threshold), 1, 0)
-                q_fun = sim.functionspace.project_over_space(q, subspace_id=1)
-                # results
-                results_dict = {}
-                results_dict['sim_time_step'] = step
-                if computation == 'volume':
-                    results_dict['all'] = self.compute_volume(q_fun, sim.subdomains.dx)
-                elif computation == 'com':
-                    com = self.compute_com(q_fun, sim.subdomains.dx)
-                    for i, coord in enumerate(com):
-                        results_dict["%s_%i" % ('all', i)] = coord
-                else:
-                    self.logger.warning("Cannot compute '%s' -- underfined" % computation)
-                # for all subdomains
-                for subdomain_id, subdomain_name in sim.subdomains.tissue_id_name_map.items():
-                    if computation == 'volume':
-                        results_dict[subdomain_name] = self.compute_volume(q_fun, sim.subdomains.dx(subdomain_id))
-                    elif computation == 'com':
-                        com = self.compute_com(q_fun, sim.subdomains.dx(subdomain_id))
-                        for i, coord in enumerate(com):
-                            results_dict["%s_%i" % (subdomain_name, i)] = coord
-                    else:
-                        self.logger.warning("Cannot compute '%s' -- underfined" % computation)
-
-                results = results.append(results_dict, ignore_index=True)
-
-            # new_col_names = [ "_".join([problem_type, 'volume', str(threshold), name.lower()]) if name!='sim_time_step'
-            #                  else name.lower() for name in volumes.columns]
+    def compute_metrics_for_each_time_step(self, threshold_list=None, problem_type='forward'):
+        """
+        Computes volume and center of mass of thresholded concentration field for all recording steps, thresholds and
+        subdomains, see `FieldMetrics`.
+        :return: tidy pandas DataFrame with columns
+                 'sim_time_step', 'threshold', 'subdomain', 'volume', 'com_0', ..., 'com_<dim-1>'
+        """
+        if not threshold_list:
+            threshold_list = [self.conc_threshold_levels['T2']]
+        sim_name, sim, base_path = self._get_sim_for_problem_type(problem_type)
+        if sim is None:
+            self.logger.warning("Cannot compute metrics for '%s'. No such simulation instance names '%s'." % (
+                problem_type, sim_name))
+            return None
+        metrics = FieldMetrics(sim.functionspace.get_functionspace(subspace_id=1), dx=sim.subdomains.dx,
+                               tissue_id_name_map=sim.subdomains.tissue_id_name_map)
+        self.logger.info("Recording steps: %s" % sim.results.get_recording_steps())
+        results = metrics.compute_from_results(sim.results, sorted(set(threshold_list)), subspace_id=1)
+        results['subdomain'] = results['subdomain'].str.lower()
+        self.get_results_store().write_step_metrics(self.case_id, problem_type, results)
+        if self.export_pickle:
+            save_path = os.path.join(base_path, 'metrics.pkl')
+            results.to_pickle(save_path)
+            self.logger.info("Saving metrics dataframe to '%s'" % (save_path))
+        return results
 
-            results.columns = [name.lower() for name in results.columns]
+    @staticmethod
+    def _metrics_to_wide(metrics, threshold, computation='volume'):
+        """
+        Converts tidy metrics DataFrame into one row per time step for single threshold and computation.
+        Columns are 'sim_time_step' and '<subdomain>' for volume, or '<subdomain>_<i>' for center of mass.
+        """
+        metrics_thr = metrics[metrics.threshold == threshold].set_index(['sim_time_step', 'subdomain'])
+        if computation == 'volume':
+            results = metrics_thr['volume'].unstack('subdomain')
+        elif computation == 'com':
+            com_columns = [name for name in metrics.columns if name.startswith('com_')]
+            results = metrics_thr[com_columns].unstack('subdomain')
+            results.columns = ["%s_%s" % (subdomain, com.replace('com_', '')) for com, subdomain in results.columns]
+        else:
+            return None
+        results.columns.name = None
+        return results.reset_index()
 
+    def compute_from_conc_for_each_time_step(self, threshold=None, problem_type='forward', computation='volume'):
+        if not threshold:
+            threshold = self.conc_threshold_levels['T2']
+        sim_name, sim, base_path = self._get_sim_for_problem_type(problem_type)
+        metrics = self.compute_metrics_for_each_time_step(threshold_list=[threshold], problem_type=problem_type)
+        if metrics is not None:
+            results = self._metrics_to_wide(metrics, threshold, computation=computation)
+            if results is None:
+                self.logger.warning("Cannot compute '%s' -- underfined" % computation)
+                return None
             save_name = "_".join([computation, str(threshold)]) + '.pkl'
             save_path = os.path.join(base_path, save_name)
             results.to_pickle(save_path)
@@ -1396,37 +1595,120 @@ class ImageBasedOptimizationBase:
             self.logger.info("Saving '%s' dataframe to '%s'" % (computation, save_path))
             return results
 
-        else:
-            self.logger.warning("Cannot compute '%s' for '%s'. No such simulation instance names '%s'." % (
-                computation, problem_type, sim_name))
-
     @staticmethod
     def thresh(f, thresh):
         smooth_f = 0.01
         f_thresh = 0.5 * (tanh((f - thresh) / smooth_f) + 1)
         return f_thresh
 
-    @staticmethod
-    def interpolate_non_matching(source_function, target_funspace):
+    # LRU cache of size config.OPERATOR_CACHE_SIZE
+    # {(source function space id, target function space id) : (source space, target space, transfer matrix)}
+    _transfer_operator_cache = collections.OrderedDict()
+
+    @classmethod
+    def get_transfer_operator(cls, source_funspace, target_funspace):
+        """
+        Assembles sparse interpolation matrix from source_funspace to target_funspace once per pair of spaces.
+        :return: scipy.sparse matrix n_target_dofs x n_source_dofs, None if not supported for these spaces
+        """
+        key = (source_funspace.id(), target_funspace.id())
+        if key in cls._transfer_operator_cache:
+            cls._transfer_operator_cache.move_to_end(key)
+        else:
+            matrix = dio.create_transfer_matrix(source_funspace, target_funspace)
+            cls._transfer_operator_cache[key] = (source_funspace, target_funspace, matrix)
+            while len(cls._transfer_operator_cache) > max(config.OPERATOR_CACHE_SIZE, 1):
+                cls._transfer_operator_cache.popitem(last=False)
+        return cls._transfer_operator_cache[key][2]
+
+    @classmethod
+    def clear_transfer_operator_cache(cls):
+        cls._transfer_operator_cache = collections.OrderedDict()
+
+    @classmethod
+    def interpolate_non_matching(cls, source_function, target_funspace):
         function_new = fenics.Function(target_funspace)
-        fenics.LagrangeInterpolator.interpolate(function_new, source_function)
+        operator = cls.get_transfer_operator(source_function.function_space(), target_funspace)
+        if operator is None:
+            fenics.LagrangeInterpolator.interpolate(function_new, source_function)
+        else:
+            dio.assign_vector_to_function(function_new, operator.dot(source_function.vector().get_local()))
         return function_new
 
-    @staticmethod
-    def compute_com(fenics_scalar_field, domain=None):
-        dim_geo = fenics_scalar_field.function_space().mesh().geometry().dim()
-        com = []
+    @classmethod
+    def interpolate_vectors_non_matching(cls, vectors, source_funspace, target_funspace):
+        """
+        Interpolates dof vectors, e.g. all steps of a time series, from source_funspace to target_funspace.
+        :param vectors: array n_vectors x n_source_dofs
+        :return: array n_vectors x n_target_dofs
+        """
+        operator = cls.get_transfer_operator(source_funspace, target_funspace)
+        if operator is None:
+            source_function = fenics.Function(source_funspace)
+            vectors_new = []
+            for vector in vectors:
+                dio.assign_vector_to_function(source_function, vector)
+                vectors_new.append(cls.interpolate_non_matching(source_function, target_funspace).vector().get_local())
+            return np.array(vectors_new)
+        return operator.dot(np.asarray(vectors).T).T
+
+    # LRU cache of size config.OPERATOR_CACHE_SIZE
+    # {(function space id, subdomain id, subdomain data id) : (function space, subdomain data, moment vectors)}
+    _moment_vectors_cache = collections.OrderedDict()
+
+    @classmethod
+    def get_moment_vectors(cls, functionspace, domain=None):
+        """
+        Assembles vectors b_0 = int(v dx), b_i = int(x_i v dx) for test function v of `functionspace` once per
+        function space and measure.
+        Integral and first moments of any function f on this space are then given by dot products with f's dof vector,
+        summed over processes.
+        :return: array (1 + dim) x n_local_dofs
+        """
         if domain is None:
             domain = fenics.dx
-        volume = fenics.assemble(fenics_scalar_field * domain)
-        for dim in range(dim_geo):
-            coord_expr = fenics.Expression('x[%i]' % dim, degree=1)
-            coord_int = fenics.assemble(coord_expr * fenics_scalar_field * domain)
-            if volume > 0:
-                coord = coord_int / volume
-            else:
-                coord = np.nan
-            com.append(coord)
+        subdomain_data = domain.subdomain_data()
+        key = (functionspace.id(), str(domain.subdomain_id()), id(subdomain_data) if subdomain_data is not None else None)
+        entry = cls._moment_vectors_cache.get(key)
+        # ids may be reused after garbage collection, cache entries keep their objects alive for comparison
+        if entry is not None and entry[0] is functionspace and entry[1] is subdomain_data:
+            cls._moment_vectors_cache.move_to_end(key)
+        else:
+            mesh = functionspace.mesh()
+            v = fenics.TestFunction(functionspace)
+            x = fenics.SpatialCoordinate(mesh)
+            forms = [v * domain] + [x[i] * v * domain for i in range(mesh.geometry().dim())]
+            vectors = np.array([fenics.assemble(form).get_local() for form in forms])
+            entry = (functionspace, subdomain_data, vectors)
+            cls._moment_vectors_cache[key] = entry
+            cls._moment_vectors_cache.move_to_end(key)
+            while len(cls._moment_vectors_cache) > max(config.OPERATOR_CACHE_SIZE, 1):
+                cls._moment_vectors_cache.popitem(last=False)
+        return entry[2]
+
+    @classmethod
+    def clear_moment_vectors_cache(cls):
+        cls._moment_vectors_cache = collections.OrderedDict()
+
+    @classmethod
+    def compute_moments(cls, fenics_scalar_field, domain=None):
+        """
+        Computes volume (integral) and first moments of scalar function.
+        :return: volume, array of first moments
+        """
+        functionspace = fenics_scalar_field.function_space()
+        vectors = cls.get_moment_vectors(functionspace, domain)
+        moments_local = vectors.dot(fenics_scalar_field.vector().get_local())
+        moments = dio.mpi_sum_array(functionspace.mesh().mpi_comm(), moments_local)
+        return moments[0], moments[1:]
+
+    @classmethod
+    def compute_com(cls, fenics_scalar_field, domain=None):
+        volume, moments = cls.compute_moments(fenics_scalar_field, domain)
+        if volume > 0:
+            com = list(moments / volume)
+        else:
+            com = [np.nan] * len(moments)
         return com
 
     @staticmethod
@@ -1466,7 +1748,7 @@ class ImageBasedOptimizationBase:
         params_flat[prefix + '_seed_position_' + 'y'] = params_dict['seed_position'][1]
         return params_flat
 
-    @staticmethod
-    def compute_volume(conc_fun, domain):
-        vol = fenics.assemble(conc_fun * domain)
+    @classmethod
+    def compute_volume(cls, conc_fun, domain):
+        vol, _ = cls.compute_moments(conc_fun, domain)
         return vol
@@ -6,17 +6,23 @@ config.USE_ADJOINT = True
 
 from glimslib import fenics_local as fenics
 from glimslib.optimization_workflow.image_based_optimization import ImageBasedOptimizationBase
+from glimslib.optimization_workflow.stage_manifest import pipeline_stage
 import glimslib.utils.data_io as dio
 from glimslib.visualisation import plotting as plott
 
 
 class ImageBasedOptimizationAtlas(ImageBasedOptimizationBase):
 
+    stage_outputs = dict(ImageBasedOptimizationBase.stage_outputs)
+    stage_outputs['target_fields'] = stage_outputs['target_fields'] + ['path_forward_disp_reconstructed']
+
+    @pipeline_stage('domain_prep')
     def prepare_domain(self, plot=True):
         self.path_to_domain_image_3d = self.path_to_image_atlas_orig
         self.path_to_domain_labels_3d = self.path_to_labels_atlas_orig
         self.mesh_domain(plot=plot)
 
+    @pipeline_stage('target_fields')
     def create_target_fields(self):
         # Deformation
 
@@ -139,7 +145,7 @@ class ImageBasedOptimizationAtlas(ImageBasedOptimizationBase):
     def write_analysis_summary(self, add_info_list=[]):
         add_info_list = [self.compute_param_rel_errors(),
                          self.flatten_params(self.params_forward, 'forward')]
-        super().write_analysis_summary(add_info_list=add_info_list)
+        return super().write_analysis_summary(add_info_list=add_info_list)
 
     def compute_com_all(self, conc_dict=None):
         conc_dict = {'forward': self.path_forward_conc}
@@ -7,20 +7,46 @@ from glimslib import config
 config.USE_ADJOINT = True
 
 from glimslib.optimization_workflow.image_based_optimization import ImageBasedOptimizationBase
-import glimslib.utils.image_registration_utils as reg
+from glimslib.optimization_workflow.stage_manifest import pipeline_stage
 from glimslib.visualisation import plotting as plott
 
 
 class ImageBasedOptimizationPatient(ImageBasedOptimizationBase):
 
+    # target fields are derived from patient images, not from forward simulation
+    stage_dependencies = dict(ImageBasedOptimizationBase.stage_dependencies)
+    stage_dependencies['target_fields'] = ['domain_prep']
+
+    stage_params = dict(ImageBasedOptimizationBase.stage_params)
+    stage_params['domain_prep'] = stage_params['domain_prep'] + ['path_to_image_patient_orig',
+                                                                 'path_to_labels_patient_orig']
+    stage_params['target_fields'] = stage_params['target_fields'] + ['path_to_image_patient_orig',
+                                                                     'path_to_labels_patient_orig',
+                                                                     'image_z_slice', 'dim']
+
+    stage_outputs = dict(ImageBasedOptimizationBase.stage_outputs)
+    stage_outputs['domain_prep'] = stage_outputs['domain_prep'] + ['path_to_atlas_img_patient_specific',
+                                                                   'path_to_atlas_labels_patient_specific',
+                                                                   'path_to_reg_affine']
+    stage_outputs['target_fields'] = stage_outputs['target_fields'] + ['path_to_image_patient_orig_2d',
+                                                                       'path_to_labels_patient_orig_2d',
+                                                                       'path_to_warp_field',
+                                                                       'path_to_img_ref_frame',
+                                                                       'path_to_labels_ref_frame',
+                                                                       'path_to_img_ref_frame_fct',
+                                                                       'path_to_labels_ref_frame_fct',
+                                                                       'path_to_meshfct_ref_frame',
+                                                                       'path_to_image_ref_frame',
+                                                                       'path_conc_from_seg']
+
     def __init__(self, base_dir,
                  path_to_labels_atlas=None, path_to_image_atlas=None,
                  path_to_labels_patient=None, path_to_image_patient=None,
-                 image_z_slice=None, plot=False):
+                 image_z_slice=None, plot=False, **kwargs):
         super().__init__(base_dir=base_dir,
                          path_to_labels_atlas=path_to_labels_atlas,
                          path_to_image_atlas=path_to_image_atlas,
-                         image_z_slice=image_z_slice, plot=plot)
+                         image_z_slice=image_z_slice, plot=plot, **kwargs)
         if path_to_image_patient and path_to_labels_patient:
             self.path_to_image_patient_orig = path_to_image_patient
             self.path_to_labels_patient_orig = path_to_labels_patient
@@ -44,21 +70,22 @@ class ImageBasedOptimizationPatient(ImageBasedOptimizationBase):
         self.logger.info("path_atlas_labels_reg: %s" % path_atlas_labels_reg)
 
         if os.path.exists(path_atlas_img):
-            reg.register_ants(fixed_img=path_patient_img,
-                              moving_img=path_atlas_img,
-                              output_prefix='.'.join(path_atlas_img_reg.split('.')[:-1]),
-                              path_to_transform=path_trafo,
-                              registration_type='Affine',
-                              image_ext=path_atlas_img_reg.split('.')[-1],
-                              fixed_mask=None, moving_mask=None, verbose=1, dim=3)
+            self.registration.register_files(fixed_img=path_patient_img,
+                                             moving_img=path_atlas_img,
+                                             output_prefix='.'.join(path_atlas_img_reg.split('.')[:-1]),
+                                             path_to_transform=path_trafo,
+                                             registration_type='Affine',
+                                             image_ext=path_atlas_img_reg.split('.')[-1],
+                                             fixed_mask=None, moving_mask=None, verbose=1, dim=3)
 
         if os.path.exists(path_atlas_labels) and os.path.exists(path_trafo):
-            reg.ants_apply_transforms(input_img=path_atlas_labels,
-                                      reference_img=path_atlas_img_reg,
-                                      output_file=path_atlas_labels_reg,
-                                      transforms=[path_trafo],
-                                      dim=3, interpolation='GenericLabel')
+            self.registration.apply_transforms_files(input_img=path_atlas_labels,
+                                                     reference_img=path_atlas_img_reg,
+                                                     output_file=path_atlas_labels_reg,
+                                                     transforms=[path_trafo],
+                                                     dim=3, interpolation='GenericLabel')
 
+    @pipeline_stage('domain_prep')
     def prepare_domain(self, plot=True):
 
         self.path_to_atlas_img_patient_specific = self.data.create_image_path(
@@ -91,6 +118,7 @@ class ImageBasedOptimizationPatient(ImageBasedOptimizationBase):
         self.logger.info("path_to_domain_labels_3d:  %s" % self.path_to_domain_labels_3d)
         self.mesh_domain(plot=plot)
 
+    @pipeline_stage('target_fields')
     def create_target_fields(self, plot=True, T1_label=5, T2_label=6):
 
         if not plot:
@@ -1,41 +1,174 @@
 import json
 import os
-
-import grabbit as gb
+import re
 
 import glimslib.optimization_workflow.config as config
 import glimslib.utils.file_utils as fu
 
 
+class PathPattern:
+    """
+    Path pattern in grabbit syntax, e.g. '[{processing}/][{datasource}][_{datatype}][.{extension}]', compiled once.
+    - '{name}' is replaced by the value of entity 'name'
+    - '{name<a|b>|default}' restricts values to the options 'a' and 'b' and sets default for undefined entity
+    - '[...]' marks optional sections, which are omitted if any of their entities is undefined or not valid;
+      the whole pattern does not apply if an entity outside optional sections is undefined or not valid
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.sections = []  # [(optional, [literal string | (name, valid options, default)])]
+        position = 0
+        for match in re.finditer(r'\[(.*?)\]', pattern):
+            if match.start() > position:
+                self.sections.append((False, self._parse_section(pattern[position:match.start()])))
+            self.sections.append((True, self._parse_section(match.group(1))))
+            position = match.end()
+        if position < len(pattern):
+            self.sections.append((False, self._parse_section(pattern[position:])))
+
+    @staticmethod
+    def _parse_section(section):
+        parts = []
+        position = 0
+        for match in re.finditer(r'\{(.*?)\}', section):
+            if match.start() > position:
+                parts.append(section[position:match.start()])
+            name, valid, default = re.match(r'([^|<]+)(<.*?>)?(\|.*)?', match.group(1)).groups()
+            valid = valid[1:-1].split('|') if valid is not None else None
+            default = default[1:] if default is not None else None
+            parts.append((name, valid, default))
+            position = match.end()
+        if position < len(section):
+            parts.append(section[position:])
+        return parts
+
+    @staticmethod
+    def _render_section(parts, entities):
+        rendered = []
+        for part in parts:
+            if isinstance(part, str):
+                rendered.append(part)
+                continue
+            name, valid, default = part
+            value = entities.get(name)
+            if value is None:
+                value = default
+            if value is None:
+                return None
+            if valid is not None and str(value) not in valid:
+                return None
+            rendered.append(str(value))
+        return ''.join(rendered)
+
+    def entity_names(self):
+        return [part[0] for optional, parts in self.sections for part in parts if not isinstance(part, str)]
+
+    def build(self, entities, strict=False):
+        """
+        :param entities: dict {entity name: value}, entities with value None are treated as undefined
+        :param strict: if True, returns None if entities contains entities that are not part of the pattern
+        :return: path string or None if a mandatory entity is undefined or not valid
+        """
+        if strict and set(name for name, value in entities.items() if value is not None) - set(self.entity_names()):
+            return None
+        path = []
+        for optional, parts in self.sections:
+            rendered = self._render_section(parts, entities)
+            if rendered is None:
+                if not optional:
+                    return None
+                rendered = ''
+            path.append(rendered)
+        return ''.join(path)
+
+
+class PathIndex:
+    """
+    Lazy index of files below data_root, with entities extracted by the entity patterns of the path config.
+    The directory tree is only scanned on first query or on refresh.
+    """
+
+    def __init__(self, data_root, entities):
+        self.data_root = data_root
+        self.entity_patterns = {entity['name']: re.compile(entity['pattern']) for entity in entities}
+        self._files = None
+
+    def refresh(self):
+        self._files = {}
+        for root, dirs, files in os.walk(self.data_root):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                self._files[path] = self.extract_entities(path)
+
+    def extract_entities(self, path):
+        entities = {}
+        for name, pattern in self.entity_patterns.items():
+            match = pattern.search(path)
+            if match:
+                entities[name] = match.group(1)
+        return entities
+
+    def get(self, refresh=False, **entities):
+        """
+        :return: sorted list of paths whose entities match all given entities
+        """
+        if self._files is None or refresh:
+            self.refresh()
+        return sorted(path for path, file_entities in self._files.items()
+                      if all(file_entities.get(name) == str(value) for name, value in entities.items()))
+
+
 class PathIO:
 
+    # {path to config file: (config dict, [PathPattern])}
+    _path_config_cache = {}
+
     def __init__(self, data_root, path_to_bids_config=None):
         if path_to_bids_config:
             self.path_to_bids_config = path_to_bids_config
         else:
             self.path_to_bids_config = config.path_to_bids_config
-        # -- read file to extract path patterns
-        with open(self.path_to_bids_config) as json_data:
-            self.bids_config = json.load(json_data)
+        # -- read file to extract path patterns, compiled once per config file
+        self.bids_config, self.path_patterns = self.read_path_config(self.path_to_bids_config)
         # -- directory to which all other dirs are relative
         self.data_root = data_root
-        # -- initialize bids layout for reading
         fu.ensure_dir_exists(data_root)
-        self.init_bids_layout()
-        # -- attach path generator instance
-        # self.path_generator = PathGenerator(self.data_root)
+        self._index = None
 
-    def init_bids_layout(self):
-        self.bids_layout = gb.Layout([(self.data_root, self.path_to_bids_config)])
-        # -- the attribute 'bids_layout.path_patterns' should be populated, but is not ...
-        #   we do this manually:
-        self.bids_layout.path_patterns = self.bids_config.get('default_path_patterns')
+    @classmethod
+    def read_path_config(cls, path_to_config):
+        if path_to_config not in cls._path_config_cache:
+            with open(path_to_config) as json_data:
+                path_config = json.load(json_data)
+            path_patterns = [PathPattern(pattern) for pattern in path_config.get('default_path_patterns', [])]
+            cls._path_config_cache[path_to_config] = (path_config, path_patterns)
+        return cls._path_config_cache[path_to_config]
 
-    def create_path(self, path_pattern_list=None, abs_path=True, create=True, with_ext=True, **kwargs):
+    @property
+    def index(self):
+        """
+        Lazy file index for queries, see `PathIndex`.
+        """
+        if self._index is None:
+            self._index = PathIndex(self.data_root, self.bids_config.get('entities', []))
+        return self._index
+
+    def build_path(self, entities, path_pattern_list=None, strict=False):
         if path_pattern_list:
-            path = self.bids_layout.build_path(kwargs, path_pattern_list)
+            if isinstance(path_pattern_list, str):
+                path_pattern_list = [path_pattern_list]
+            path_patterns = [PathPattern(pattern) for pattern in path_pattern_list]
         else:
-            path = self.bids_layout.build_path(kwargs)
+            path_patterns = self.path_patterns
+        for path_pattern in path_patterns:
+            path = path_pattern.build(entities, strict=strict)
+            if path:
+                return path
+        return None
+
+    def create_path(self, path_pattern_list=None, abs_path=True, create=True, with_ext=True, **kwargs):
+        path = self.build_path(kwargs, path_pattern_list)
         if abs_path:
             path = os.path.join(self.data_root, path)
         if create:
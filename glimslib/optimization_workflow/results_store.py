@@ -0,0 +1,331 @@
+"""
+Structured store for study state, measures and summaries, backed by a single SQLite database.
+
+All writes for one case and one kind of result are executed in a single transaction, replacing previous entries.
+The database may be shared by multiple processes, e.g. by all cases of a study.
+"""
+
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from numbers import Number
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT PRIMARY KEY,
+    base_dir TEXT,
+    case_class TEXT,
+    datetime_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS run_params (
+    case_id TEXT NOT NULL,
+    problem_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    value_json TEXT,
+    PRIMARY KEY (case_id, problem_type, name)
+);
+CREATE INDEX IF NOT EXISTS idx_run_params_name ON run_params (problem_type, name);
+CREATE TABLE IF NOT EXISTS measures (
+    case_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    value_json TEXT,
+    PRIMARY KEY (case_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_measures_name ON measures (name);
+CREATE TABLE IF NOT EXISTS summary (
+    case_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    value_json TEXT,
+    PRIMARY KEY (case_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_summary_name ON summary (name);
+CREATE TABLE IF NOT EXISTS optimizer_iterations (
+    case_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    datetime TEXT,
+    PRIMARY KEY (case_id, iteration, name)
+);
+CREATE TABLE IF NOT EXISTS step_metrics (
+    case_id TEXT NOT NULL,
+    problem_type TEXT NOT NULL,
+    sim_time_step INTEGER NOT NULL,
+    threshold REAL NOT NULL,
+    subdomain TEXT NOT NULL,
+    volume REAL,
+    com_0 REAL,
+    com_1 REAL,
+    com_2 REAL,
+    PRIMARY KEY (case_id, problem_type, sim_time_step, threshold, subdomain)
+);
+CREATE INDEX IF NOT EXISTS idx_step_metrics_query ON step_metrics (problem_type, threshold, subdomain);
+"""
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    return json.dumps(value, default=str)
+
+
+def _split_value(value):
+    """
+    Returns (numeric value, json representation); numeric value is None for non-scalar or non-numeric values.
+    """
+    if isinstance(value, (Number, np.number)) and not isinstance(value, (bool, np.bool_)):
+        value_num = float(value)
+    else:
+        value_num = None
+    return value_num, _to_json(value)
+
+
+def flatten_dict(params_dict, separator='.'):
+    """
+    Flattens nested dict, keys of nested entries are joined by separator.
+    """
+    flat = {}
+    for key, value in params_dict.items():
+        if isinstance(value, dict) and value:
+            for sub_key, sub_value in flatten_dict(value, separator).items():
+                flat[str(key) + separator + sub_key] = sub_value
+        else:
+            flat[str(key)] = value
+    return flat
+
+
+def unflatten_dict(flat_dict, separator='.'):
+    params_dict = {}
+    for key, value in flat_dict.items():
+        keys = key.split(separator)
+        current = params_dict
+        for sub_key in keys[:-1]:
+            current = current.setdefault(sub_key, {})
+        current[keys[-1]] = value
+    return params_dict
+
+
+class ResultsStore:
+    """
+    SQLite-backed results store with tables
+        - cases: case_id, base_dir, case_class
+        - run_params: (case_id, problem_type, name) -> value; nested parameter names joined by '.'
+        - measures, summary: (case_id, name) -> value
+        - optimizer_iterations: (case_id, iteration, name) -> value
+        - step_metrics: (case_id, problem_type, sim_time_step, threshold, subdomain) -> volume, com_0, com_1, com_2
+    Numeric values are stored in column 'value', all values are also stored in json representation ('value_json').
+    """
+
+    def __init__(self, path_to_db, timeout=60):
+        """
+        :param path_to_db: path to SQLite database file, created if it does not exist
+        :param timeout: time in seconds to wait for database lock held by other processes
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path_to_db = path_to_db
+        self.timeout = timeout
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path_to_db, timeout=self.timeout)
+
+    def _execute_transaction(self, statements):
+        """
+        Executes list of (sql, parameter list) in single transaction.
+        Parameter list is executed via `executemany`.
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                for sql, params in statements:
+                    connection.executemany(sql, params)
+        finally:
+            connection.close()
+
+    def query(self, sql, params=()):
+        """
+        Executes sql query and returns result as pandas.DataFrame.
+        """
+        connection = self._connect()
+        try:
+            return pd.read_sql_query(sql, connection, params=params)
+        finally:
+            connection.close()
+
+    # == Writing
+
+    def write_case(self, case_id, base_dir=None, case_class=None):
+        self._execute_transaction(
+            [("INSERT OR REPLACE INTO cases (case_id, base_dir, case_class, datetime_updated) VALUES (?, ?, ?, ?)",
+              [(case_id, base_dir, case_class, datetime.now().isoformat())])])
+
+    def write_run_params(self, case_id, problem_type, params_dict):
+        rows = [(case_id, problem_type, name) + _split_value(value)
+                for name, value in flatten_dict(params_dict).items()]
+        self._execute_transaction(
+            [("DELETE FROM run_params WHERE case_id = ? AND problem_type = ?", [(case_id, problem_type)]),
+             ("INSERT INTO run_params (case_id, problem_type, name, value, value_json) VALUES (?, ?, ?, ?, ?)",
+              rows)])
+
+    def _write_key_values(self, table, case_id, values_dict):
+        rows = [(case_id, str(name)) + _split_value(value) for name, value in values_dict.items()]
+        self._execute_transaction(
+            [("DELETE FROM %s WHERE case_id = ?" % table, [(case_id,)]),
+             ("INSERT INTO %s (case_id, name, value, value_json) VALUES (?, ?, ?, ?)" % table, rows)])
+
+    def write_measures(self, case_id, measures):
+        self._write_key_values('measures', case_id, measures)
+
+    def write_summary(self, case_id, summary):
+        self._write_key_values('summary', case_id, summary)
+
+    def write_optimizer_iterations(self, case_id, opt_df):
+        """
+        :param opt_df: pandas.DataFrame with one row per iteration, as created by `create_opt_progress_df`;
+                       optional column 'datetime'
+        """
+        rows = []
+        for iteration, (_, row) in enumerate(opt_df.iterrows()):
+            dt = row['datetime'] if 'datetime' in row.index else None
+            dt = None if dt is None or pd.isnull(dt) else str(dt)
+            for name, value in row.items():
+                if name == 'datetime':
+                    continue
+                value = None if pd.isnull(value) else float(value)
+                rows.append((case_id, iteration, str(name), value, dt))
+        self._execute_transaction(
+            [("DELETE FROM optimizer_iterations WHERE case_id = ?", [(case_id,)]),
+             ("INSERT INTO optimizer_iterations (case_id, iteration, name, value, datetime) VALUES (?, ?, ?, ?, ?)",
+              rows)])
+
+    def write_step_metrics(self, case_id, problem_type, metrics):
+        """
+        :param metrics: tidy pandas.DataFrame as returned by `FieldMetrics.compute`
+        """
+        rows = []
+        for record in metrics.to_dict(orient='records'):
+            coms = [record.get('com_%i' % i) for i in range(3)]
+            coms = [None if com is None or pd.isnull(com) else float(com) for com in coms]
+            rows.append((case_id, problem_type, int(record['sim_time_step']), float(record['threshold']),
+                         str(record['subdomain']), float(record['volume']), *coms))
+        self._execute_transaction(
+            [("DELETE FROM step_metrics WHERE case_id = ? AND problem_type = ?", [(case_id, problem_type)]),
+             ("INSERT INTO step_metrics (case_id, problem_type, sim_time_step, threshold, subdomain, "
+              "volume, com_0, com_1, com_2) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)])
+
+    # == Reading
+
+    @staticmethod
+    def _selection(column, values):
+        if values is None:
+            return "", []
+        if isinstance(values, str):
+            values = [values]
+        return " AND %s IN (%s)" % (column, ', '.join('?' * len(values))), list(values)
+
+    def read_run_params(self, case_id, problem_type):
+        """
+        :return: nested parameter dict, or None if no parameters exist
+        """
+        df = self.query("SELECT name, value_json FROM run_params WHERE case_id = ? AND problem_type = ?",
+                        (case_id, problem_type))
+        if df.shape[0] == 0:
+            return None
+        return unflatten_dict({name: json.loads(value) for name, value in zip(df.name, df.value_json)})
+
+    def _read_key_values(self, table, case_id):
+        df = self.query("SELECT name, value_json FROM %s WHERE case_id = ?" % table, (case_id,))
+        return {name: json.loads(value) for name, value in zip(df.name, df.value_json)}
+
+    def read_measures(self, case_id):
+        return self._read_key_values('measures', case_id)
+
+    def read_summary(self, case_id):
+        return self._read_key_values('summary', case_id)
+
+    def read_optimizer_iterations(self, case_id):
+        """
+        :return: pandas.DataFrame with one row per iteration, as created by `create_opt_progress_df`
+        """
+        df = self.query("SELECT iteration, name, value, datetime FROM optimizer_iterations WHERE case_id = ?",
+                        (case_id,))
+        if df.shape[0] == 0:
+            return None
+        opt_df = df.pivot(index='iteration', columns='name', values='value')
+        opt_df['datetime'] = pd.to_datetime(df.groupby('iteration').datetime.first())
+        opt_df.columns.name = None
+        return opt_df.reset_index(drop=True)
+
+    def _get_key_value_table(self, table, case_ids=None, names=None):
+        sel_cases, params_cases = self._selection('case_id', case_ids)
+        sel_names, params_names = self._selection('name', names)
+        df = self.query("SELECT case_id, name, value, value_json FROM %s WHERE 1=1%s%s" % (table, sel_cases,
+                                                                                          sel_names),
+                        params_cases + params_names)
+        values = [value if not pd.isnull(value) else json.loads(value_json)
+                  for value, value_json in zip(df.value, df.value_json)]
+        df = df.assign(value=values)
+        wide = df.pivot(index='case_id', columns='name', values='value')
+        wide.columns.name = None
+        return wide
+
+    def get_measures(self, case_ids=None, names=None):
+        """
+        :return: pandas.DataFrame with one row per case and one column per measure
+        """
+        return self._get_key_value_table('measures', case_ids, names)
+
+    def get_summary(self, case_ids=None, names=None):
+        """
+        :return: pandas.DataFrame with one row per case and one column per summary entry
+        """
+        return self._get_key_value_table('summary', case_ids, names)
+
+    def get_run_params(self, problem_type, case_ids=None, names=None):
+        """
+        :return: pandas.DataFrame with one row per case and one column per (flattened) parameter
+        """
+        sel_cases, params_cases = self._selection('case_id', case_ids)
+        sel_names, params_names = self._selection('name', names)
+        df = self.query("SELECT case_id, name, value, value_json FROM run_params WHERE problem_type = ?%s%s"
+                        % (sel_cases, sel_names), [problem_type] + params_cases + params_names)
+        values = [value if not pd.isnull(value) else json.loads(value_json)
+                  for value, value_json in zip(df.value, df.value_json)]
+        wide = df.assign(value=values).pivot(index='case_id', columns='name', values='value')
+        wide.columns.name = None
+        return wide
+
+    def get_optimizer_iterations(self, case_ids=None):
+        sel_cases, params_cases = self._selection('case_id', case_ids)
+        return self.query("SELECT * FROM optimizer_iterations WHERE 1=1%s ORDER BY case_id, iteration"
+                          % sel_cases, params_cases)
+
+    def get_step_metrics(self, case_ids=None, problem_type=None, threshold=None, subdomain=None):
+        """
+        :return: tidy pandas.DataFrame of per-step metrics, selected by case, problem type, threshold and subdomain
+        """
+        sql = "SELECT * FROM step_metrics WHERE 1=1"
+        params = []
+        for column, values in [('case_id', case_ids), ('problem_type', problem_type),
+                               ('subdomain', subdomain)]:
+            sel, sel_params = self._selection(column, values)
+            sql = sql + sel
+            params = params + sel_params
+        if threshold is not None:
+            sql = sql + " AND abs(threshold - ?) < 1E-10"
+            params.append(float(threshold))
+        return self.query(sql + " ORDER BY case_id, problem_type, threshold, subdomain, sim_time_step", params)
@@ -0,0 +1,237 @@
+"""
+Bookkeeping for incremental execution of pipeline stages.
+
+For every stage, the manifest records a fingerprint of its inputs (parameters, content hashes of input files,
+code version and outputs of upstream stages) together with content hashes of the files it produced.
+A stage whose fingerprint is unchanged and whose outputs are still intact does not need to be recomputed.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+def _to_serializable(obj):
+    """
+    Converts obj into a structure of json-serializable builtin types.
+    Callables are represented by their qualified name, unknown objects by their string representation.
+    """
+    if isinstance(obj, dict):
+        return {str(key): _to_serializable(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple, set)):
+        return [_to_serializable(item) for item in obj]
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    elif callable(obj):
+        return getattr(obj, '__qualname__', getattr(obj, '__name__', str(obj)))
+    else:
+        return str(obj)
+
+
+def _collect_file_paths(obj):
+    """
+    Returns sorted list of all strings in obj that point to existing files.
+    """
+    paths = set()
+    if isinstance(obj, dict):
+        for value in obj.values():
+            paths.update(_collect_file_paths(value))
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            paths.update(_collect_file_paths(item))
+    elif isinstance(obj, str) and os.path.isfile(obj):
+        paths.add(os.path.abspath(obj))
+    return sorted(paths)
+
+
+def _hash_string(string):
+    return hashlib.sha256(string.encode('utf-8')).hexdigest()
+
+
+class StageManifest:
+    """
+    Persistent record of pipeline stages and their inputs / outputs, stored as json file.
+    """
+
+    def __init__(self, path_to_manifest, stage_dependencies=None, block_size=2 ** 20):
+        """
+        :param path_to_manifest: path to json file
+        :param stage_dependencies: dict {stage: [upstream stages]}
+        :param block_size: size of blocks read when hashing files
+        """
+        self.path_to_manifest = path_to_manifest
+        self.stage_dependencies = stage_dependencies if stage_dependencies else {}
+        self.block_size = block_size
+        self.logger = logging.getLogger(__name__)
+        self._read()
+
+    def _read(self):
+        self.stages = {}
+        self.file_hashes = {}
+        if os.path.exists(self.path_to_manifest):
+            try:
+                with open(self.path_to_manifest, 'r') as f:
+                    content = json.load(f)
+                self.stages = content.get('stages', {})
+                self.file_hashes = content.get('file_hashes', {})
+            except ValueError:
+                self.logger.warning("Cannot read stage manifest '%s', starting from empty manifest"
+                                    % self.path_to_manifest)
+
+    def save(self):
+        content = {'stages': self.stages, 'file_hashes': self.file_hashes}
+        path_tmp = self.path_to_manifest + '.tmp'
+        with open(path_tmp, 'w') as f:
+            json.dump(content, f, indent=2, sort_keys=True)
+        os.replace(path_tmp, self.path_to_manifest)
+
+    def hash_file(self, path):
+        """
+        Returns content hash of file or None if file does not exist.
+        Hashes are cached by file size and modification time.
+        """
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        cached = self.file_hashes.get(path)
+        if cached is not None and cached[:2] == key:
+            return cached[2]
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                file_hash.update(block)
+        digest = file_hash.hexdigest()
+        self.file_hashes[path] = key + [digest]
+        return digest
+
+    def hash_files(self, paths):
+        return {os.path.abspath(path): self.hash_file(path) for path in paths}
+
+    def get_downstream_stages(self, stage):
+        """
+        Returns all stages that depend directly or indirectly on stage.
+        """
+        downstream = []
+        to_check = [stage]
+        while to_check:
+            current = to_check.pop(0)
+            for name, upstream in self.stage_dependencies.items():
+                if current in upstream and name not in downstream and name != stage:
+                    downstream.append(name)
+                    to_check.append(name)
+        return downstream
+
+    def _get_outputs_digest(self, stage):
+        record = self.stages.get(stage)
+        if record is None:
+            return None
+        return _hash_string(json.dumps(record['output_hashes'], sort_keys=True))
+
+    def compute_fingerprint(self, stage, params, input_paths=None, code_version=None):
+        """
+        Computes fingerprint of stage from parameters, content of input files, code version and
+        outputs of upstream stages.
+        String values in params that point to existing files are included as input files.
+        :return: fingerprint, dict {path: hash} of input files
+        """
+        params = _to_serializable(params)
+        paths = set(_collect_file_paths(params))
+        if input_paths:
+            paths.update(os.path.abspath(path) for path in input_paths)
+        input_hashes = self.hash_files(sorted(paths))
+        upstream = {name: self._get_outputs_digest(name) for name in self.stage_dependencies.get(stage, [])}
+        content = {'stage': stage,
+                   'params': params,
+                   'input_hashes': sorted(input_hashes.values(), key=str),
+                   'upstream': upstream,
+                   'code_version': _to_serializable(code_version)}
+        fingerprint = _hash_string(json.dumps(content, sort_keys=True))
+        return fingerprint, input_hashes
+
+    def is_up_to_date(self, stage, fingerprint):
+        """
+        Stage is up to date if it has been run with the same fingerprint and all its output files are unchanged.
+        """
+        record = self.stages.get(stage)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+        for path, output_hash in record['output_hashes'].items():
+            if self.hash_file(path) != output_hash:
+                self.logger.info("Output '%s' of stage '%s' has changed" % (path, stage))
+                return False
+        return True
+
+    def get_state(self, stage):
+        record = self.stages.get(stage)
+        if record is None:
+            return {}
+        return record['state']
+
+    def record(self, stage, fingerprint, input_hashes, state):
+        """
+        Records successful execution of stage.
+        String values in state that point to existing files are considered outputs of the stage.
+        Downstream stages are invalidated if outputs differ from those of the previous execution.
+        """
+        state = _to_serializable(state)
+        output_hashes = self.hash_files(_collect_file_paths(state))
+        previous = self.stages.get(stage)
+        if previous is not None and previous['output_hashes'] != output_hashes:
+            self.invalidate(stage, downstream=True, include_stage=False)
+        self.stages[stage] = {'fingerprint': fingerprint,
+                              'input_hashes': input_hashes,
+                              'output_hashes': output_hashes,
+                              'state': state,
+                              'datetime': datetime.now().isoformat()}
+        self.save()
+
+    def invalidate(self, stage, downstream=True, include_stage=True):
+        """
+        Removes records of stage and (optionally) of all stages depending on it.
+        """
+        stages = []
+        if include_stage:
+            stages.append(stage)
+        if downstream:
+            stages.extend(self.get_downstream_stages(stage))
+        for name in stages:
+            if name in self.stages:
+                self.logger.info("Invalidating stage '%s'" % name)
+                del self.stages[name]
+        self.save()
+
+
+def pipeline_stage(stage, ignore_args=('plot',)):
+    """
+    Decorator for methods of classes that provide `_run_stage(stage, method, call_args, *args, **kwargs)`.
+    Arguments of the call, except those listed in ignore_args, are passed on as stage parameters.
+    The decorated method accepts the additional keyword argument `force` to enforce execution.
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, force=False, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            call_args = {name: value for name, value in list(bound.arguments.items())[1:]
+                         if name not in ignore_args}
+            return self._run_stage(stage, method, call_args, force, *args, **kwargs)
+
+        wrapper.pipeline_stage = stage
+        return wrapper
+
+    return decorator
@@ -0,0 +1,316 @@
+"""
+Execution of ImageBasedOptimization pipelines for multiple cases in parallel.
+
+Each case attempt runs in its own freshly started process: fenics / dolfin-adjoint keep global state (e.g. the
+adjoint tape) that must not leak between cases, and a crashing case must not take down the remaining study.
+"""
+
+import json
+import logging
+import os
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import product
+import multiprocessing
+from multiprocessing.connection import wait
+
+import pandas as pd
+
+import glimslib.utils.file_utils as fu
+
+# environment variables that limit the number of threads used by BLAS / OpenMP (including PETSc) and ITK (ANTs)
+THREAD_LIMIT_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                         'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                         'ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS']
+
+# case entries that are given as json strings when the manifest is read from a table
+STRUCTURED_CASE_ENTRIES = ['seed_position', 'params_sim', 'params_fix', 'params_target', 'params_init',
+                           'opt_params', 'parameter_set']
+
+
+def read_study_manifest(path_to_manifest):
+    """
+    Reads list of cases from json file (list of dicts or dict with key 'cases'), or from csv / excel table with
+    one case per row.
+    Each case is a dict with keys:
+        - case_id
+        - case_type: 'atlas' or 'patient'
+        - path_to_image_atlas, path_to_labels_atlas, path_to_image_patient, path_to_labels_patient
+        - image_z_slice: z-slice for 2d studies, None for 3d
+        - seed_position, seed_from_com, optimization_type
+        - params_sim, params_fix, params_init, params_target, opt_params
+        - T1_label, T2_label (patient)
+    :param path_to_manifest: path to manifest file
+    :return: list of case dicts
+    """
+    ext = fu.get_file_extension(path_to_manifest)
+    if ext == 'json':
+        with open(path_to_manifest) as f:
+            content = json.load(f)
+        if isinstance(content, dict):
+            content = content['cases']
+        return content
+    elif ext == 'csv':
+        df = pd.read_csv(path_to_manifest)
+    elif ext in ['xls', 'xlsx']:
+        df = pd.read_excel(path_to_manifest)
+    else:
+        raise ValueError("Unsupported manifest format '%s'" % ext)
+    cases = []
+    for record in df.to_dict(orient='records'):
+        case = {}
+        for key, value in record.items():
+            if isinstance(value, float) and pd.isnull(value):
+                value = None
+            elif key in STRUCTURED_CASE_ENTRIES and isinstance(value, str):
+                value = json.loads(value)
+            case[key] = value
+        cases.append(case)
+    return cases
+
+
+def create_study_cases(cases, parameter_sets):
+    """
+    Combines each case with each parameter set.
+    :param cases: list of case dicts
+    :param parameter_sets: dict {parameter_set_name: dict of case entries}, e.g. {'setA': {'params_init': ...}}
+    :return: list of case dicts, case_id '<case_id>_<parameter_set_name>'
+    """
+    study_cases = []
+    for case, (set_name, parameter_set) in product(cases, parameter_sets.items()):
+        study_case = dict(case)
+        study_case.update(parameter_set)
+        study_case['case_id'] = "%s_%s" % (case['case_id'], set_name)
+        study_case['parameter_set'] = set_name
+        study_cases.append(study_case)
+    return study_cases
+
+
+def run_case(case, base_dir):
+    """
+    Runs full ImageBasedOptimization pipeline for a single case.
+    Stages that have been completed in a previous attempt are skipped (see StageManifest).
+    :return: summary dict as written by `write_analysis_summary`
+    """
+    # imported here so that thread limits are in place before numerical libraries are loaded
+    from glimslib.optimization_workflow.image_based_optimization_atlas import ImageBasedOptimizationAtlas
+    from glimslib.optimization_workflow.image_based_optimization_patient import ImageBasedOptimizationPatient
+
+    case_type = case.get('case_type', 'patient')
+    if case_type == 'atlas':
+        ibo = ImageBasedOptimizationAtlas(base_dir,
+                                          path_to_labels_atlas=case['path_to_labels_atlas'],
+                                          path_to_image_atlas=case['path_to_image_atlas'],
+                                          image_z_slice=case.get('image_z_slice'),
+                                          plot=case.get('plot', False),
+                                          case_id=case['case_id'],
+                                          path_to_results_db=case.get('path_to_results_db'))
+        ibo.prepare_domain(plot=False)
+        ibo.init_forward_problem(seed_position=case['seed_position'],
+                                 model_params_varying=case['params_target'],
+                                 sim_params=case['params_sim'],
+                                 model_params_fixed=case['params_fix'])
+        ibo.run_forward_sim(plot=False)
+        ibo.create_target_fields()
+    elif case_type == 'patient':
+        ibo = ImageBasedOptimizationPatient(base_dir,
+                                            path_to_labels_atlas=case['path_to_labels_atlas'],
+                                            path_to_image_atlas=case['path_to_image_atlas'],
+                                            path_to_labels_patient=case['path_to_labels_patient'],
+                                            path_to_image_patient=case['path_to_image_patient'],
+                                            image_z_slice=case.get('image_z_slice'),
+                                            plot=case.get('plot', False),
+                                            case_id=case['case_id'],
+                                            path_to_results_db=case.get('path_to_results_db'))
+        ibo.prepare_domain(plot=False)
+        ibo.create_target_fields(plot=False, T1_label=case.get('T1_label', 5), T2_label=case.get('T2_label', 6))
+    else:
+        raise ValueError("Invalid case_type '%s'" % case_type)
+
+    ibo.init_inverse_problem(seed_position=case.get('seed_position') if case_type == 'patient' else None,
+                             model_params_varying=case['params_init'],
+                             sim_params=case['params_sim'],
+                             model_params_fixed=case['params_fix'],
+                             seed_from_com=case.get('seed_from_com', False),
+                             optimization_type=case.get('optimization_type', 5))
+    ibo.run_inverse_problem(case.get('opt_params'))
+    ibo.init_optimized_problem()
+    ibo.run_optimized_sim(plot=False)
+    ibo.post_process()
+    return ibo.write_analysis_summary()
+
+
+def get_thread_limits(threads_per_worker):
+    return {name: str(threads_per_worker) for name in THREAD_LIMIT_ENV_VARS}
+
+
+@contextmanager
+def _environment(env_vars):
+    """
+    Temporarily sets environment variables; processes started in this context inherit them.
+    """
+    previous = {name: os.environ.get(name) for name in env_vars}
+    os.environ.update(env_vars)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def _case_worker(connection, case_function, case, base_dir, threads_per_worker):
+    try:
+        try:
+            import SimpleITK as sitk
+            sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads_per_worker)
+        except (ImportError, AttributeError):
+            pass
+        fu.ensure_dir_exists(base_dir)
+        result = {'status': 'success', 'summary': case_function(case, base_dir), 'error': None}
+    except Exception as e:
+        result = {'status': 'failed', 'summary': None, 'error': "%s\n%s" % (repr(e), traceback.format_exc())}
+    connection.send(result)
+    connection.close()
+
+
+class StudyRunner:
+    """
+    Runs a list of cases in a pool of local worker processes and consolidates their summaries.
+    """
+
+    def __init__(self, study_dir, cases, case_function=run_case, n_processes=1, threads_per_worker=1,
+                 max_retries=1, timeout=None, path_to_results_db=None):
+        """
+        :param study_dir: directory in which case directories (one per case_id) and study summary are created
+        :param cases: list of case dicts, or path to manifest file
+        :param case_function: function(case, base_dir) -> summary dict, executed for each case
+        :param n_processes: number of cases that are processed at the same time
+        :param threads_per_worker: number of threads each worker may use for ITK / ANTs, OpenMP / PETSc and BLAS
+        :param max_retries: number of times a failed case is restarted
+        :param timeout: maximum runtime of a single case attempt in seconds
+        :param path_to_results_db: SQLite results database shared by all cases, defaults to
+                                   '<study_dir>/results.sqlite'
+        """
+        self.logger = logging.getLogger(__name__)
+        self.study_dir = study_dir
+        if isinstance(cases, str):
+            cases = read_study_manifest(cases)
+        case_ids = [case['case_id'] for case in cases]
+        if len(set(case_ids)) != len(case_ids):
+            raise ValueError("case_id must be unique")
+        self.cases = cases
+        self.case_function = case_function
+        self.n_processes = n_processes
+        self.threads_per_worker = threads_per_worker
+        self.max_retries = max_retries
+        self.timeout = timeout
+        if path_to_results_db is None:
+            path_to_results_db = os.path.join(self.study_dir, 'results.sqlite')
+        self.path_to_results_db = path_to_results_db
+        self.path_to_summary_pkl = os.path.join(self.study_dir, 'study_summary.pkl')
+        self.path_to_summary_xls = os.path.join(self.study_dir, 'study_summary.xls')
+        self.context = multiprocessing.get_context('spawn')
+        fu.ensure_dir_exists(self.study_dir)
+
+    def get_case_dir(self, case):
+        return os.path.join(self.study_dir, str(case['case_id']))
+
+    def _start(self, case):
+        case = dict(case)
+        case.setdefault('path_to_results_db', self.path_to_results_db)
+        connection_recv, connection_send = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_case_worker,
+                                       args=(connection_send, self.case_function, case,
+                                             self.get_case_dir(case), self.threads_per_worker))
+        with _environment(get_thread_limits(self.threads_per_worker)):
+            process.start()
+        connection_send.close()
+        return process, connection_recv
+
+    def _finish(self, process, connection, timed_out=False):
+        result = None
+        if not timed_out:
+            try:
+                if connection.poll():
+                    result = connection.recv()
+            except EOFError:
+                pass
+        if timed_out:
+            process.terminate()
+        process.join()
+        connection.close()
+        if result is None:
+            if timed_out:
+                error = "Timeout after %s seconds" % self.timeout
+            else:
+                error = "Worker process terminated with exit code %s" % process.exitcode
+            result = {'status': 'failed', 'summary': None, 'error': error}
+        return result
+
+    def run(self):
+        """
+        Processes all cases and writes consolidated summary table.
+        :return: pandas.DataFrame with one row per case
+        """
+        pending = [(case, 1) for case in self.cases]
+        running = {}
+        results = {}
+        while pending or running:
+            while pending and len(running) < self.n_processes:
+                case, attempt = pending.pop(0)
+                self.logger.info("Starting case '%s' (attempt %i)" % (case['case_id'], attempt))
+                process, connection = self._start(case)
+                running[connection] = (process, case, attempt, time.time(), datetime.now())
+            sentinels = [process.sentinel for process, _, _, _, _ in running.values()]
+            wait(list(running.keys()) + sentinels, timeout=1)
+            for connection, (process, case, attempt, t_start, dt_start) in list(running.items()):
+                timed_out = self.timeout is not None and time.time() - t_start > self.timeout
+                if not (connection.poll() or not process.is_alive() or timed_out):
+                    continue
+                del running[connection]
+                result = self._finish(process, connection, timed_out=timed_out)
+                result.update({'attempts': attempt,
+                               'datetime_start': dt_start,
+                               'runtime_seconds': time.time() - t_start})
+                case_id = case['case_id']
+                if result['status'] == 'success':
+                    self.logger.info("Case '%s' finished successfully" % case_id)
+                else:
+                    self.logger.error("Case '%s' failed (attempt %i): %s" % (case_id, attempt, result['error']))
+                    if attempt <= self.max_retries:
+                        pending.append((case, attempt + 1))
+                        continue
+                results[case_id] = result
+        self.summary = self.create_summary_table(results)
+        self.save_summary()
+        return self.summary
+
+    def create_summary_table(self, results):
+        rows = []
+        for case in self.cases:
+            result = results[case['case_id']]
+            row = {'case_id': case['case_id'],
+                   'case_type': case.get('case_type'),
+                   'parameter_set': case.get('parameter_set'),
+                   'base_dir': self.get_case_dir(case),
+                   'status': result['status'],
+                   'attempts': result['attempts'],
+                   'datetime_start': result['datetime_start'],
+                   'runtime_seconds': result['runtime_seconds'],
+                   'error': result['error']}
+            if result['summary']:
+                row.update(result['summary'])
+            rows.append(row)
+        return pd.DataFrame(rows).set_index('case_id')
+
+    def save_summary(self):
+        self.summary.to_pickle(self.path_to_summary_pkl)
+        try:
+            self.summary.to_excel(self.path_to_summary_xls)
+        except Exception as e:
+            self.logger.warning("Cannot write summary to '%s': %s" % (self.path_to_summary_xls, e))
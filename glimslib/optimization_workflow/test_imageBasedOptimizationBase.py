@@ -1,7 +1,9 @@
 import os
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from glimslib import config
+from glimslib import fenics_local as fenics
+import glimslib.utils.data_io as dio
 from glimslib.optimization_workflow.image_based_optimization import ImageBasedOptimizationBase
 
 
@@ -141,3 +143,72 @@ class TestImageBasedOptimizationBase(TestCase):
 
     def test_run_optimized_sim(self):
         self.fail()
+
+
+class TestImageBasedOptimizationOperators(TestCase):
+
+    def setUp(self):
+        self.base_dir = os.path.join(config.output_dir_testing, 'ImageBasedOptimizationBase_operators')
+        self.ibo = ImageBasedOptimizationBase(self.base_dir,
+                                              path_to_labels_atlas=os.path.join(config.test_data_dir,
+                                                                                'brain_atlas_image_3d.mha'),
+                                              path_to_image_atlas=os.path.join(config.test_data_dir,
+                                                                               'brain_atlas_image_t1_3d.mha'),
+                                              image_z_slice=87, plot=False)
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), 10, 10)
+        mesh_reduced = fenics.RectangleMesh(fenics.Point(-1, -1), fenics.Point(1, 1), 7, 7)
+        self.path_to_reduced_domain = os.path.join(self.base_dir, 'reduced_domain.h5')
+        dio.save_mesh_hdf5(mesh_reduced, self.path_to_reduced_domain)
+        ImageBasedOptimizationBase.clear_transfer_operator_cache()
+
+    def tearDown(self):
+        ImageBasedOptimizationBase.clear_transfer_operator_cache()
+        dio.clear_mesh_cache()
+
+    def test_map_field_into_reduced_domain_reuses_operator(self):
+        funspace = fenics.FunctionSpace(self.mesh, 'Lagrange', 2)
+        fields = [fenics.interpolate(fenics.Expression('x[0] * x[1] > %f ? 1.0 : 0.0' % threshold, degree=2),
+                                     funspace) for threshold in [0.1, 0.5]]
+        with mock.patch.object(dio, 'create_transfer_matrix', wraps=dio.create_transfer_matrix) as create_matrix:
+            mapped = [self.ibo._map_field_into_reduced_domain(field, self.path_to_reduced_domain, degree=2)
+                      for field in fields]
+        self.assertEqual(create_matrix.call_count, 1)
+        self.assertEqual(mapped[0].function_space().id(), mapped[1].function_space().id())
+        for field, field_mapped in zip(fields, mapped):
+            field_expected = fenics.Function(field_mapped.function_space())
+            fenics.LagrangeInterpolator.interpolate(field_expected, field)
+            self.assertLess(fenics.errornorm(field_expected, field_mapped), 1E-8)
+
+
+class TestImageBasedOptimizationMeasures(TestCase):
+
+    def setUp(self):
+        self.mesh = fenics.UnitSquareMesh(8, 8)
+        funspace = fenics.FunctionSpace(self.mesh, 'Lagrange', 1)
+        self.field = fenics.interpolate(fenics.Expression('1.0 + x[0] + 2 * x[1]', degree=1), funspace)
+        subdomains = fenics.MeshFunction('size_t', self.mesh, 2)
+        subdomains.set_all(0)
+        fenics.CompiledSubDomain('x[0] > 0.5 - tol', tol=1E-14).mark(subdomains, 1)
+        self.dx = fenics.Measure('dx', domain=self.mesh, subdomain_data=subdomains)
+        ImageBasedOptimizationBase.clear_moment_vectors_cache()
+
+    def tearDown(self):
+        ImageBasedOptimizationBase.clear_moment_vectors_cache()
+
+    def test_volume_and_com(self):
+        x = fenics.SpatialCoordinate(self.mesh)
+        for domain in [fenics.dx(domain=self.mesh), self.dx(1)]:
+            volume_expected = fenics.assemble(self.field * domain)
+            com_expected = [fenics.assemble(x[i] * self.field * domain) / volume_expected for i in range(2)]
+            self.assertAlmostEqual(ImageBasedOptimizationBase.compute_volume(self.field, domain), volume_expected)
+            com = ImageBasedOptimizationBase.compute_com(self.field, domain)
+            for i in range(2):
+                self.assertAlmostEqual(com[i], com_expected[i])
+
+    def test_moment_vectors_cached(self):
+        vectors_1 = ImageBasedOptimizationBase.get_moment_vectors(self.field.function_space(), self.dx(1))
+        vectors_2 = ImageBasedOptimizationBase.get_moment_vectors(self.field.function_space(), self.dx(1))
+        self.assertIs(vectors_1, vectors_2)
+        vectors_all = ImageBasedOptimizationBase.get_moment_vectors(self.field.function_space(), self.dx)
+        self.assertIsNot(vectors_1, vectors_all)
+        self.assertEqual(len(ImageBasedOptimizationBase._moment_vectors_cache), 2)
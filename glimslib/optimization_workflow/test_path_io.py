@@ -1,4 +1,9 @@
-from glimslib.optimization_workflow.path_io import PathIO
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from glimslib.optimization_workflow.path_io import PathIO, PathPattern
 import glimslib.optimization_workflow.config as config
 
 project_root = config.output_dir
@@ -27,3 +32,41 @@ data.create_params_path(processing=None)
 # file_name = data.create_registered_image_path(subject='1', session='1232-23-23', modality='T1w', extension='mha', reg_type='affine')
 # print(file_name)
 
+
+
+class TestPathIO(TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.data = PathIO(self.data_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_root)
+
+    def test_path_pattern(self):
+        pattern = PathPattern("[{processing}/][{datasource}][_{datatype}][_{dim<2|3>|3}d][.{extension}]")
+        self.assertEqual(pattern.build({'processing': 'A', 'datasource': 'patient', 'extension': 'mha'}),
+                         'A/patient_3d.mha')
+        self.assertEqual(pattern.build({'datasource': 'patient', 'datatype': None, 'dim': 2}), 'patient_2d')
+        self.assertEqual(pattern.build({'datasource': 'patient', 'dim': 4}), 'patient')
+        self.assertEqual(pattern.build({'datasource': 'patient', 'dim': 23}), 'patient')
+        self.assertIsNone(PathPattern("{datasource}_{dim<2|3>}d").build({'datasource': 'patient', 'dim': 4}))
+        self.assertIsNone(PathPattern("{processing}/[{datasource}]").build({'datasource': 'patient'}))
+        self.assertIsNone(pattern.build({'datasource': 'patient', 'subject': 1}, strict=True))
+
+    def test_create_path(self):
+        path = self.data.create_image_path(processing='DomainPreparation', datasource='patient', dim=2,
+                                           abs_path=False)
+        self.assertEqual(path, 'DomainPreparation/patient_image_T1_full_reference_2d.mha')
+        path = self.data.create_trafo_path(processing='DomainPreparation', with_ext=False)
+        self.assertEqual(path, os.path.join(self.data_root,
+                                            'DomainPreparation/registration_trafo_regaffine_ref2def'))
+        self.assertTrue(os.path.isdir(os.path.join(self.data_root, 'DomainPreparation')))
+        self.assertEqual(self.data.create_params_path(processing=None, abs_path=False),
+                         'simulation_parameterset.pkl')
+
+    def test_index(self):
+        path = self.data.create_fenics_path(processing='TargetFields', datasource='registration', content='disp')
+        open(path, 'w').close()
+        self.assertEqual(self.data.index.get(datasource='registration', content='disp'), [path])
+        self.assertEqual(self.data.index.get(content='T1'), [])
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from glimslib.optimization_workflow.results_store import ResultsStore
+
+
+class TestResultsStore(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.store = ResultsStore(os.path.join(self.output_dir, 'results.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_run_params(self):
+        params = {'path_to_domain': '/some/path.h5',
+                  'seed_position': [148, -67],
+                  'sim_params': {'sim_time': 10, 'sim_time_step': 1},
+                  'model_params_fixed': {},
+                  'optimization_type': 3}
+        self.store.write_run_params('case_1', 'inverse', params)
+        self.store.write_run_params('case_2', 'inverse', dict(params, optimization_type=5))
+        self.assertEqual(self.store.read_run_params('case_1', 'inverse'), params)
+        self.assertIsNone(self.store.read_run_params('case_1', 'forward'))
+        df = self.store.get_run_params('inverse', names=['optimization_type', 'sim_params.sim_time'])
+        self.assertEqual(list(df.optimization_type), [3, 5])
+
+    def test_measures_summary(self):
+        self.store.write_measures('case_1', {'a': 1.0, 'x': np.array([1., 2.])})
+        self.store.write_measures('case_1', {'a': 2.0, 'method': 'L-BFGS-B'})
+        self.store.write_summary('case_2', {'a': 3.0})
+        self.assertEqual(self.store.read_measures('case_1'), {'a': 2.0, 'method': 'L-BFGS-B'})
+        df = self.store.get_measures(names=['a'])
+        self.assertEqual(list(df.index), ['case_1'])
+        self.assertEqual(self.store.get_summary().loc['case_2', 'a'], 3.0)
+
+    def test_optimizer_iterations(self):
+        t0 = datetime(2018, 1, 1)
+        opt_df = pd.DataFrame({'J': [3.0, 2.0, 1.0], 'D_WM': [0.1, 0.2, 0.3],
+                               'datetime': [t0, t0 + timedelta(seconds=10), t0 + timedelta(seconds=30)]})
+        self.store.write_optimizer_iterations('case_1', opt_df)
+        opt_df_read = self.store.read_optimizer_iterations('case_1')
+        self.assertEqual(list(opt_df_read.J), [3.0, 2.0, 1.0])
+        self.assertEqual((opt_df_read.datetime.iloc[-1] - opt_df_read.datetime.iloc[0]).total_seconds(), 30)
+        self.assertEqual(self.store.get_optimizer_iterations().shape[0], 6)
+
+    def test_step_metrics(self):
+        metrics = pd.DataFrame({'sim_time_step': [1, 2, 1, 2],
+                                'threshold': [0.12, 0.12, 0.8, 0.8],
+                                'subdomain': ['all'] * 4,
+                                'volume': [1., 2., 0.5, 1.],
+                                'com_0': [0., 0.1, 0.2, 0.3],
+                                'com_1': [1., 1.1, 1.2, 1.3]})
+        self.store.write_step_metrics('case_1', 'forward', metrics)
+        self.store.write_step_metrics('case_2', 'forward', metrics)
+        df = self.store.get_step_metrics(problem_type='forward', threshold=0.12)
+        self.assertEqual(df.shape[0], 4)
+        self.assertTrue(df.com_2.isnull().all())
+        self.assertEqual(list(df[df.case_id == 'case_2'].volume), [1., 2.])
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from glimslib.optimization_workflow.stage_manifest import StageManifest, pipeline_stage
+
+
+class Pipeline:
+
+    stage_dependencies = {'prep': [], 'sim': ['prep']}
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path_input = os.path.join(base_dir, 'input.txt')
+        self.stage_manifest = StageManifest(os.path.join(base_dir, 'manifest.json'),
+                                            stage_dependencies=self.stage_dependencies)
+        self.n_calls = {'prep': 0, 'sim': 0}
+
+    def _run_stage(self, stage, method, call_args, force, *args, **kwargs):
+        params = {'call_args': call_args, 'path_input': self.path_input}
+        fingerprint, input_hashes = self.stage_manifest.compute_fingerprint(stage, params)
+        if not force and self.stage_manifest.is_up_to_date(stage, fingerprint):
+            for name, value in self.stage_manifest.get_state(stage).items():
+                setattr(self, name, value)
+            return None
+        result = method(self, *args, **kwargs)
+        state = {'path_%s' % stage: getattr(self, 'path_%s' % stage)}
+        self.stage_manifest.record(stage, fingerprint, input_hashes, state)
+        return result
+
+    @pipeline_stage('prep')
+    def prep(self, factor=1, plot=False):
+        self.n_calls['prep'] += 1
+        self.path_prep = os.path.join(self.base_dir, 'prep.txt')
+        with open(self.path_input) as f:
+            content = f.read()
+        with open(self.path_prep, 'w') as f:
+            f.write(content * factor)
+
+    @pipeline_stage('sim')
+    def sim(self):
+        self.n_calls['sim'] += 1
+        self.path_sim = os.path.join(self.base_dir, 'sim.txt')
+        with open(self.path_sim, 'w') as f:
+            f.write('sim')
+
+
+class TestStageManifest(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.path_input = os.path.join(self.base_dir, 'input.txt')
+        with open(self.path_input, 'w') as f:
+            f.write('a')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_skip_unchanged(self):
+        pipeline = Pipeline(self.base_dir)
+        pipeline.prep()
+        pipeline.sim()
+        pipeline_2 = Pipeline(self.base_dir)
+        pipeline_2.prep(plot=True)
+        pipeline_2.sim()
+        self.assertEqual(pipeline_2.n_calls, {'prep': 0, 'sim': 0})
+        self.assertEqual(pipeline_2.path_sim, pipeline.path_sim)
+        pipeline_2.sim(force=True)
+        self.assertEqual(pipeline_2.n_calls['sim'], 1)
+
+    def test_rerun_changed_params(self):
+        pipeline = Pipeline(self.base_dir)
+        pipeline.prep()
+        pipeline.sim()
+        pipeline.prep(factor=2)
+        pipeline.sim()
+        self.assertEqual(pipeline.n_calls, {'prep': 2, 'sim': 2})
+
+    def test_rerun_changed_input(self):
+        pipeline = Pipeline(self.base_dir)
+        pipeline.prep()
+        pipeline.sim()
+        with open(self.path_input, 'w') as f:
+            f.write('bb')
+        pipeline.prep()
+        pipeline.sim()
+        self.assertEqual(pipeline.n_calls, {'prep': 2, 'sim': 2})
+
+    def test_rerun_changed_output(self):
+        pipeline = Pipeline(self.base_dir)
+        pipeline.prep()
+        pipeline.sim()
+        os.remove(pipeline.path_sim)
+        pipeline.prep()
+        pipeline.sim()
+        self.assertEqual(pipeline.n_calls, {'prep': 1, 'sim': 2})
+
+    def test_invalidate_downstream(self):
+        pipeline = Pipeline(self.base_dir)
+        pipeline.prep()
+        pipeline.sim()
+        self.assertEqual(pipeline.stage_manifest.get_downstream_stages('prep'), ['sim'])
+        pipeline.stage_manifest.invalidate('prep')
+        pipeline.prep()
+        pipeline.sim()
+        self.assertEqual(pipeline.n_calls, {'prep': 2, 'sim': 2})
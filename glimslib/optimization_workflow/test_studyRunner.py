@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from glimslib.optimization_workflow.study_runner import StudyRunner, create_study_cases, read_study_manifest
+
+
+def dummy_case(case, base_dir):
+    path_marker = os.path.join(base_dir, 'attempted')
+    if case.get('fail_first') and not os.path.exists(path_marker):
+        open(path_marker, 'w').close()
+        raise RuntimeError("first attempt")
+    if case.get('fail'):
+        raise RuntimeError("always failing")
+    return {'value': case['value'] * 2, 'omp_threads': os.environ.get('OMP_NUM_THREADS')}
+
+
+class TestStudyRunner(TestCase):
+
+    def setUp(self):
+        self.study_dir = tempfile.mkdtemp()
+        self.cases = [{'case_id': 'a', 'value': 1},
+                      {'case_id': 'b', 'value': 2, 'fail_first': True},
+                      {'case_id': 'c', 'value': 3, 'fail': True}]
+
+    def tearDown(self):
+        shutil.rmtree(self.study_dir)
+
+    def test_run(self):
+        runner = StudyRunner(self.study_dir, self.cases, case_function=dummy_case, n_processes=2,
+                             threads_per_worker=2, max_retries=1)
+        summary = runner.run()
+        self.assertEqual(list(summary.index), ['a', 'b', 'c'])
+        self.assertEqual(list(summary.status), ['success', 'success', 'failed'])
+        self.assertEqual(list(summary.attempts), [1, 2, 2])
+        self.assertEqual(summary.loc['b', 'value'], 4)
+        self.assertEqual(summary.loc['a', 'omp_threads'], '2')
+        self.assertTrue(os.path.exists(runner.path_to_summary_pkl))
+
+    def test_create_study_cases(self):
+        cases = create_study_cases(self.cases[:2], {'s1': {'value': 10}, 's2': {'value': 20}})
+        self.assertEqual(len(cases), 4)
+        self.assertEqual(cases[0]['case_id'], 'a_s1')
+        self.assertEqual(cases[1]['value'], 20)
+
+    def test_read_study_manifest(self):
+        path = os.path.join(self.study_dir, 'manifest.csv')
+        with open(path, 'w') as f:
+            f.write('case_id,image_z_slice,seed_position\n')
+            f.write('p1,87,"[148, -67]"\n')
+        cases = read_study_manifest(path)
+        self.assertEqual(cases[0]['seed_position'], [148, -67])
+        self.assertEqual(cases[0]['image_z_slice'], 87)
@@ -17,6 +17,7 @@ from abc import ABC, abstractmethod
 from glimslib import fenics_local as fenics
 from glimslib.simulation_helpers.helper_classes import SubDomains, FunctionSpace, \
                                             BoundaryConditions, Parameters, Results, Plotting
+from glimslib.simulation_helpers.observers import ObserverTable
 from glimslib.simulation import config
 
 # FENICS (and related) Logger settings
@@ -234,14 +235,23 @@ class FenicsSimulation(ABC):
         self.mesh.bounding_box_tree().build(self.mesh)
 
     def run(self, keep_nth=1, save_method='xdmf', clear_all=False, plot=True,
-            output_dir=config.output_dir_simulation_tmp):
+            output_dir=config.output_dir_simulation_tmp, observers=None, observe_nth=1, store_fields=True):
         """
         Run the time-dependent simulation.
         :param keep_nth: keep every nth simulation step
         :param save_method : None, 'vtk', 'xdmf'
+        :param observers: list of observers (see `simulation_helpers.observers`, e.g. PointProbes) or functions
+                          `callback(solution, time)`
+                          evaluated on the current solution; outputs are collected in `self.observations` and
+                          written to 'observations.csv' in `output_dir`
+        :param observe_nth: evaluate observers every nth simulation step
+        :param store_fields: if False, solutions are neither kept in `self.results` nor saved or plotted
         """
         if self.geometric_dimension==3:
             plot=False
+        if not store_fields:
+            save_method = None
+            plot = False
 
         self.logger.info("-- Computing solutions: ")
         # Results instance
@@ -252,14 +262,21 @@ class FenicsSimulation(ABC):
         # Initial Conditions
         u_previous = self.params.create_initial_value_function()
         self._setup_problem(u_previous)
+        # Observers
+        self.observations = ObserverTable(observers if observers is not None else [])
+        self.observations.setup(self.functionspace, self.subdomains)
+        observe = len(self.observations.observers) > 0
 
         if not self.time_dependent:
             self.logger.info("    - solving stationary problem")
             self.solver.solve()
-            self.results.add_to_results(0, 0, 0, self.solution)
-            self.results.save_solution(0, 0, method=save_method)
+            if store_fields:
+                self.results.add_to_results(0, 0, 0, self.solution)
+                self.results.save_solution(0, 0, method=save_method)
             if plot:
                 self.plotting.plot_all(0)
+            if observe:
+                self.observations.observe(self.solution, 0, 0)
             u_previous.vector()[:] = self.solution.vector()
         else:
             # == t=0
@@ -268,10 +285,13 @@ class FenicsSimulation(ABC):
             time_step = 0
             recording_step = 0
             u_0 = u_previous
-            self.results.add_to_results(0, 0, recording_step, u_0)
-            self.results.save_solution(recording_step, current_sim_time, function=u_0, method=save_method)
+            if store_fields:
+                self.results.add_to_results(0, 0, recording_step, u_0)
+                self.results.save_solution(recording_step, current_sim_time, function=u_0, method=save_method)
             if plot:
                 self.plotting.plot_all(recording_step)
+            if observe:
+                self.observations.observe(u_0, current_sim_time, time_step)
             continue_simulation = True
             # == t>0
             while (current_sim_time <= self.params.sim_time - 1e-5) and continue_simulation:
@@ -286,12 +306,14 @@ class FenicsSimulation(ABC):
                         except:
                             self.logger.warning("    - Solver did not converge -- will shutdown simulation")
                             continue_simulation = False
-                        if (time_step % keep_nth == 0) and continue_simulation:
+                        if (time_step % keep_nth == 0) and continue_simulation and store_fields:
                             recording_step = recording_step + 1
                             self.results.add_to_results(current_sim_time, time_step, recording_step, self.solution)
                             self.results.save_solution(recording_step, current_sim_time, method=save_method)
                             if plot:
                                 self.plotting.plot_all(recording_step)
+                        if observe and (time_step % observe_nth == 0) and continue_simulation:
+                            self.observations.observe(self.solution, current_sim_time, time_step)
                         u_previous.assign(self.solution)
                 else:
                     current_sim_time += float(self.params.sim_time_step)
@@ -303,23 +325,36 @@ class FenicsSimulation(ABC):
                     except:
                         self.logger.warning("    - Solver did not converge -- will shutdown simulation")
                         continue_simulation = False
-                    if (time_step % keep_nth == 0) and continue_simulation:
+                    if (time_step % keep_nth == 0) and continue_simulation and store_fields:
                         recording_step = recording_step + 1
                         self.results.add_to_results(current_sim_time, time_step, recording_step, self.solution)
                         self.results.save_solution(recording_step, current_sim_time, method=save_method)
                         if plot:
                             self.plotting.plot_all(recording_step)
+                    if observe and (time_step % observe_nth == 0) and continue_simulation:
+                        self.observations.observe(self.solution, current_sim_time, time_step)
                     u_previous.assign(self.solution)
 
         self.results.save_solution_end(method=save_method)
         # save entire time series as hdf5
-        self.results.save_solution_hdf5()
+        if store_fields:
+            self.results.save_solution_hdf5()
+        if observe:
+            self.observations.save(os.path.join(output_dir, 'observations.csv'))
         return self.solution
 
-    def reload_from_hdf5(self, path_to_hdf5, output_dir=config.output_dir_simulation_tmp):
+    def reload_from_hdf5(self, path_to_hdf5, output_dir=config.output_dir_simulation_tmp, lazy=False, raw=False):
+        """
+        Reloads simulation results from hdf5 file.
+        :param lazy: if True, solution of each recording step is only read from file when first accessed
+        :param raw: if True, expects file written by `Results.save_solution_hdf5(raw=True)`
+        """
         self.logger.info("-- Reloading from hdf5: ")
         # Results instance
         self.results = Results(self.functionspace, self.subdomains, output_dir=output_dir)
-        self.results.data.load_from_hdf5(path_to_hdf5)
+        if raw:
+            self.results.data.load_from_hdf5_raw(path_to_hdf5, lazy=lazy)
+        else:
+            self.results.data.load_from_hdf5(path_to_hdf5, lazy=lazy)
         # Plotting
         self.plotting = Plotting(self.results, output_dir=os.path.join(output_dir, 'plots'))
\ No newline at end of file
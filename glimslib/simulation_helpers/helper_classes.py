@@ -1,8 +1,10 @@
 import logging
 import sys
 import itertools
+import functools
 import numpy as np
 import collections
+import contextlib
 import copy
 import os
 import shutil
@@ -11,7 +13,7 @@ from abc import ABC, abstractmethod
 import pandas as pd
 
 from glimslib import fenics_local as fenics
-from glimslib.visualisation import plotting as plott, helpers as vh
+from glimslib.visualisation import plotting as plott, helpers as vh, frames as vf
 
 import glimslib.utils.file_utils as fu
 import glimslib.utils.data_io as dio
@@ -231,6 +233,88 @@ class SubSpaces():
                 self.logger.warning(sys.exc_info()[0])
                 return None
 
+class Projector():
+    """
+    L2 projection onto a fixed function space.
+    The mass matrix is assembled once and the solver is set up once, so that repeated projections only require
+    assembly of the right hand side and a single solve.
+    """
+
+    def __init__(self, functionspace, solver_type='lu', preconditioner_type='default'):
+        """
+        :param functionspace: fenics function space to project onto
+        :param solver_type: 'lu', 'mumps', ... for direct solver, or 'cg' or other krylov method
+        :param preconditioner_type: preconditioner for krylov solver
+        """
+        self.functionspace = functionspace
+        u = fenics.TrialFunction(functionspace)
+        self._v = fenics.TestFunction(functionspace)
+        self.mass_matrix = fenics.assemble(fenics.inner(u, self._v) * fenics.dx)
+        if solver_type in ['lu', 'default', 'mumps', 'umfpack', 'superlu', 'superlu_dist', 'petsc']:
+            # as in fenics.project, 'lu' denotes the default LU method
+            if solver_type == 'lu':
+                solver_type = 'default'
+            self.solver = fenics.LUSolver(self.mass_matrix, solver_type)
+            if fenics.is_version("<2018.1.x"):
+                self.solver.parameters['reuse_factorization'] = True
+        else:
+            self.solver = fenics.KrylovSolver(solver_type, preconditioner_type)
+            self.solver.set_operator(self.mass_matrix)
+
+    def project(self, function_expr, function=None):
+        """
+        Projects function or expression onto function space.
+        :param function_expr: fenics function or ufl expression
+        :param function: optional fenics function to store result in
+        :return: fenics function
+        """
+        if function is None:
+            function = fenics.Function(self.functionspace)
+        rhs = fenics.assemble(fenics.inner(function_expr, self._v) * fenics.dx)
+        self.solver.solve(function.vector(), rhs)
+        return function
+
+
+class LocalProjector():
+    """
+    Element-wise L2 projection onto discontinuous (DG or Quadrature) function space.
+    The local mass matrices are factorized once, projections do not require a global linear solve.
+    """
+
+    def __init__(self, functionspace):
+        """
+        :param functionspace: fenics function space of discontinuous elements
+        """
+        self.functionspace = functionspace
+        element = functionspace.ufl_element()
+        if element.family() == 'Quadrature':
+            self.dx = fenics.dx(metadata={'quadrature_degree': element.degree(), 'quadrature_scheme': 'default'})
+        else:
+            self.dx = fenics.dx
+        u = fenics.TrialFunction(functionspace)
+        self._v = fenics.TestFunction(functionspace)
+        self.solver = fenics.LocalSolver(fenics.inner(u, self._v) * self.dx)
+        self.solver.factorize()
+
+    def assemble_rhs(self, function_expr):
+        return fenics.assemble(fenics.inner(function_expr, self._v) * self.dx)
+
+    def solve(self, rhs, function=None):
+        if function is None:
+            function = fenics.Function(self.functionspace)
+        self.solver.solve_local(function.vector(), rhs, self.functionspace.dofmap())
+        return function
+
+    def project(self, function_expr, function=None):
+        """
+        Projects function or expression onto function space.
+        :param function_expr: fenics function or ufl expression
+        :param function: optional fenics function to store result in
+        :return: fenics function
+        """
+        return self.solve(self.assemble_rhs(function_expr), function=function)
+
+
 class FunctionSpace():
     """
     Helper class for management of Fenics function space.
@@ -329,6 +413,130 @@ class FunctionSpace():
         subspace = self.function_space.sub(subspace_id)
         return subspace
 
+    def get_derived_functionspace(self, kind='scalar', family='Lagrange', degree=1):
+        """
+        Returns function space for derived quantities on the same mesh; function spaces are created once and cached.
+        :param kind: 'scalar', 'vector' or 'tensor'
+        :param family: element family
+        :param degree: element degree
+        """
+        if not hasattr(self, '_derived_functionspaces'):
+            self._derived_functionspaces = {}
+        key = (kind, family, degree)
+        if key not in self._derived_functionspaces:
+            element = self.get_derived_element(kind, family, degree)
+            if element is None:
+                return None
+            self._derived_functionspaces[key] = fenics.FunctionSpace(self._mesh, element)
+        return self._derived_functionspaces[key]
+
+    def get_derived_element(self, kind='scalar', family='Lagrange', degree=1):
+        """
+        Returns element for derived quantities.
+        :param kind: 'scalar', 'vector' or 'tensor'
+        :param family: element family, e.g. 'Lagrange', 'DG' or 'Quadrature'
+        :param degree: element degree
+        """
+        cell = self._mesh.ufl_cell()
+        element_kwargs = {}
+        if family == 'Quadrature':
+            element_kwargs['quad_scheme'] = 'default'
+        if kind == 'scalar':
+            element = fenics.FiniteElement(family, cell, degree, **element_kwargs)
+        elif kind == 'vector':
+            element = fenics.VectorElement(family, cell, degree, **element_kwargs)
+        elif kind == 'tensor':
+            element = fenics.TensorElement(family, cell, degree, **element_kwargs)
+        else:
+            self.logger.error("Do not understand function space kind '%s'" % kind)
+            return None
+        return element
+
+    def get_projector(self, functionspace):
+        """
+        Returns Projector instance for given target function space; projectors are created once and cached.
+        """
+        if not hasattr(self, '_projectors'):
+            self._projectors = {}
+        key = functionspace.id()
+        if key not in self._projectors:
+            self.logger.info("   - setting up projector for function space %s" % key)
+            projector_parameters = {name: value for name, value in self._projection_parameters.items()
+                                    if name in ['solver_type', 'preconditioner_type']}
+            self._projectors[key] = Projector(functionspace, **projector_parameters)
+        return self._projectors[key]
+
+    def get_local_projector(self, functionspace):
+        """
+        Returns LocalProjector instance for given discontinuous target function space; cached as `get_projector`.
+        """
+        if not hasattr(self, '_local_projectors'):
+            self._local_projectors = {}
+        key = functionspace.id()
+        if key not in self._local_projectors:
+            self.logger.info("   - setting up local projector for function space %s" % key)
+            self._local_projectors[key] = LocalProjector(functionspace)
+        return self._local_projectors[key]
+
+    def clear_projectors(self):
+        """
+        Removes all cached projectors, e.g. after mesh has been moved.
+        """
+        self._projectors = {}
+        self._local_projectors = {}
+
+    def project_local(self, function_expr, functionspace):
+        """
+        Projects function or expression element-wise onto discontinuous `functionspace`, see LocalProjector.
+        """
+        return self.get_local_projector(functionspace).project(function_expr)
+
+    def project_local_batch(self, function_expr_dict, family='DG', degree=0):
+        """
+        Projects multiple functions or expressions element-wise in a single assembly loop over cells.
+        Expressions are projected onto a mixed space of discontinuous elements and then split into separate functions.
+        :param function_expr_dict: dictionary {name : (function_expr, kind)}, kind in 'scalar', 'vector', 'tensor'
+        :param family: 'DG' or 'Quadrature'
+        :param degree: element degree
+        :return: dictionary {name : function}
+        """
+        names = list(function_expr_dict.keys())
+        kinds = tuple(function_expr_dict[name][1] for name in names)
+        if len(names) == 1:
+            function_expr, kind = function_expr_dict[names[0]]
+            V = self.get_derived_functionspace(kind, family, degree)
+            return {names[0]: self.project_local(function_expr, V)}
+        if not hasattr(self, '_derived_mixed_functionspaces'):
+            self._derived_mixed_functionspaces = {}
+        key = (kinds, family, degree)
+        if key not in self._derived_mixed_functionspaces:
+            elements = [self.get_derived_element(kind, family, degree) for kind in kinds]
+            W = fenics.FunctionSpace(self._mesh, fenics.MixedElement(elements))
+            assigners = [fenics.FunctionAssigner(self.get_derived_functionspace(kind, family, degree), W.sub(i))
+                         for i, kind in enumerate(kinds)]
+            self._derived_mixed_functionspaces[key] = (W, assigners)
+        W, assigners = self._derived_mixed_functionspaces[key]
+        projector = self.get_local_projector(W)
+        v_list = fenics.TestFunctions(W)
+        rhs_form = sum([fenics.inner(function_expr_dict[name][0], v) * projector.dx for name, v in zip(names, v_list)])
+        w = projector.solve(fenics.assemble(rhs_form))
+        function_dict = {}
+        for i, name in enumerate(names):
+            function = fenics.Function(self.get_derived_functionspace(kinds[i], family, degree))
+            assigners[i].assign(function, w.sub(i))
+            function_dict[name] = function
+        return function_dict
+
+    def project(self, function_expr, functionspace, **kwargs):
+        """
+        Projects function or expression onto `functionspace` using cached projector.
+        If adjoint is used and projection should be annotated, fenics.project is used instead.
+        """
+        if config.USE_ADJOINT and kwargs.get('annotate', True):
+            return fenics.project(function_expr, functionspace, **self._projection_parameters, **kwargs)
+        else:
+            return self.get_projector(functionspace).project(function_expr)
+
     def project_over_space(self, function_expr, subspace_id=None, subspace_name=None, **kwargs):
         if self.has_subspaces:
             if type(function_expr)==dict:
@@ -337,13 +545,15 @@ class FunctionSpace():
             else:
                 if (subspace_id is None) and (subspace_name is None):
                     self.logger.info("Projecting over main function space")
-                    function = fenics.project(function_expr, self.function_space, **self._projection_parameters, **kwargs)
+                    function = self.project(function_expr, self.function_space, **kwargs)
                 else:
-                    function = self.subspaces.project_over_subspace(function_expr,
-                                                                subspace_id=subspace_id, subspace_name=subspace_name,
-                                                                    **self._projection_parameters, **kwargs)
+                    if subspace_id is None:
+                        subspace_id = self.subspaces.get_subspace_id(subspace_name)
+                    funspace_sub = self.subspaces.get_functionspace(subspace_id=subspace_id)
+                    self.logger.info('Projecting over subspace %i' % subspace_id)
+                    function = self.project(function_expr, funspace_sub, **kwargs)
         else:
-            function = fenics.project(function_expr, self.function_space, **self._projection_parameters)
+            function = self.project(function_expr, self.function_space)
         return function
 
     def _project_combine_multiple_subspaces(self, function_expr_subspace_dict, **kwargs):
@@ -359,6 +569,36 @@ class FunctionSpace():
             assigner.assign(U.sub(subspace_id), f)
         return U
 
+    def _get_subspace_assigner(self, subspace_id):
+        """
+        Returns FunctionAssigner from subspace `subspace_id` of main function space to separate subspace function space.
+        Assigners are created once and cached.
+        """
+        if not hasattr(self, '_subspace_assigners'):
+            self._subspace_assigners = {}
+        if subspace_id not in self._subspace_assigners:
+            V = self.subspaces.get_functionspace(subspace_id=subspace_id)
+            self._subspace_assigners[subspace_id] = fenics.FunctionAssigner(V, self.function_space.sub(subspace_id))
+        return self._subspace_assigners[subspace_id]
+
+    def extract_subspace_function(self, function, subspace_id=None, subspace_name=None, **kwargs):
+        """
+        Extracts function on subspace by copying dof values, no projection is needed.
+        Function must be defined on main function space.
+        :param function: function on main function space
+        :param subspace_id: subspace id
+        :param subspace_name: subspace name
+        :return: new function on subspace, or copy of function if no subspace specified
+        """
+        if (not self.has_subspaces) or ((subspace_id is None) and (subspace_name is None)):
+            return function.copy(deepcopy=True)
+        if subspace_id is None:
+            subspace_id = self.subspaces.get_subspace_id(subspace_name=subspace_name)
+        function_sub = fenics.Function(self.subspaces.get_functionspace(subspace_id=subspace_id))
+        assigner = self._get_subspace_assigner(subspace_id)
+        assigner.assign(function_sub, function.sub(subspace_id), **kwargs)
+        return function_sub
+
     def split_function(self, function, subspace_id=None, subspace_name=None):
         """
         Splits function into subspace functions. Does not project onto other functionspace.
@@ -438,8 +678,19 @@ class SubDomains():
         subdomains = fenics.MeshFunction("size_t", self._mesh, self.dim_geo)
         subdomains.set_all(0)
         # mark subdomains
-        for cell in fenics.cells(self._mesh):
-            subdomains[cell.index()] = int(self.label_function(cell.midpoint()))
+        element = label_function.function_space().ufl_element()
+        if label_function.function_space().mesh().id() == self._mesh.id() and element.degree() == 1 \
+                and element.family() in ['Lagrange', 'CG']:
+            # label function at cell midpoint is mean of vertex values
+            vertex_values = label_function.compute_vertex_values(self._mesh)
+            labels = vertex_values[self._mesh.cells()].mean(axis=1).astype(np.uintp)
+            if hasattr(subdomains, 'set_values'):
+                subdomains.set_values(labels)
+            else:
+                subdomains.array()[:] = labels
+        else:
+            for cell in fenics.cells(self._mesh):
+                subdomains[cell.index()] = int(self.label_function(cell.midpoint()))
         self.subdomains = subdomains
         self.logger.info("     ... created subdomains.")
 
@@ -1093,8 +1344,31 @@ class TimeSeriesDataTimePoint():
     def set_field(self, field):
         self.field = field
 
+    def set_field_loader(self, field_loader, access_hook=None):
+        """
+        Defines callable that creates field on first access, see `get_field`.
+        :param access_hook: optional callable, called on every access of the loaded field
+        """
+        self._field_loader = field_loader
+        self._access_hook = access_hook
+
+    def is_loaded(self):
+        return hasattr(self, 'field')
+
+    def unload_field(self):
+        """
+        Removes field from memory if it can be reloaded by field loader.
+        """
+        if hasattr(self, '_field_loader') and hasattr(self, 'field'):
+            del self.field
+
     def get_field(self):
         if hasattr(self, 'field'):
+            if getattr(self, '_access_hook', None) is not None:
+                self._access_hook()
+            return self.field
+        elif hasattr(self, '_field_loader'):
+            self.field = self._field_loader()
             return self.field
 
     def get_time(self):
@@ -1112,15 +1386,28 @@ class TimeSeriesData():
     This class provides a datastructure for time series data from observations over a single functionspace.
 
     """
-    def __init__(self, name, functionspace):
+    def __init__(self, name, functionspace, cache_size=10, lazy_cache_size=10):
         """
         :param name: name of solution time series
         :param functionspace: instance of FunctionSpace helper class
+        :param cache_size: number of extracted solution functions kept in memory
+        :param lazy_cache_size: number of lazily loaded fields kept in memory
         """
         self.logger = logging.getLogger(__name__)
         self._functionspace = functionspace
         self.name = name
         self.data = {}  # here data is being stored, keys correspond to recording_step
+        self._cache_size = cache_size
+        self._solution_cache = collections.OrderedDict()  # {(recording_step, subspace_id): function}
+        self._lazy_cache_size = lazy_cache_size
+        self._lazy_loaded_steps = collections.OrderedDict()  # {recording_step: None}, in order of last access
+
+    def _clear_solution_cache(self, recording_step=None):
+        if recording_step is None:
+            self._solution_cache.clear()
+        else:
+            for key in [key for key in self._solution_cache.keys() if key[0] == recording_step]:
+                del self._solution_cache[key]
 
     def exists_recording_step(self, recording_step):
         return recording_step in self.data.keys()
@@ -1140,9 +1427,42 @@ class TimeSeriesData():
             if replace:
                 self.logger.warning("Replacing existing recording step %i" % recording_step)
                 self.data[recording_step] = observation
+                self._clear_solution_cache(recording_step)
         else:
             self.data[recording_step] = observation
 
+    def add_lazy_observation(self, field_loader, time, time_step, recording_step, replace=False):
+        """
+        Adds observation whose field is only created by `field_loader()` when first accessed.
+        At most `lazy_cache_size` lazily loaded fields are kept in memory, least recently used ones are released.
+        """
+        observation = TimeSeriesDataTimePoint(time=time, time_step=time_step, recording_step=recording_step)
+        observation.set_field_loader(lambda: self._load_lazy_field(recording_step, field_loader),
+                                     access_hook=lambda: self._touch_lazy_field(recording_step))
+        if self.exists_recording_step(recording_step=recording_step):
+            self.logger.warning("Recording step %i already exists" % recording_step)
+            if replace:
+                self.logger.warning("Replacing existing recording step %i" % recording_step)
+                self.data[recording_step] = observation
+                self._clear_solution_cache(recording_step)
+        else:
+            self.data[recording_step] = observation
+
+    def _load_lazy_field(self, recording_step, field_loader):
+        self.logger.info("Loading field for recording step '%d'" % recording_step)
+        field = field_loader()
+        self._lazy_loaded_steps[recording_step] = None
+        self._lazy_loaded_steps.move_to_end(recording_step)
+        while len(self._lazy_loaded_steps) > self._lazy_cache_size:
+            step, _ = self._lazy_loaded_steps.popitem(last=False)
+            if step in self.data:
+                self.data[step].unload_field()
+        return field
+
+    def _touch_lazy_field(self, recording_step):
+        if recording_step in self._lazy_loaded_steps:
+            self._lazy_loaded_steps.move_to_end(recording_step)
+
     def get_observation(self, recording_step):
         if self.exists_recording_step(recording_step):
             return self.data.get(recording_step)
@@ -1165,19 +1485,30 @@ class TimeSeriesData():
             observation = self.get_observation(recording_step)
         # get either function or function on subspace
         if observation is not None:
+            if (subspace_id is None) and (subspace_name is not None) and self._functionspace.has_subspaces:
+                subspace_id = self._functionspace.subspaces.get_subspace_id(subspace_name=subspace_name)
+            key = (observation.get_recording_step(), subspace_id)
+            if key in self._solution_cache:
+                self._solution_cache.move_to_end(key)
+                # callers may modify the returned function, cached function must remain unchanged
+                return self._solution_cache[key].copy(deepcopy=True)
             field_function = observation.get_field()
-            result_sub = self._functionspace.split_function(field_function,
-                                                            subspace_id=subspace_id, subspace_name=subspace_name)
-            # project function over entire function space or subspace
+            kwargs = {}
             if config.USE_ADJOINT:
+                kwargs['annotate'] = False
+            try:
+                solution_function = self._functionspace.extract_subspace_function(field_function,
+                                                                                  subspace_id=subspace_id, **kwargs)
+            except RuntimeError:
+                self.logger.warning("Cannot extract subspace function, projecting instead")
+                result_sub = self._functionspace.split_function(field_function, subspace_id=subspace_id)
                 solution_function = self._functionspace.project_over_space(result_sub,
-                                                                           subspace_name=subspace_name,
-                                                                           subspace_id=subspace_id,
-                                                                           annotate=False)
-            else:
-                solution_function = self._functionspace.project_over_space(result_sub,
-                                                                           subspace_name=subspace_name,
-                                                                           subspace_id=subspace_id)
+                                                                           subspace_id=subspace_id, **kwargs)
+            if self._cache_size > 0:
+                self._solution_cache[key] = solution_function
+                while len(self._solution_cache) > self._cache_size:
+                    self._solution_cache.popitem(last=False)
+                return solution_function.copy(deepcopy=True)
             return solution_function
 
 
@@ -1236,6 +1567,11 @@ class TimeSeriesMultiData():
         if tsd is not None:
             tsd.add_observation(field, time, time_step, recording_step, replace=replace)
 
+    def add_lazy_observation(self, name, field_loader, time, time_step, recording_step, replace=False):
+        tsd = self.get_time_series(name)
+        if tsd is not None:
+            tsd.add_lazy_observation(field_loader, time, time_step, recording_step, replace=replace)
+
     def get_solution_function(self, name, subspace_name=None, subspace_id=None, recording_step=None):
         tsd = self.get_time_series(name)
         if tsd is not None:
@@ -1282,7 +1618,18 @@ class TimeSeriesMultiData():
             function = fenics.Function(funspace)
             return function
 
-    def load_from_hdf5(self, path_to_file):
+    def _read_function_hdf5(self, name, path_to_file, dataset):
+        function = self._create_empty_function(name)
+        hdf = fenics.HDF5File(self._get_mpi_comm(), path_to_file, "r")
+        hdf.read(function, dataset)
+        hdf.close()
+        return function
+
+    def load_from_hdf5(self, path_to_file, lazy=False):
+        """
+        Loads all registered time series from hdf5 file written by `save_to_hdf5`.
+        :param lazy: if True, only the file index is read; fields are read when first accessed
+        """
         # get mpi_comm from one of the meshes
         mpi_comm = self._get_mpi_comm()
         # open file
@@ -1297,16 +1644,79 @@ class TimeSeriesMultiData():
                     dataset = name+"/vector_%d" % step
                     step_attribute = hdf.attributes(dataset)
                     time_step = step_attribute['timestamp']
-                    function = self._create_empty_function(name)
-                    #print("before assignment", function.vector().array())
-                    hdf.read(function, dataset)
-                    #print("after assignment", function.vector().array())
-                    self.add_observation(name, function,
-                                         time=time_step, time_step=time_step, recording_step=step)
+                    if lazy:
+                        field_loader = functools.partial(self._read_function_hdf5, name, path_to_file, dataset)
+                        self.add_lazy_observation(name, field_loader,
+                                                  time=time_step, time_step=time_step, recording_step=step)
+                    else:
+                        function = self._create_empty_function(name)
+                        #print("before assignment", function.vector().array())
+                        hdf.read(function, dataset)
+                        #print("after assignment", function.vector().array())
+                        self.add_observation(name, function,
+                                             time=time_step, time_step=time_step, recording_step=step)
             hdf.close()
         else:
             self.logger.warning("File '%s' does not exist"%path_to_file)
 
+    def save_to_hdf5_raw(self, path_to_file, replace=False):
+        """
+        Saves all time series as raw dof vectors, see `data_io.save_time_series_raw`.
+        Fields are written without projection or intermediate functions; only supported in serial runs.
+        """
+        for ts in self.get_all_time_series().values():
+            if fenics.MPI.size(ts._functionspace.function_space.mesh().mpi_comm()) > 1:
+                raise RuntimeError("Raw time series format is only supported in serial runs")
+        if os.path.exists(path_to_file):
+            self.logger.warning("File '%s' exists already."%path_to_file)
+            if replace:
+                self.logger.warning("Overwriting file '%s'." % path_to_file)
+                os.remove(path_to_file)
+            else:
+                self.logger.warning("Adding to existing file '%s'." % path_to_file)
+        for name, ts in self.get_all_time_series().items():
+            recording_steps = self.get_all_recording_steps(name)
+            if len(recording_steps) == 0:
+                continue
+            observations = [self.get_observation(name, recording_step) for recording_step in recording_steps]
+            vectors = [observation.get_field().vector().get_local() for observation in observations]
+            subspace_names = None
+            if ts._functionspace.has_subspaces:
+                subspace_names = ts._functionspace.subspaces.names
+            dio.save_time_series_raw(path_to_file, name, ts._functionspace.function_space, vectors,
+                                     recording_steps=recording_steps,
+                                     times=[observation.get_time() for observation in observations],
+                                     time_steps=[observation.get_time_step() for observation in observations],
+                                     subspace_names=subspace_names)
+
+    def _read_function_hdf5_raw(self, name, path_to_file, step_index):
+        function = self._create_empty_function(name)
+        return dio.assign_vector_to_function(function, dio.read_time_series_raw(path_to_file, name, steps=step_index))
+
+    def load_from_hdf5_raw(self, path_to_file, lazy=False):
+        """
+        Loads all registered time series from file written by `save_to_hdf5_raw`.
+        :param lazy: if True, only the file index is read; fields are read when first accessed
+        """
+        if not os.path.exists(path_to_file):
+            self.logger.warning("File '%s' does not exist" % path_to_file)
+            return
+        for name, ts in self.get_all_time_series().items():
+            info = dio.read_time_series_raw_info(path_to_file, name)
+            if info['element'] != str(ts._functionspace.function_space.ufl_element()):
+                self.logger.warning("Element of time series '%s' does not match registered function space" % name)
+            if not lazy:
+                values = dio.read_time_series_raw(path_to_file, name)
+            for i, recording_step in enumerate(info['recording_steps']):
+                if lazy:
+                    field_loader = functools.partial(self._read_function_hdf5_raw, name, path_to_file, i)
+                    self.add_lazy_observation(name, field_loader, time=info['times'][i],
+                                              time_step=info['time_steps'][i], recording_step=int(recording_step))
+                else:
+                    function = self._create_empty_function(name)
+                    dio.assign_vector_to_function(function, values[i])
+                    self.add_observation(name, function, time=info['times'][i], time_step=info['time_steps'][i],
+                                         recording_step=int(recording_step))
 
 
 class Results():
@@ -1438,11 +1848,21 @@ class Results():
             if hasattr(self, '_subdomains') and method=='vtk':
                 self.save_label_function(0, 0, method=method)
 
-    def save_solution_hdf5(self, save_path=None):
+    def save_solution_hdf5(self, save_path=None, raw=False):
+        """
+        Saves all solution time steps to hdf5.
+        :param raw: if True, dof vectors are written in raw format, see `TimeSeriesMultiData.save_to_hdf5_raw`
+        """
         if save_path is None:
-            save_path = os.path.join(self.output_dir, 'solution_timeseries.h5')
+            if raw:
+                save_path = os.path.join(self.output_dir, 'solution_timeseries_raw.h5')
+            else:
+                save_path = os.path.join(self.output_dir, 'solution_timeseries.h5')
             fu.ensure_dir_exists(save_path)
-        self.data.save_to_hdf5(save_path, replace=True)
+        if raw:
+            self.data.save_to_hdf5_raw(save_path, replace=True)
+        else:
+            self.data.save_to_hdf5(save_path, replace=True)
 
     def save_solution_end(self, method='xdmf'):
         if method is not None:
@@ -1532,6 +1952,7 @@ class PostProcess(ABC):
         self._subdomains = self._results._subdomains
         self._mesh = self._functionspace._mesh
         self._projection_parameters = self._functionspace._projection_parameters
+        self.set_derived_field_projection()
         self.set_output_dir(output_dir)
         self.plot_params = {   "showmesh": False,
                                "contour": False,
@@ -1541,8 +1962,12 @@ class PostProcess(ABC):
                                "dpi" : 300,
                                "alpha" : 1,
                                "alpha_f" : 1,
-                               "shading" : "gouraud"}
+                               "shading" : "gouraud",
+                               "render_mode": "mesh",
+                               "n_pixels": 500}
         self.update_plot_params(plot_params)
+        self._frame_renderer = None
+        self._view_mesh_data = None
 
     def update_plot_params(self, plot_params={}):
         self.plot_params.update(plot_params)
@@ -1563,13 +1988,84 @@ class PostProcess(ABC):
     def get_solution_concentration(self, recording_step=None):
         return self._results.get_solution_function(subspace_name='concentration', recording_step=recording_step)
 
-    def get_strain_tensor(self, recording_step=None):
-        VT = fenics.TensorFunctionSpace(self._mesh, "Lagrange", 1)
+    def set_derived_field_projection(self, projection_type='global', family='DG', degree=0):
+        """
+        Defines how derived fields (strain, stress, pressure, ...) are computed from the solution.
+        :param projection_type: 'global' for L2 projection onto P1 space,
+                                'local' for element-wise projection onto `family` space of `degree`
+        :param family: 'DG' or 'Quadrature', only used for local projection
+        :param degree: element degree, only used for local projection
+        """
+        self._derived_field_projection = {'projection_type': projection_type, 'family': family, 'degree': degree}
+
+    def _get_derived_functionspace(self, kind):
+        if self._derived_field_projection['projection_type'] == 'local':
+            return self._functionspace.get_derived_functionspace(kind,
+                                                                 family=self._derived_field_projection['family'],
+                                                                 degree=self._derived_field_projection['degree'])
+        else:
+            return self._functionspace.get_derived_functionspace(kind)
+
+    def get_derived_expression(self, name, recording_step=None):
+        """
+        Returns ufl expression of derived field `name` and its kind ('scalar', 'vector', 'tensor').
+        Expressions are defined by methods `_expr_<name>`.
+        """
+        return getattr(self, '_expr_' + name)(recording_step=recording_step)
+
+    def get_derived_field(self, name, recording_step=None):
+        """
+        Computes derived field `name` as defined by `set_derived_field_projection`.
+        """
+        expr, kind = self.get_derived_expression(name, recording_step=recording_step)
+        V = self._get_derived_functionspace(kind)
+        if self._derived_field_projection['projection_type'] == 'local':
+            function = self._functionspace.project_local(expr, V)
+        else:
+            function = self._functionspace.project(expr, V)
+        function.rename(name, '')
+        return function
+
+    def get_derived_fields(self, names, recording_step=None):
+        """
+        Computes multiple derived fields.
+        For local projection, all fields are computed in a single assembly loop over cells.
+        :param names: list of derived field names
+        :return: dictionary {name : function}
+        """
+        if self._derived_field_projection['projection_type'] == 'local':
+            expr_dict = {name: self.get_derived_expression(name, recording_step=recording_step) for name in names}
+            function_dict = self._functionspace.project_local_batch(expr_dict,
+                                                                    family=self._derived_field_projection['family'],
+                                                                    degree=self._derived_field_projection['degree'])
+            for name, function in function_dict.items():
+                function.rename(name, '')
+        else:
+            function_dict = {name: self.get_derived_field(name, recording_step=recording_step) for name in names}
+        return function_dict
+
+    def _expr_strain_tensor(self, recording_step=None):
         displacement = self.get_solution_displacement(recording_step=recording_step)
-        strain_tensor = mle.compute_strain(displacement)
-        strain_tensor_fct = fenics.project(strain_tensor, VT, **self._projection_parameters)
-        strain_tensor_fct.rename("strain_tensor", "")
-        return strain_tensor_fct
+        return mle.compute_strain(displacement), 'tensor'
+
+    def _expr_pressure(self, recording_step=None):
+        stress, _ = self._expr_stress_tensor(recording_step=recording_step)
+        return mle.compute_pressure_from_stress_tensor(stress), 'scalar'
+
+    def _expr_van_mises_stress(self, recording_step=None):
+        stress, _ = self._expr_stress_tensor(recording_step=recording_step)
+        return mle.compute_van_mises_stress(stress, self._functionspace.dim_geo), 'scalar'
+
+    def _expr_displacement_norm(self, recording_step=None):
+        displacement = self.get_solution_displacement(recording_step=recording_step)
+        return fenics.inner(displacement, displacement)**0.5, 'scalar'
+
+    @abstractmethod
+    def _expr_stress_tensor(self, recording_step=None):
+        pass
+
+    def get_strain_tensor(self, recording_step=None):
+        return self.get_derived_field('strain_tensor', recording_step=recording_step)
 
     @abstractmethod
     def get_stress_tensor(self, recording_step=None):
@@ -1584,20 +2080,10 @@ class PostProcess(ABC):
         pass
 
     def get_pressure(self, recording_step=None):
-        stress = self.get_stress_tensor(recording_step=recording_step)
-        pressure      = mle.compute_pressure_from_stress_tensor(stress)
-        F = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        pressure_fct = fenics.project(pressure, F, **self._projection_parameters)
-        pressure_fct.rename("pressure", '')
-        return pressure_fct
+        return self.get_derived_field('pressure', recording_step=recording_step)
 
     def get_van_mises_stress(self, recording_step=None):
-        stress = self.get_stress_tensor(recording_step=recording_step)
-        van_mises_stress = mle.compute_van_mises_stress(stress, self._functionspace.dim_geo)
-        F = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        van_mises_stress_fct = fenics.project(van_mises_stress, F, **self._projection_parameters)
-        van_mises_stress_fct.rename("pressure", '')
-        return van_mises_stress_fct
+        return self.get_derived_field('van_mises_stress', recording_step=recording_step)
 
     def compute_force(self, recording_step=None, subdomain_id=None):
         n   = fenics.FacetNormal(self._mesh)
@@ -1610,12 +2096,7 @@ class PostProcess(ABC):
         return force
 
     def get_displacement_norm(self, recording_step=None):
-        displacement = self.get_solution_displacement(recording_step=recording_step)
-        disp_norm = fenics.inner(displacement,displacement)**0.5
-        F = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        disp_norm_fct = fenics.project(disp_norm, F, **self._projection_parameters)
-        disp_norm_fct.rename("displacement_norm", '')
-        return disp_norm_fct
+        return self.get_derived_field('displacement_norm', recording_step=recording_step)
 
     def plot_function(self, function, recording_step, name, file_name=None, units=None, output_dir=None,
                       show_labels=False, **kwargs):
@@ -1639,9 +2120,9 @@ class PostProcess(ABC):
         plot_params.update(kwargs)
         save_path = os.path.join(output_dir, file_name)
         if not show_labels:
-            plott.show_img_seg_f(function=function, path=save_path, **plot_params)
+            self._show_img_seg_f(function=function, path=save_path, **plot_params)
         else:
-            labels = self.get_label_function()
+            labels = self._get_plot_data(self.get_label_function())
             plot_obj_label = {'object': labels,
                               'cbar_label': None,
                               'exclude_below': None,
@@ -1656,12 +2137,56 @@ class PostProcess(ABC):
                               'alpha': 1,
                               'norm': None,
                               'norm_ref': None,
-                              'color': None
+                              'color': None,
+                              'render_mode': plot_params.get('render_mode', 'mesh'),
+                              'n_pixels': plot_params.get('n_pixels', 500)
                               }
-            plott.show_img_seg_f(function=function, path=save_path,
+            self._show_img_seg_f(function=function, path=save_path,
                                  add_plot_object_pre=plot_obj_label,
                                  **plot_params)
 
+    def _get_plot_data(self, function):
+        """
+        Returns function itself, or its vertex values (on deformed mesh coordinates within `deformed_view` context)
+        if these are needed for plotting.
+        """
+        mesh_data = None
+        if self._view_mesh_data is not None:
+            if function.function_space().mesh().id() == self._mesh.id():
+                mesh_data = self._view_mesh_data
+            else:
+                self.logger.warning("Function '%s' is not defined on simulation mesh, "
+                                    "plotting in reference configuration" % function.name())
+        if mesh_data is not None or self._frame_renderer is not None:
+            return vh.FunctionData(function, mesh_data=mesh_data)
+        return function
+
+    def _show_img_seg_f(self, function, **kwargs):
+        """
+        Plots immediately, or hands plot data to frame renderer if plotting within `rendering` context.
+        """
+        function = self._get_plot_data(function)
+        if self._frame_renderer is not None:
+            self._frame_renderer.submit(function=function, **kwargs)
+        else:
+            plott.show_img_seg_f(function=function, **kwargs)
+
+    @contextlib.contextmanager
+    def rendering(self, n_processes=None, movie_format=None, fps=5):
+        """
+        Context in which plots are rendered by `n_processes` worker processes.
+        The main process only extracts vertex values of the plotted functions.
+        :param movie_format: 'mp4' or 'gif' to stitch frames of each output directory into movie, optional
+        """
+        with vf.FrameRenderer(n_processes=n_processes) as renderer:
+            self._frame_renderer = renderer
+            try:
+                yield renderer
+            finally:
+                self._frame_renderer = None
+        if movie_format is not None:
+            vf.stitch_frames_by_directory(renderer.paths, movie_format=movie_format, fps=fps)
+
     def plot_concentration(self, recording_step, **kwargs):
         conc = self.get_solution_concentration(recording_step=recording_step)
         plot_params = { "range_f" : [0.000, 1.0] }
@@ -1709,22 +2234,75 @@ class PostProcess(ABC):
                            file_name=None, units=None,
                            output_dir=os.path.join(self.get_output_dir(), 'label_function'), **plot_params)
 
+    def get_deformed_coordinates(self, recording_step=None):
+        """
+        Returns vertex coordinates of simulation mesh displaced by the simulated displacement at `recording_step`.
+        The simulation mesh is not modified.
+        """
+        displacement = self.get_solution_displacement(recording_step)
+        coordinates = self._mesh.coordinates()
+        values = displacement.compute_vertex_values(self._mesh)
+        return coordinates + values.reshape(coordinates.shape[1], -1).T
+
+    def get_deformed_mesh(self, recording_step=None):
+        """
+        Returns copy of simulation mesh in deformed configuration, e.g. for exporting deformed fields.
+        Topology and dof numbering are identical to the simulation mesh, see `get_function_on_mesh`.
+        """
+        mesh = fenics.Mesh(self._mesh)
+        mesh.coordinates()[:] = self.get_deformed_coordinates(recording_step)
+        mesh.bounding_box_tree().build(mesh)
+        return mesh
+
+    def get_function_on_mesh(self, function, mesh):
+        """
+        Copies function defined on simulation mesh to `mesh` with identical topology, e.g. from `get_deformed_mesh`.
+        """
+        V = fenics.FunctionSpace(mesh, function.function_space().ufl_element())
+        function_on_mesh = fenics.Function(V)
+        function_on_mesh.vector().set_local(function.vector().get_local())
+        function_on_mesh.vector().apply('insert')
+        function_on_mesh.rename(function.name(), '')
+        return function_on_mesh
+
+    @contextlib.contextmanager
+    def deformed_view(self, recording_step):
+        """
+        Context in which plots show the deformed configuration at `recording_step`.
+        Fields are computed on the reference mesh and drawn at displaced vertex positions;
+        the simulation mesh is not modified.
+        """
+        self._view_mesh_data = vh.MeshData(self._mesh, coordinates=self.get_deformed_coordinates(recording_step))
+        try:
+            yield self._view_mesh_data
+        finally:
+            self._view_mesh_data = None
+
+    def _view(self, recording_step, deformed):
+        if deformed:
+            return self.deformed_view(recording_step)
+        return contextlib.ExitStack()
+
     def _update_mesh_displacements(self, displacement):
         """
         Applies displacement function to mesh.
         .. warning:: This changes the current mesh! Multiple updates result in additive mesh deformations!
+                     Use `deformed_view` or `get_deformed_mesh` instead.
         """
         fenics.ALE.move(self._mesh, displacement)
         self._mesh.bounding_box_tree().build(self._mesh)
+        # mass matrices of cached projectors are no longer valid on deformed mesh
+        self._functionspace.clear_projectors()
 
     def update_mesh_displacement(self, recording_step=None, reverse=False):
         """
         Update mesh with simulated displacement from specified time-point.
         .. warning:: This changes the current mesh! Multiple updates result in additive mesh deformations!
+                     Use `deformed_view` or `get_deformed_mesh` instead.
         """
         displacement = self.get_solution_displacement(recording_step)
         if reverse:
-            neg_disp = fenics.project(-1*displacement, displacement.function_space(),  **self._projection_parameters)
+            neg_disp = self._functionspace.project(-1*displacement, displacement.function_space())
             self._update_mesh_displacements(neg_disp)
         else:
             self._update_mesh_displacements(displacement)
@@ -1733,57 +2311,52 @@ class PostProcess(ABC):
 
 class PostProcessTumorGrowth(PostProcess):
 
-    def get_stress_tensor(self, recording_step=None):
-        VT = fenics.TensorFunctionSpace(self._mesh, "Lagrange", 1)
+    def _expr_stress_tensor(self, recording_step=None):
         displacement = self.get_solution_displacement(recording_step=recording_step)
         mu = mle.compute_mu(self._params.E, self._params.poisson)
         lmbda = mle.compute_lambda(self._params.E, self._params.poisson)
-        stress_tensor = mle.compute_stress(displacement, mu=mu, lmbda=lmbda)
-        stress_tensor_fct = fenics.project(stress_tensor, VT, **self._projection_parameters)
-        stress_tensor_fct.rename("stress_tensor", "")
-        return stress_tensor_fct
+        return mle.compute_stress(displacement, mu=mu, lmbda=lmbda), 'tensor'
 
-    def get_logistic_growth(self, recording_step=None):
+    def _expr_log_growth(self, recording_step=None):
         concentration = self.get_solution_concentration(recording_step=recording_step)
-        log_growth = mrd.compute_growth_logistic(concentration, self._params.proliferation, 1.0)
-        F = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        log_growth_fct = fenics.project(log_growth, F, **self._projection_parameters)
-        log_growth_fct.rename("log_growth", '')
-        return log_growth_fct
+        return mrd.compute_growth_logistic(concentration, self._params.proliferation, 1.0), 'scalar'
 
-    def get_mech_expansion(self, recording_step=None):
-        VT = fenics.TensorFunctionSpace(self._mesh, "Lagrange", 1)
+    def _expr_mech_expansion(self, recording_step=None):
         concentration = self.get_solution_concentration(recording_step=recording_step)
+        return mle.compute_growth_induced_strain(concentration, self._params.coupling,
+                                                 self._functionspace.dim_geo), 'tensor'
 
-        mech_exp = mle.compute_growth_induced_strain(concentration, self._params.coupling, self._functionspace.dim_geo)
-        mech_exp_fct = fenics.project(mech_exp, VT, **self._projection_parameters)
-        mech_exp_fct.rename("mech_expansion", '')
-        return mech_exp_fct
+    def _expr_total_jacobian(self, recording_step=None):
+        displacement = self.get_solution_displacement(recording_step=recording_step)
+        return mle.compute_total_jacobian(displacement), 'scalar'
 
-    def get_total_jacobian(self, recording_step=None):
-        V = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
+    def _expr_growth_induced_jacobian(self, recording_step=None):
+        strain_growth, _ = self._expr_mech_expansion(recording_step=recording_step)
+        return mle.compute_growth_induced_jacobian(strain_growth, self._functionspace.dim_geo), 'scalar'
+
+    def _expr_concentration_deformed_config(self, recording_step=None):
+        concentration = self.get_solution_concentration(recording_step=recording_step)
         displacement = self.get_solution_displacement(recording_step=recording_step)
-        jac = mle.compute_total_jacobian(displacement)
-        jac_fct = fenics.project(jac, V, **self._projection_parameters)
-        jac_fct.rename("total_jacobian", '')
-        return jac_fct
+        return mle.compute_concentration_deformed(concentration, displacement, self._params.coupling,
+                                                  self._functionspace.dim_geo), 'scalar'
+
+    def get_stress_tensor(self, recording_step=None):
+        return self.get_derived_field('stress_tensor', recording_step=recording_step)
+
+    def get_logistic_growth(self, recording_step=None):
+        return self.get_derived_field('log_growth', recording_step=recording_step)
+
+    def get_mech_expansion(self, recording_step=None):
+        return self.get_derived_field('mech_expansion', recording_step=recording_step)
+
+    def get_total_jacobian(self, recording_step=None):
+        return self.get_derived_field('total_jacobian', recording_step=recording_step)
 
     def get_growth_induced_jacobian(self, recording_step=None):
-        V = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        strain_growth = self.get_mech_expansion(recording_step)
-        jac_growth = mle.compute_growth_induced_jacobian(strain_growth, self._functionspace.dim_geo)
-        jac_growth_fct = fenics.project(jac_growth, V, **self._projection_parameters)
-        jac_growth_fct.rename("growth_induced_jacobian", '')
-        return jac_growth_fct
+        return self.get_derived_field('growth_induced_jacobian', recording_step=recording_step)
 
     def get_concentration_deformed_configuration(self, recording_step=None):
-        concentration = self.get_solution_concentration(recording_step=recording_step)
-        displacement = self.get_solution_displacement(recording_step=recording_step)
-        V = fenics.FunctionSpace(self._mesh, "Lagrange", 1)
-        conc_def = mle.compute_concentration_deformed(concentration, displacement, self._params.coupling, self._functionspace.dim_geo)
-        conc_def_fct = fenics.project(conc_def, V, **self._projection_parameters)
-        conc_def_fct.rename("concentration_deformed_config", '')
-        return conc_def_fct
+        return self.get_derived_field('concentration_deformed_config', recording_step=recording_step)
 
     def plot_concentration_deformed_configuration(self, recording_step, **kwargs):
         conc_def = self.get_concentration_deformed_configuration(recording_step=recording_step)
@@ -1824,10 +2397,13 @@ class PostProcessTumorGrowth(PostProcess):
                            file_name=None, units=None,
                            output_dir=os.path.join(self.get_output_dir(), 'growth_induced_jacobian'), **plot_params)
 
-    def plot_all(self, deformed=False, selection=slice(None), output_dir=None, **kwargs):
+    def plot_all(self, deformed=False, selection=slice(None), output_dir=None, n_processes=1, movie_format=None,
+                 **kwargs):
         """
         :param deformed: boolean flag for mesh deformation
         :param selection: slice object, e.g. slice(10,-1,5)
+        :param n_processes: number of rendering processes, see `rendering`
+        :param movie_format: 'mp4' or 'gif' to combine frames of each field into movie, optional
         :return:
         """
         if output_dir is not None:
@@ -1842,26 +2418,28 @@ class PostProcessTumorGrowth(PostProcess):
             steps = selection
         else:
             print("cannot handle selection '%s'"%selection)
-        for recording_step in steps:
-            if deformed:
-                self.update_mesh_displacement(recording_step)
-                self.plot_label_function(recording_step, **kwargs) # if deformed, plot label function in every time step
-            self.plot_concentration(recording_step, **kwargs)
-            self.plot_displacement(recording_step, **kwargs)
-            self.plot_pressure(recording_step, **kwargs)
-            self.plot_displacement_norm(recording_step, **kwargs)
-            self.plot_log_growth(recording_step, **kwargs)
-            self.plot_total_jacobian(recording_step, **kwargs)
-            self.plot_growth_induced_jacobian(recording_step, **kwargs)
-            self.plot_van_mises_stress(recording_step, **kwargs)
-            self.plot_concentration_deformed_configuration(recording_step, **kwargs)
-            if deformed:
-                self.update_mesh_displacement(recording_step, reverse=True)
-
-    def plot_for_pub(self, deformed=False, selection=slice(None), output_dir=None, **kwargs):
+        with self.rendering(n_processes=n_processes, movie_format=movie_format):
+            for recording_step in steps:
+                with self._view(recording_step, deformed):
+                    if deformed:
+                        self.plot_label_function(recording_step, **kwargs) # if deformed, plot label function in every time step
+                    self.plot_concentration(recording_step, **kwargs)
+                    self.plot_displacement(recording_step, **kwargs)
+                    self.plot_pressure(recording_step, **kwargs)
+                    self.plot_displacement_norm(recording_step, **kwargs)
+                    self.plot_log_growth(recording_step, **kwargs)
+                    self.plot_total_jacobian(recording_step, **kwargs)
+                    self.plot_growth_induced_jacobian(recording_step, **kwargs)
+                    self.plot_van_mises_stress(recording_step, **kwargs)
+                    self.plot_concentration_deformed_configuration(recording_step, **kwargs)
+
+    def plot_for_pub(self, deformed=False, selection=slice(None), output_dir=None, n_processes=1, movie_format=None,
+                     **kwargs):
         """
         :param deformed: boolean flag for mesh deformation
         :param selection: slice object, e.g. slice(10,-1,5)
+        :param n_processes: number of rendering processes, see `rendering`
+        :param movie_format: 'mp4' or 'gif' to combine frames of each field into movie, optional
         :return:
         """
         if output_dir is not None:
@@ -1884,23 +2462,22 @@ class PostProcessTumorGrowth(PostProcess):
             steps = selection
         else:
             print("cannot handle selection '%s'"%selection)
-        for recording_step in steps:
-            if deformed:
-                self.update_mesh_displacement(recording_step)
-                self.plot_label_function(recording_step, n_cmap_levels=4, colormap='Greys_r',
-                                         **plot_params) # if deformed, plot label function in every time step
-            self.plot_concentration(recording_step, exclude_below=0.01, exclude_min_max=True, show_labels=True,
-                                    **plot_params)
-            self.plot_displacement(recording_step, **plot_params)
-            self.plot_pressure(recording_step, **plot_params)
-            self.plot_displacement_norm(recording_step, **plot_params)
-            self.plot_log_growth(recording_step, **plot_params)
-            self.plot_total_jacobian(recording_step, **plot_params)
-            self.plot_growth_induced_jacobian(recording_step, **plot_params)
-            self.plot_van_mises_stress(recording_step, **plot_params)
-            self.plot_concentration_deformed_configuration(recording_step, **plot_params)
-            if deformed:
-                self.update_mesh_displacement(recording_step, reverse=True)
+        with self.rendering(n_processes=n_processes, movie_format=movie_format):
+            for recording_step in steps:
+                with self._view(recording_step, deformed):
+                    if deformed:
+                        self.plot_label_function(recording_step, n_cmap_levels=4, colormap='Greys_r',
+                                                 **plot_params) # if deformed, plot label function in every time step
+                    self.plot_concentration(recording_step, exclude_below=0.01, exclude_min_max=True, show_labels=True,
+                                            **plot_params)
+                    self.plot_displacement(recording_step, **plot_params)
+                    self.plot_pressure(recording_step, **plot_params)
+                    self.plot_displacement_norm(recording_step, **plot_params)
+                    self.plot_log_growth(recording_step, **plot_params)
+                    self.plot_total_jacobian(recording_step, **plot_params)
+                    self.plot_growth_induced_jacobian(recording_step, **plot_params)
+                    self.plot_van_mises_stress(recording_step, **plot_params)
+                    self.plot_concentration_deformed_configuration(recording_step, **plot_params)
         # plot colorbars separately
         plot_params_2 = {'show_axes': False,
                           'show_ticks': False,
@@ -1919,7 +2496,7 @@ class PostProcessTumorGrowth(PostProcess):
         self.plot_displacement_norm(step, **plot_params_2, range_f=[0, 8])
         self.plot_total_jacobian(step, **plot_params_2)
 
-    def save_all(self, save_method='xdmf', clear_all=False, selection=slice(None), output_dir=None):
+    def save_all(self, save_method='xdmf', clear_all=False, selection=slice(None), output_dir=None, n_processes=1):
         if output_dir is not None:
             self.set_output_dir(output_dir)
         self._results.set_save_output_dir(self.get_output_dir())
@@ -1934,10 +2511,11 @@ class PostProcessTumorGrowth(PostProcess):
             current_sim_time = self._results.get_result(recording_step=recording_step).get_time_step()
             u = self._results.get_solution_function(recording_step=recording_step)
             self._results.save_solution(recording_step, current_sim_time, function=u, method=save_method)
-            # try merging those files into single vtu
-            if save_method != 'xdmf':
-                dio.merge_vtus_timestep(self.get_output_dir(), recording_step, remove=False, reference_file_path=None)
         self._results.save_solution_end(method=save_method)
+        # try merging those files into single vtu per time step
+        if save_method != 'xdmf':
+            dio.merge_vtus(self.get_output_dir(), steps, remove=False, reference_file_path=None,
+                           n_processes=n_processes)
 
 
 class PostProcessTumorGrowthBrain(PostProcessTumorGrowth):
@@ -1972,6 +2550,105 @@ class PostProcessTumorGrowthBrain(PostProcessTumorGrowth):
             self._params.set_parameter('proliferation', prolif)
 
 
+class FieldMetrics():
+    """
+    Computes volume and center of mass of thresholded scalar fields for many time steps, thresholds and subdomains
+    at once.
+    Lumped (per dof) subdomain volumes and dof coordinates are computed once; volumes and centers of mass of the
+    thresholded field are then obtained by matrix products with the (steps x dofs) matrix of field values.
+    The thresholded field is represented by its nodal interpolant, i.e. a dof contributes its lumped volume if its
+    value is >= threshold.
+    """
+
+    def __init__(self, functionspace, dx=None, tissue_id_name_map=None):
+        """
+        :param functionspace: fenics function space of scalar field
+        :param dx: fenics measure with subdomain data, e.g. SubDomains.dx
+        :param tissue_id_name_map: dictionary {subdomain_id : subdomain_name}
+        """
+        self.logger = logging.getLogger(__name__)
+        self.functionspace = functionspace
+        self.mpi_comm = functionspace.mesh().mpi_comm()
+        if dx is None:
+            dx = fenics.dx
+        if tissue_id_name_map is None:
+            tissue_id_name_map = {}
+        self.subdomain_names = ['all'] + list(tissue_id_name_map.values())
+        measures = [dx] + [dx(subdomain_id) for subdomain_id in tissue_id_name_map.keys()]
+        # -- lumped volume per dof and subdomain, n_subdomains x n_dofs
+        self.lumped_volumes = np.array([self._compute_lumped_volume(measure) for measure in measures])
+        # -- dof coordinates, n_dofs x dim
+        self.dof_coordinates = dio.get_dof_coordinate_map(functionspace)
+        self.dim = self.dof_coordinates.shape[1]
+        # -- first moments per dof, subdomain and coordinate, n_dofs x (n_subdomains * dim)
+        moments = self.lumped_volumes[:, :, np.newaxis] * self.dof_coordinates[np.newaxis, :, :]
+        self.lumped_moments = np.transpose(moments, (1, 0, 2)).reshape((self.dof_coordinates.shape[0], -1))
+
+    def _compute_lumped_volume(self, measure):
+        v = fenics.TestFunction(self.functionspace)
+        # row-sum lumping: integral of each basis function
+        row_sum = fenics.assemble(v * measure).get_local()
+        if self.functionspace.ufl_element().degree() == 1:
+            return row_sum
+        else:
+            # diagonal scaling lumping, positive for higher order elements
+            u = fenics.TrialFunction(self.functionspace)
+            mass_matrix = fenics.assemble(u * v * measure)
+            diagonal = fenics.Vector()
+            mass_matrix.init_vector(diagonal, 0)
+            mass_matrix.get_diagonal(diagonal)
+            diagonal = diagonal.get_local()
+            volume, diagonal_sum = dio.mpi_sum_array(self.mpi_comm, [row_sum.sum(), diagonal.sum()])
+            if diagonal_sum > 0:
+                return diagonal * volume / diagonal_sum
+            else:
+                return diagonal
+
+    def compute(self, values, thresholds, recording_steps=None):
+        """
+        :param values: array n_steps x n_dofs of field values, local dofs of this process
+        :param thresholds: list of thresholds
+        :param recording_steps: list of recording step ids, defaults to range(n_steps)
+        :return: pandas DataFrame with columns
+                 'sim_time_step', 'threshold', 'subdomain', 'volume', 'com_0', ..., 'com_<dim-1>'
+        """
+        values = np.atleast_2d(values)
+        n_steps = values.shape[0]
+        n_subdomains = len(self.subdomain_names)
+        if recording_steps is None:
+            recording_steps = np.arange(n_steps)
+        # -- local volumes and first moments for all thresholds, n_thresholds x n_steps x (n_subdomains * (1 + dim))
+        lumped = np.hstack([self.lumped_volumes.T, self.lumped_moments])
+        local = np.array([(values >= threshold).astype(float).dot(lumped) for threshold in thresholds])
+        # -- single reduction over processes
+        reduced = dio.mpi_sum_array(self.mpi_comm, local)
+        df_list = []
+        for threshold, reduced_threshold in zip(thresholds, reduced):
+            volumes = reduced_threshold[:, :n_subdomains]  # n_steps x n_subdomains
+            moments = reduced_threshold[:, n_subdomains:].reshape((n_steps, n_subdomains, self.dim))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                coms = np.where(volumes[:, :, np.newaxis] > 0, moments / volumes[:, :, np.newaxis], np.nan)
+            df_dict = {'sim_time_step': np.repeat(recording_steps, n_subdomains),
+                       'threshold': threshold,
+                       'subdomain': np.tile(self.subdomain_names, n_steps),
+                       'volume': volumes.flatten()}
+            for i in range(self.dim):
+                df_dict['com_%i' % i] = coms[:, :, i].flatten()
+            df_list.append(pd.DataFrame(df_dict))
+        columns = ['sim_time_step', 'threshold', 'subdomain', 'volume'] + ['com_%i' % i for i in range(self.dim)]
+        return pd.concat(df_list, ignore_index=True)[columns]
+
+    def compute_from_results(self, results, thresholds, subspace_id=None, subspace_name=None):
+        """
+        Computes metrics for all recording steps of Results instance.
+        """
+        recording_steps = results.get_recording_steps()
+        values = np.array([results.get_solution_function(subspace_id=subspace_id, subspace_name=subspace_name,
+                                                         recording_step=step).vector().get_local()
+                           for step in recording_steps])
+        return self.compute(values, thresholds, recording_steps=recording_steps)
+
+
 class Comparison():
 
     def __init__(self, sim1, sim2):
@@ -0,0 +1,338 @@
+"""
+Observers are evaluated on the current solution after each step of `FenicsSimulation.run` and reduce it to scalar
+quantities, e.g. tumor volume or maximum displacement.
+Their outputs are collected in an `ObserverTable`, so that per-step metrics do not require storing the solution
+of every step.
+"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+from glimslib import fenics_local as fenics
+import glimslib.utils.data_io as dio
+
+
+def get_subspace_node_dofs(functionspace, subspace_id=None, subspace_name=None):
+    """
+    Returns process-local indices into `function.vector().get_local()` of all dofs of a subspace, grouped by node.
+    Only dofs owned by the current process are included.
+    :param functionspace: instance of helper_classes.FunctionSpace
+    :return: array n_nodes x n_components
+    """
+    V = functionspace.function_space
+    if functionspace.has_subspaces:
+        if subspace_id is None:
+            subspace_id = functionspace.subspaces.get_subspace_id(subspace_name)
+        V = V.sub(subspace_id)
+    if V.num_sub_spaces() > 0:
+        components = [V.sub(i) for i in range(V.num_sub_spaces())]
+    else:
+        components = [V]
+    node_dofs = np.stack([dio.get_cell_dofs(component).flatten() for component in components], axis=1)
+    node_dofs = np.unique(node_dofs, axis=0)
+    local_size = fenics.Function(functionspace.function_space).vector().local_size()
+    return node_dofs[node_dofs[:, 0] < local_size]
+
+
+class Observer(ABC):
+    """
+    Base class for observers.
+    `setup` is called once before the first step, `observe` after each observed step.
+    """
+
+    def setup(self, functionspace, subdomains=None):
+        """
+        :param functionspace: instance of helper_classes.FunctionSpace
+        :param subdomains: instance of helper_classes.SubDomains
+        """
+        self.logger = logging.getLogger(__name__)
+        self.functionspace = functionspace
+        self.subdomains = subdomains
+        self.mpi_comm = functionspace._mesh.mpi_comm()
+
+    @abstractmethod
+    def observe(self, solution, time):
+        """
+        :param solution: current solution function
+        :param time: current simulation time
+        :return: dictionary {column name: scalar}
+        """
+        pass
+
+    def save(self, output_dir):
+        """
+        Writes observations that are not part of the ObserverTable, called by `ObserverTable.save`.
+        """
+        pass
+
+
+class CallbackObserver(Observer):
+    """
+    Wraps function `callback(solution, time)` that returns a scalar or a dictionary {column name: scalar}.
+    """
+
+    def __init__(self, callback, name='observer'):
+        self.callback = callback
+        self.name = name
+
+    def observe(self, solution, time):
+        result = self.callback(solution, time)
+        if isinstance(result, dict):
+            return result
+        return {self.name: result}
+
+
+class ThresholdVolumeObserver(Observer):
+    """
+    Volume and center of mass of the region where a scalar subspace field is >= threshold.
+    As in `helper_classes.FieldMetrics`, a dof contributes its lumped (row-sum) volume if its value is above the
+    threshold; lumped volumes are assembled once, each observation is a sum over local dofs and one MPI reduction.
+    """
+
+    def __init__(self, thresholds, subspace_name='concentration', subdomain_name=None, center_of_mass=True,
+                 name='volume'):
+        """
+        :param thresholds: list of thresholds
+        :param subdomain_name: restrict volume to subdomain, optional
+        :param center_of_mass: also compute center of mass, columns 'com_<i>_<threshold>'
+        """
+        self.thresholds = thresholds
+        self.subspace_name = subspace_name
+        self.subdomain_name = subdomain_name
+        self.center_of_mass = center_of_mass
+        self.name = name
+
+    def setup(self, functionspace, subdomains=None):
+        super().setup(functionspace, subdomains)
+        V = functionspace.function_space
+        v = fenics.TestFunction(V)
+        if functionspace.has_subspaces:
+            v = fenics.split(v)[functionspace.subspaces.get_subspace_id(self.subspace_name)]
+        if self.subdomain_name is not None:
+            dx = subdomains.dx(subdomains.get_subdomain_id(self.subdomain_name))
+        else:
+            dx = fenics.dx(domain=functionspace._mesh)
+        self.dofs = get_subspace_node_dofs(functionspace, subspace_name=self.subspace_name)[:, 0]
+        self.lumped_volumes = fenics.assemble(v * dx).get_local()[self.dofs]
+        dof_coordinates = dio.get_dof_coordinate_map(V)
+        self.lumped_moments = self.lumped_volumes[:, np.newaxis] * dof_coordinates[self.dofs]
+
+    def observe(self, solution, time):
+        values = solution.vector().get_local()[self.dofs]
+        result = {}
+        for threshold in self.thresholds:
+            indicator = values >= threshold
+            volume = fenics.MPI.sum(self.mpi_comm, float(self.lumped_volumes[indicator].sum()))
+            result['%s_%s' % (self.name, threshold)] = volume
+            if self.center_of_mass:
+                moments = self.lumped_moments[indicator].sum(axis=0)
+                for i, moment in enumerate(moments):
+                    moment = fenics.MPI.sum(self.mpi_comm, float(moment))
+                    result['com_%i_%s' % (i, threshold)] = moment / volume if volume > 0 else np.nan
+        return result
+
+
+class MaxObserver(Observer):
+    """
+    Maximum of a subspace field over its dofs; for vector fields the maximum of the nodal magnitude.
+    """
+
+    def __init__(self, subspace_name='displacement', name=None):
+        self.subspace_name = subspace_name
+        if name is None:
+            name = 'max_%s' % subspace_name
+        self.name = name
+
+    def setup(self, functionspace, subdomains=None):
+        super().setup(functionspace, subdomains)
+        self.node_dofs = get_subspace_node_dofs(functionspace, subspace_name=self.subspace_name)
+
+    def observe(self, solution, time):
+        values = solution.vector().get_local()[self.node_dofs]
+        if values.shape[1] > 1:
+            values = np.linalg.norm(values, axis=1)
+        else:
+            values = values[:, 0]
+        local_max = float(values.max()) if len(values) > 0 else -np.inf
+        return {self.name: fenics.MPI.max(self.mpi_comm, local_max)}
+
+
+def _get_mpi4py_comm(mpi_comm):
+    # fenics 2017.2 returns petsc4py communicators
+    if hasattr(mpi_comm, 'tompi4py'):
+        return mpi_comm.tompi4py()
+    return mpi_comm
+
+
+class PointProbes(Observer):
+    """
+    Records subspace values at fixed points after each observed step.
+    Points are located and Lagrange basis functions evaluated once, each observation is a sparse matrix-vector
+    product with the dof vector.
+    In MPI runs, each point is evaluated by the lowest rank whose mesh partition contains it; values are gathered
+    on rank 0, see `get_values`.
+    """
+
+    def __init__(self, points, subspace_names=('concentration', 'displacement'), name='probes'):
+        """
+        :param points: array n_points x dim
+        :param subspace_names: subspaces to be recorded, ignored if functionspace has no subspaces
+        """
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+        self.subspace_names = list(subspace_names)
+        self.name = name
+
+    def setup(self, functionspace, subdomains=None):
+        from scipy.sparse import csr_matrix
+        super().setup(functionspace, subdomains)
+        mesh = functionspace._mesh
+        self.rank = fenics.MPI.rank(self.mpi_comm)
+        self.parallel = fenics.MPI.size(self.mpi_comm) > 1
+        cell_ids, bary = dio.locate_points(mesh, self.points)
+        found = cell_ids >= 0
+        if self.parallel:
+            found_all = np.array(_get_mpi4py_comm(self.mpi_comm).allgather(found))
+            owned = np.logical_and(found, np.argmax(found_all, axis=0) == self.rank)
+            found_any = found_all.any(axis=0)
+        else:
+            owned = found
+            found_any = found
+        if not found_any.all() and self.rank == 0:
+            self.logger.warning("%i of %i probe points are outside of the mesh, their values are NaN"
+                                % ((~found_any).sum(), len(found_any)))
+        self.point_ids = np.where(owned)[0]
+        V = functionspace.function_space
+        if functionspace.has_subspaces:
+            subspaces = {name: V.sub(functionspace.subspaces.get_subspace_id(name)) for name in self.subspace_names}
+        else:
+            subspaces = {functionspace.name: V}
+        self.subspace_names = list(subspaces.keys())
+        # -- sparse evaluation matrix per subspace, rows: owned points x components, columns: local dofs
+        self.n_components = {}
+        self.matrices = {}
+        for name, V_sub in subspaces.items():
+            components = [V_sub.sub(i) for i in range(V_sub.num_sub_spaces())] if V_sub.num_sub_spaces() > 0 \
+                else [V_sub]
+            self.n_components[name] = len(components)
+            basis_values = dio.evaluate_lagrange_basis(bary[self.point_ids], V_sub.ufl_element().degree())
+            rows, columns = [], []
+            for i, component in enumerate(components):
+                cell_dofs = dio.get_cell_dofs(component, cell_ids[self.point_ids])
+                rows.append(np.repeat(np.arange(len(self.point_ids)) * len(components) + i, cell_dofs.shape[1]))
+                columns.append(cell_dofs.flatten())
+            values = np.tile(basis_values.flatten(), len(components))
+            self.matrices[name] = (np.concatenate(rows), np.concatenate(columns), values)
+        # -- columns are local dof indices (including ghosts), map to dofs that are read from the vector
+        self.local_to_global = V.dofmap().tabulate_local_to_global_dofs() if self.parallel else None
+        used_dofs = np.unique(np.concatenate([matrix[1] for matrix in self.matrices.values()]))
+        for name, (rows, columns, values) in self.matrices.items():
+            self.matrices[name] = csr_matrix((values, (rows, np.searchsorted(used_dofs, columns))),
+                                             shape=(len(self.point_ids) * self.n_components[name], len(used_dofs)))
+        self.used_dofs = used_dofs
+        self.times = []
+        self.values = {name: [] for name in self.subspace_names}
+
+    def _get_dof_values(self, solution):
+        if self.parallel:
+            return solution.vector().gather(self.local_to_global[self.used_dofs].astype(np.intc))
+        return solution.vector().get_local()[self.used_dofs]
+
+    def evaluate(self, solution):
+        """
+        Evaluates solution at probe points.
+        :return: dictionary {subspace name: array n_points x n_components}, on rank 0 only (None on other ranks)
+        """
+        dof_values = self._get_dof_values(solution)
+        values_local = {name: matrix.dot(dof_values).reshape(len(self.point_ids), self.n_components[name])
+                        for name, matrix in self.matrices.items()}
+        if self.parallel:
+            gathered = _get_mpi4py_comm(self.mpi_comm).gather((self.point_ids, values_local), root=0)
+        else:
+            gathered = [(self.point_ids, values_local)]
+        if self.rank != 0:
+            return None
+        values = {name: np.full((self.points.shape[0], self.n_components[name]), np.nan)
+                  for name in self.subspace_names}
+        for point_ids, values_rank in gathered:
+            for name, value in values_rank.items():
+                values[name][point_ids] = value
+        return values
+
+    def observe(self, solution, time):
+        values = self.evaluate(solution)
+        if values is not None:
+            self.times.append(time)
+            for name, value in values.items():
+                self.values[name].append(value)
+        return {}
+
+    def get_values(self, subspace_name):
+        """
+        :return: array n_steps x n_points for scalar, n_steps x n_points x n_components for vector subspaces;
+                 on rank 0 only
+        """
+        values = np.array(self.values[subspace_name]).reshape(-1, self.points.shape[0],
+                                                              self.n_components[subspace_name])
+        if self.n_components[subspace_name] == 1:
+            return values[:, :, 0]
+        return values
+
+    def save(self, output_dir):
+        """
+        Writes times, points and recorded values to '<name>.npz', on rank 0 only.
+        """
+        if self.rank == 0:
+            path_to_file = os.path.join(output_dir, '%s.npz' % self.name)
+            np.savez(path_to_file, times=np.array(self.times), points=self.points,
+                     **{name: self.get_values(name) for name in self.subspace_names})
+            self.logger.info("Saved probe values to '%s'" % path_to_file)
+
+
+class ObserverTable():
+    """
+    Evaluates list of observers and collects their outputs, one row per observed step.
+    """
+
+    def __init__(self, observers):
+        """
+        :param observers: list of Observer instances or functions `callback(solution, time)`
+        """
+        self.logger = logging.getLogger(__name__)
+        self.observers = []
+        for i, observer in enumerate(observers):
+            if not isinstance(observer, Observer):
+                observer = CallbackObserver(observer, name=getattr(observer, '__name__', 'observer_%i' % i))
+            self.observers.append(observer)
+        self.rows = []
+
+    def setup(self, functionspace, subdomains=None):
+        self.mpi_comm = functionspace._mesh.mpi_comm()
+        for observer in self.observers:
+            observer.setup(functionspace, subdomains)
+
+    def observe(self, solution, time, time_step):
+        row = {'time': time, 'time_step': time_step}
+        for observer in self.observers:
+            row.update(observer.observe(solution, time))
+        self.rows.append(row)
+        return row
+
+    def get_dataframe(self):
+        columns = ['time', 'time_step']
+        for row in self.rows:
+            columns.extend([column for column in row.keys() if column not in columns])
+        return pd.DataFrame(self.rows, columns=columns)
+
+    def save(self, path_to_file):
+        """
+        Writes table as csv file, on MPI rank 0 only.
+        """
+        if fenics.MPI.rank(self.mpi_comm) == 0:
+            self.get_dataframe().to_csv(path_to_file, index=False)
+            self.logger.info("Saved observations to '%s'" % path_to_file)
+        for observer in self.observers:
+            observer.save(os.path.dirname(path_to_file))
@@ -0,0 +1,33 @@
+from unittest import TestCase
+import numpy as np
+
+from glimslib import fenics_local as fenics
+from glimslib.simulation_helpers.helper_classes import FieldMetrics
+
+
+class TestFieldMetrics(TestCase):
+
+    def setUp(self):
+        nx = ny = 10
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), nx, ny)
+        self.V = fenics.FunctionSpace(self.mesh, "Lagrange", 1)
+        subdomains = fenics.MeshFunction("size_t", self.mesh, 2)
+        subdomains.set_all(1)
+        fenics.CompiledSubDomain("x[0] > 0.0 - tol", tol=1E-14).mark(subdomains, 2)
+        self.dx = fenics.dx(subdomain_data=subdomains)
+        self.tissue_id_name_map = {1: 'left', 2: 'right'}
+
+    def test_compute(self):
+        metrics = FieldMetrics(self.V, dx=self.dx, tissue_id_name_map=self.tissue_id_name_map)
+        conc_1 = fenics.interpolate(fenics.Constant(1.0), self.V)
+        conc_2 = fenics.interpolate(fenics.Expression('x[0] > -1E-10 ? 1.0 : 0.0', degree=1), self.V)
+        values = np.array([conc_1.vector().get_local(), conc_2.vector().get_local()])
+        df = metrics.compute(values, thresholds=[0.5, 2.0], recording_steps=[1, 2])
+        self.assertEqual(df.shape[0], 2 * 2 * 3)
+        df_all = df[(df.subdomain == 'all') & (df.threshold == 0.5)]
+        self.assertAlmostEqual(df_all.volume.iloc[0], 16.0)
+        self.assertAlmostEqual(df_all.com_0.iloc[0], 0.0)
+        df_right = df[(df.subdomain == 'right') & (df.threshold == 0.5)]
+        self.assertAlmostEqual(df_right.volume.iloc[1], 8.0)
+        self.assertAlmostEqual(df_right.com_0.iloc[1], 1.0)
+        self.assertTrue(np.all(df[df.threshold == 2.0].volume == 0))
@@ -58,3 +58,36 @@ class TestFunctionSpace(TestCase):
         U_0 = functionspace.split_function(U_orig, subspace_id=0)
 
 
+
+    def test_project(self):
+        subspace_names = {0: 'displacement', 1: 'concentration'}
+        functionspace = FunctionSpace(self.mesh, projection_parameters={'solver_type': 'cg',
+                                                                        'preconditioner_type': 'amg'})
+        functionspace.init_function_space(self.element, subspace_names)
+        V = functionspace.get_derived_functionspace('scalar')
+        self.assertEqual(functionspace.get_derived_functionspace('scalar'), V)
+        expr = fenics.Expression('x[0]*x[1]', degree=2)
+        f_1 = functionspace.project(expr, V)
+        f_2 = functionspace.project(expr, V)
+        self.assertEqual(len(functionspace._projectors), 1)
+        f_ref = fenics.project(expr, V)
+        self.assertLess(fenics.errornorm(f_ref, f_1), 1E-6)
+        self.assertLess(fenics.errornorm(f_1, f_2), 1E-10)
+
+    def test_project_local(self):
+        subspace_names = {0: 'displacement', 1: 'concentration'}
+        functionspace = FunctionSpace(self.mesh)
+        functionspace.init_function_space(self.element, subspace_names)
+        V_DG0 = functionspace.get_derived_functionspace('scalar', family='DG', degree=0)
+        expr = fenics.Expression('x[0]*x[1]', degree=2)
+        f_local = functionspace.project_local(expr, V_DG0)
+        f_ref = fenics.project(expr, V_DG0)
+        self.assertLess(fenics.errornorm(f_ref, f_local), 1E-10)
+        # batch
+        expr_vec = fenics.Expression(('x[0]', 'x[1]'), degree=1)
+        f_dict = functionspace.project_local_batch({'scalar': (expr, 'scalar'), 'vector': (expr_vec, 'vector')},
+                                                   family='DG', degree=1)
+        self.assertLess(fenics.errornorm(fenics.project(expr, f_dict['scalar'].function_space()),
+                                         f_dict['scalar']), 1E-10)
+        self.assertLess(fenics.errornorm(fenics.project(expr_vec, f_dict['vector'].function_space()),
+                                         f_dict['vector']), 1E-10)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+import numpy as np
+
+from glimslib import fenics_local as fenics
+from glimslib.simulation_helpers.helper_classes import FunctionSpace
+from glimslib.simulation_helpers.observers import ObserverTable, ThresholdVolumeObserver, MaxObserver, PointProbes
+
+
+class TestObservers(TestCase):
+
+    def setUp(self):
+        nx = ny = 10
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), nx, ny)
+        displacement_element = fenics.VectorElement("Lagrange", self.mesh.ufl_cell(), 1)
+        concentration_element = fenics.FiniteElement("Lagrange", self.mesh.ufl_cell(), 1)
+        element = fenics.MixedElement([displacement_element, concentration_element])
+        self.functionspace = FunctionSpace(self.mesh)
+        self.functionspace.init_function_space(element, {0: 'displacement', 1: 'concentration'})
+        self.solution = fenics.interpolate(fenics.Expression(('x[0]', 'x[1]', 'x[0] > -1E-10 ? 1.0 : 0.0'),
+                                                             degree=1),
+                                           self.functionspace.function_space)
+
+    def test_observe(self):
+        observations = ObserverTable([ThresholdVolumeObserver(thresholds=[0.5, 2.0]),
+                                      MaxObserver(subspace_name='displacement'),
+                                      lambda solution, time: {'double_time': 2 * time}])
+        observations.setup(self.functionspace)
+        for time_step in range(3):
+            observations.observe(self.solution, 0.5 * time_step, time_step)
+        df = observations.get_dataframe()
+        self.assertEqual(df.shape[0], 3)
+        # lumped volume of dofs with x >= 0: 5.5 columns of width 0.4, height 4
+        self.assertAlmostEqual(df['volume_0.5'].iloc[0], 8.8)
+        self.assertAlmostEqual(df['com_0_0.5'].iloc[0], 8.0 / 8.8)
+        self.assertAlmostEqual(df['volume_2.0'].iloc[0], 0.0)
+        self.assertAlmostEqual(df['max_displacement'].iloc[0], np.sqrt(8))
+        self.assertAlmostEqual(df['double_time'].iloc[2], 2.0)
+
+    def test_point_probes(self):
+        points = np.array([[0.5, 0.3], [-1.2, 1.7], [3.0, 3.0]])
+        probes = PointProbes(points)
+        observations = ObserverTable([probes])
+        observations.setup(self.functionspace)
+        for time_step in range(2):
+            observations.observe(self.solution, 0.5 * time_step, time_step)
+        concentration = probes.get_values('concentration')
+        displacement = probes.get_values('displacement')
+        self.assertEqual(concentration.shape, (2, 3))
+        self.assertEqual(displacement.shape, (2, 3, 2))
+        self.assertAlmostEqual(concentration[0, 0], 1.0)
+        self.assertAlmostEqual(concentration[1, 1], 0.0)
+        self.assertTrue(np.allclose(displacement[0, :2], points[:2]))
+        self.assertTrue(np.isnan(concentration[0, 2]))
@@ -0,0 +1,41 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from glimslib import fenics_local as fenics, config
+from glimslib.simulation_helpers.helper_classes import FunctionSpace, Results, PostProcessTumorGrowth
+
+
+class TestPostProcessDeformed(TestCase):
+
+    def setUp(self):
+        mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), 10, 10)
+        displacement_element = fenics.VectorElement("Lagrange", mesh.ufl_cell(), 1)
+        concentration_element = fenics.FiniteElement("Lagrange", mesh.ufl_cell(), 1)
+        element = fenics.MixedElement([displacement_element, concentration_element])
+        functionspace = FunctionSpace(mesh)
+        functionspace.init_function_space(element, {0: 'displacement', 1: 'concentration'})
+        U = functionspace.project_over_space(function_expr={0: fenics.Constant((0.1, -0.2)),
+                                                            1: fenics.Expression('x[0]', degree=1)})
+        results = Results(functionspace, subdomains=None)
+        results.add_to_results(current_sim_time=1, current_time_step=1, recording_step=1, field=U)
+        self.mesh = mesh
+        self.coordinates = mesh.coordinates().copy()
+        self.postprocess = PostProcessTumorGrowth(results, params=None,
+                                                  output_dir=os.path.join(config.output_dir_testing,
+                                                                          'test_postprocess'))
+
+    def test_get_deformed_mesh(self):
+        mesh_deformed = self.postprocess.get_deformed_mesh(recording_step=1)
+        self.assertTrue(np.allclose(mesh_deformed.coordinates(), self.coordinates + np.array([0.1, -0.2])))
+        self.assertTrue((self.mesh.coordinates() == self.coordinates).all())
+        # field transferred to deformed mesh keeps its dof values
+        concentration = self.postprocess.get_solution_concentration(recording_step=1)
+        concentration_deformed = self.postprocess.get_function_on_mesh(concentration, mesh_deformed)
+        self.assertTrue(np.allclose(concentration_deformed.vector().get_local(), concentration.vector().get_local()))
+
+    def test_deformed_view(self):
+        with self.postprocess.deformed_view(recording_step=1) as mesh_data:
+            self.assertTrue(np.allclose(mesh_data.coordinates(), self.coordinates + np.array([0.1, -0.2])))
+        self.assertTrue((self.mesh.coordinates() == self.coordinates).all())
@@ -65,4 +65,20 @@ class TestTimeSeriesData(TestCase):
         u1 = self.tsd.get_solution_function(subspace_id=1, recording_step=2)
         u0 = self.tsd.get_solution_function(subspace_id=0, recording_step=2)
         self.assertEqual(u.function_space(), self.U.function_space())
-        self.assertNotEqual(u, self.U)
\ No newline at end of file
+        self.assertNotEqual(u, self.U)
+
+    def test_get_solution_function_extract_subspace(self):
+        self.tsd.add_observation(field=self.U, time=1, time_step=1, recording_step=1, replace=False)
+        u1 = self.tsd.get_solution_function(subspace_id=1, recording_step=1)
+        u1_proj = self.tsd._functionspace.project_over_space(fenics.split(self.U)[1], subspace_id=1)
+        self.assertLess(fenics.errornorm(u1_proj, u1), 1E-5)
+        u1_cached = self.tsd.get_solution_function(subspace_name='concentration', recording_step=1)
+        self.assertNotEqual(u1, u1_cached)
+        self.assertLess(fenics.errornorm(u1, u1_cached), 1E-10)
+        # modifying returned function does not change later reads
+        u1_cached.vector()[:] = 0.0
+        u1_again = self.tsd.get_solution_function(subspace_id=1, recording_step=1)
+        self.assertLess(fenics.errornorm(u1, u1_again), 1E-10)
+        self.tsd.add_observation(field=self.U, time=1, time_step=2, recording_step=1, replace=True)
+        u1_new = self.tsd.get_solution_function(subspace_id=1, recording_step=1)
+        self.assertNotEqual(u1, u1_new)
@@ -3,6 +3,7 @@ import os
 import numpy as np
 
 import glimslib.utils.file_utils as fu
+import glimslib.utils.data_io as dio
 from glimslib import fenics_local as fenics, config
 from glimslib.simulation_helpers.helper_classes import FunctionSpace, TimeSeriesMultiData
 
@@ -123,3 +124,56 @@ class TestTimeSeriesMultiData(TestCase):
 
 
 
+
+    def test_save_load_hdf5_raw(self):
+        path_to_file = os.path.join(config.output_dir_testing, 'timeseries_to_hdf5_raw.h5')
+        fu.ensure_dir_exists(path_to_file)
+        tsmd = TimeSeriesMultiData()
+        tsmd.register_time_series(name='solution', functionspace=self.functionspace)
+        tsmd.add_observation('solution', field=self.U, time=1, time_step=1, recording_step=1)
+        tsmd.add_observation('solution', field=self.U, time=2, time_step=2, recording_step=2)
+        tsmd.add_observation('solution', field=self.U, time=3, time_step=3, recording_step=3)
+        tsmd.save_to_hdf5_raw(path_to_file, replace=True)
+        # read dof values directly
+        info = dio.read_time_series_raw_info(path_to_file, 'solution')
+        self.assertTrue(np.allclose(info['recording_steps'], [1, 2, 3]))
+        self.assertTrue(np.allclose(info['times'], [1, 2, 3]))
+        values = dio.read_time_series_raw(path_to_file, 'solution', steps=[2, 0])
+        self.assertEqual(values.shape, (2, self.U.vector().size()))
+        conc_dofs = self.functionspace.function_space.sub(1).dofmap().dofs()
+        values_conc = dio.read_time_series_raw(path_to_file, 'solution', steps=1, subspace_name='concentration')
+        self.assertTrue(np.allclose(values_conc, self.U.vector().get_local()[conc_dofs]))
+        # read into functions
+        tsmd2 = TimeSeriesMultiData()
+        tsmd2.register_time_series(name='solution', functionspace=self.functionspace)
+        tsmd2.load_from_hdf5_raw(path_to_file)
+        self.assertEqual(len(tsmd2.get_time_series('solution').get_all_recording_steps()), 3)
+        u_reloaded = tsmd2.get_solution_function(name='solution', recording_step=2)
+        self.assertTrue(np.allclose(u_reloaded.vector().get_local(), self.U.vector().get_local()))
+
+    def test_load_from_hdf5_lazy(self):
+        path_to_file = os.path.join(config.output_dir_testing, 'timeseries_to_hdf5_for_lazy_reading.h5')
+        fu.ensure_dir_exists(path_to_file)
+        tsmd = TimeSeriesMultiData()
+        tsmd.register_time_series(name='solution', functionspace=self.functionspace)
+        for recording_step in range(1, 6):
+            tsmd.add_observation('solution', field=self.U, time=1, time_step=1, recording_step=recording_step)
+        tsmd.save_to_hdf5(path_to_file, replace=True)
+        # read file
+        tsmd2 = TimeSeriesMultiData()
+        tsmd2.register_time_series(name='solution', functionspace=self.functionspace)
+        tsmd2.get_time_series('solution')._lazy_cache_size = 2
+        tsmd2.load_from_hdf5(path_to_file, lazy=True)
+        ts = tsmd2.get_time_series('solution')
+        self.assertEqual(len(ts.get_all_recording_steps()), 5)
+        self.assertFalse(any([ts.get_observation(step).is_loaded() for step in ts.get_all_recording_steps()]))
+        for step in ts.get_all_recording_steps():
+            u_reloaded = tsmd2.get_solution_function(name='solution', recording_step=step)
+            self.assertTrue(np.allclose(u_reloaded.vector().get_local(), self.U.vector().get_local()))
+        n_loaded = sum([ts.get_observation(step).is_loaded() for step in ts.get_all_recording_steps()])
+        self.assertEqual(n_loaded, 2)
+        # accessing a loaded field makes it most recently used
+        ts.get_observation(4).get_field()
+        ts.get_observation(1).get_field()
+        self.assertTrue(ts.get_observation(4).is_loaded())
+        self.assertFalse(ts.get_observation(5).is_loaded())
@@ -1,4 +1,7 @@
 import os
+import copy
+import collections
+import multiprocessing
 
 import numpy as np
 import meshio as mio
@@ -406,6 +409,273 @@ def create_fenics_function_from_image(image):
     return f_img
 
 
+def create_image_mesh(image):
+    """
+    Creates structured RectangleMesh / BoxMesh with one vertex per voxel (voxel centers).
+    Assumes image direction to be identity.
+    """
+    origin, size, spacing, extent, dim, vdim = get_measures_from_image(image)
+    p_min = fenics.Point(extent[0, :])
+    p_max = fenics.Point(extent[1, :])
+    # fenics expects number of elements, i.e. n_nodes - 1
+    n_elements = [int(n) - 1 for n in size]
+    if dim == 2:
+        mesh_image = fenics.RectangleMesh(p_min, p_max, *n_elements)
+    else:
+        mesh_image = fenics.BoxMesh(p_min, p_max, *n_elements)
+    return mesh_image
+
+
+def get_image_values_at_vertices(image, mesh):
+    """
+    Returns values of voxels closest to the vertices of mesh as array n_vertices x n_components.
+    """
+    origin, size, spacing, extent, dim, vdim = get_measures_from_image(image)
+    index = np.rint((mesh.coordinates() - origin) / spacing).astype(int)
+    index = np.clip(index, 0, size - 1)
+    # numpy image array is indexed [z, y, x]
+    flat_index = np.ravel_multi_index(tuple(index.T[::-1]), tuple(size[::-1]))
+    values = sitk.GetArrayFromImage(image).reshape(-1, vdim)
+    return values[flat_index]
+
+
+def image_to_function(image, mesh=None, function_type='scalar'):
+    """
+    Vectorized conversion of 2D/3D image into P1 fenics function, assigning voxel values to mesh vertices.
+    :param image: sitk image
+    :param mesh: fenics.Mesh with vertices on voxel centers, created by `create_image_mesh` if not provided
+    :param function_type: 'scalar', 'label' (values rounded to integers) or 'vector'
+    :return: fenics.Function
+    """
+    if mesh is None:
+        mesh = create_image_mesh(image)
+    values = get_image_values_at_vertices(image, mesh).astype(float)
+    if function_type == 'vector':
+        V = fenics.VectorFunctionSpace(mesh, "Lagrange", 1, dim=values.shape[1])
+    else:
+        V = fenics.FunctionSpace(mesh, "Lagrange", 1)
+        if function_type == 'label':
+            values = np.rint(values)
+    # vertex_to_dof_map is indexed by vertex * n_components + component
+    dof_values = np.zeros(V.dim())
+    dof_values[fenics.vertex_to_dof_map(V)] = values.flatten()
+    f_img = fenics.Function(V)
+    f_img.vector().set_local(dof_values)
+    f_img.vector().apply('insert')
+    return f_img
+
+
+# ==============================================================================
+# RASTERIZING MESH DATA ON IMAGE GRIDS
+# ==============================================================================
+# Vectorized alternative to evaluating fenics functions point-by-point:
+# voxel positions are located in mesh cells once (cell id + barycentric coordinates),
+# P1 (vertex) values and cell-wise data are then interpolated with numpy.
+
+def get_image_point_coordinates(image):
+    """
+    Returns physical coordinates of all voxels as array n_voxels x dim, in the order of
+    sitk.GetArrayFromImage(image).flatten(), i.e. x index running fastest.
+    """
+    dim = image.GetDimension()
+    size = image.GetSize()
+    index = np.indices(size[::-1]).reshape(dim, -1)[::-1].T
+    direction = np.array(image.GetDirection()).reshape(dim, dim)
+    return np.array(image.GetOrigin()) + (index * np.array(image.GetSpacing())).dot(direction.T)
+
+
+def locate_points(mesh, points, n_candidates=8, eps=1E-8, chunk_size=2**18):
+    """
+    Finds cell containing each point and the point's barycentric coordinates in that cell.
+    Candidate cells are the n_candidates cells with closest midpoints; points not found among them are
+    checked with the mesh' bounding box tree if they may lie inside the mesh.
+    :param mesh: fenics.Mesh, simplex cells, or object providing coordinates() and cells()
+    :param points: array n_points x gdim
+    :return: cell_ids (-1 for points outside of mesh), barycentric coordinates n_points x (tdim+1)
+    """
+    from scipy.spatial import cKDTree
+    coords = mesh.coordinates()
+    cells = mesh.cells()
+    tdim = cells.shape[1] - 1
+    points = np.asarray(points, dtype=float)
+    # affine map from barycentric to physical coordinates for each cell
+    vertex_0 = coords[cells[:, 0]]
+    edges = np.stack([coords[cells[:, i]] - vertex_0 for i in range(1, tdim + 1)], axis=2)
+    edges_inv = np.linalg.inv(edges)
+    midpoints = coords[cells].mean(axis=1)
+    max_distance = np.max(np.linalg.norm(coords[cells] - midpoints[:, np.newaxis, :], axis=2))
+    tree = cKDTree(midpoints)
+    n_candidates = min(n_candidates, cells.shape[0])
+
+    def barycentric(cell_ids, pts):
+        lambdas = np.einsum('nij,nj->ni', edges_inv[cell_ids], pts - vertex_0[cell_ids])
+        return np.hstack([1 - lambdas.sum(axis=1, keepdims=True), lambdas])
+
+    cell_ids = -np.ones(points.shape[0], dtype=int)
+    bary = np.zeros((points.shape[0], tdim + 1))
+    for start in range(0, points.shape[0], chunk_size):
+        pts = points[start:start + chunk_size]
+        distances, candidates = tree.query(pts, k=n_candidates)
+        candidates = candidates.reshape(pts.shape[0], -1)
+        found = np.zeros(pts.shape[0], dtype=bool)
+        for j in range(candidates.shape[1]):
+            todo = np.where(~found)[0]
+            if len(todo) == 0:
+                break
+            bary_j = barycentric(candidates[todo, j], pts[todo])
+            inside = np.all(bary_j >= -eps, axis=1)
+            cell_ids[start + todo[inside]] = candidates[todo[inside], j]
+            bary[start + todo[inside]] = bary_j[inside]
+            found[todo[inside]] = True
+        # fallback for points close to the mesh
+        distance_min = distances.reshape(pts.shape[0], -1)[:, 0]
+        todo = np.where(np.logical_and(~found, distance_min <= max_distance))[0]
+        if len(todo) > 0 and hasattr(mesh, 'bounding_box_tree'):
+            bbtree = mesh.bounding_box_tree()
+            n_cells = mesh.num_cells()
+            for i in todo:
+                cell_id = bbtree.compute_first_entity_collision(fenics.Point(*pts[i]))
+                if cell_id < n_cells:
+                    cell_ids[start + i] = cell_id
+                    bary[start + i] = barycentric(np.array([cell_id]), pts[i:i + 1])[0]
+        elif len(todo) > 0:
+            # mesh data without bounding box tree, e.g. visualisation.helpers.MeshData: check all nearby cells
+            for i in todo:
+                for cell_id in tree.query_ball_point(pts[i], max_distance):
+                    bary_i = barycentric(np.array([cell_id]), pts[i:i + 1])[0]
+                    if np.all(bary_i >= -eps):
+                        cell_ids[start + i] = cell_id
+                        bary[start + i] = bary_i
+                        break
+    return cell_ids, bary
+
+
+def locate_image_points(mesh, image, **kwargs):
+    """
+    Locates voxels of image in mesh, see `locate_points`.
+    """
+    return locate_points(mesh, get_image_point_coordinates(image), **kwargs)
+
+
+def _values_to_image(values, reference_image):
+    size = reference_image.GetSize()
+    if values.ndim == 2 and values.shape[1] > 1:
+        image = sitk.GetImageFromArray(values.reshape(*size[::-1], values.shape[1]), isVector=True)
+    else:
+        image = sitk.GetImageFromArray(values.reshape(size[::-1]))
+    image.CopyInformation(reference_image)
+    return image
+
+
+def rasterize_function(function, reference_image, point_locations=None, default_value=0.0):
+    """
+    Interpolates fenics function linearly from its vertex values onto the grid of reference_image.
+    :param function: scalar or vector valued fenics.Function
+    :param point_locations: result of `locate_image_points` for function's mesh and reference_image
+    :return: sitk image, vector image for vector valued functions
+    """
+    mesh = function.function_space().mesh()
+    if point_locations is None:
+        point_locations = locate_image_points(mesh, reference_image)
+    cell_ids, bary = point_locations
+    vdim = function.value_size()
+    vertex_values = function.compute_vertex_values(mesh).reshape(vdim, -1).T
+    inside = cell_ids >= 0
+    values = np.full((len(cell_ids), vdim), default_value, dtype=float)
+    cell_vertices = mesh.cells()[cell_ids[inside]]
+    values[inside] = np.einsum('nk,nkv->nv', bary[inside], vertex_values[cell_vertices])
+    return _values_to_image(values, reference_image)
+
+
+def rasterize_mesh_function(mesh_function, reference_image, point_locations=None, default_value=0):
+    """
+    Assigns cell values of mesh_function (e.g. subdomain labels) to the voxels of reference_image.
+    :param mesh_function: fenics.MeshFunction over cells
+    :param point_locations: result of `locate_image_points` for mesh of mesh_function and reference_image
+    :return: sitk image
+    """
+    if point_locations is None:
+        point_locations = locate_image_points(mesh_function.mesh(), reference_image)
+    cell_ids, bary = point_locations
+    cell_values = mesh_function.array()
+    values = np.full(len(cell_ids), default_value, dtype=cell_values.dtype)
+    values[cell_ids >= 0] = cell_values[cell_ids[cell_ids >= 0]]
+    return _values_to_image(values, reference_image)
+
+
+# ==============================================================================
+# TRANSFER OPERATORS BETWEEN NON-MATCHING MESHES
+# ==============================================================================
+# Lagrange interpolation from a source to a target function space is linear in the source dofs.
+# The interpolation matrix (n_target_dofs x n_source_dofs) is assembled once from the barycentric coordinates of the
+# target dof coordinates in the source mesh; interpolating any field is then a sparse mat-vec product.
+
+def _get_simplex_edges(tdim):
+    # UFC local edge numbering
+    if tdim == 2:
+        return [(1, 2), (0, 2), (0, 1)]
+    elif tdim == 3:
+        return [(2, 3), (1, 3), (1, 2), (0, 3), (0, 2), (0, 1)]
+    return [(0, 1)]
+
+
+def evaluate_lagrange_basis(bary, degree):
+    """
+    Evaluates P1 / P2 Lagrange basis functions of a simplex in UFC ordering.
+    :param bary: barycentric coordinates n_points x (tdim+1)
+    :return: array n_points x n_basis_functions
+    """
+    if degree == 1:
+        return bary
+    elif degree == 2:
+        tdim = bary.shape[1] - 1
+        vertex_basis = bary * (2 * bary - 1)
+        edge_basis = [4 * bary[:, i] * bary[:, j] for i, j in _get_simplex_edges(tdim)]
+        return np.hstack([vertex_basis, np.array(edge_basis).T])
+    raise ValueError("Lagrange basis of degree %s not implemented" % degree)
+
+
+def create_transfer_matrix(source_funspace, target_funspace):
+    """
+    Assembles sparse matrix that interpolates functions from source_funspace to target_funspace.
+    Only P1/P2 Lagrange (scalar or vector) spaces on simplex meshes in serial runs are supported.
+    Target dofs outside of the source mesh are set to 0.
+    :return: scipy.sparse.csr_matrix n_target_dofs x n_source_dofs, or None if spaces are not supported
+    """
+    from scipy.sparse import csr_matrix
+    source_mesh = source_funspace.mesh()
+    if fenics.MPI.size(source_mesh.mpi_comm()) > 1:
+        return None
+    source_element = source_funspace.ufl_element()
+    target_element = target_funspace.ufl_element()
+    if source_element.family() != 'Lagrange' or target_element.family() != 'Lagrange' \
+            or source_element.degree() not in [1, 2] \
+            or source_funspace.num_sub_spaces() != target_funspace.num_sub_spaces():
+        return None
+    n_components = max(1, source_funspace.num_sub_spaces())
+    # components of target dofs
+    target_coords = get_dof_coordinate_map(target_funspace)
+    target_components = np.zeros(target_coords.shape[0], dtype=int)
+    if n_components > 1:
+        for component in range(n_components):
+            target_components[target_funspace.sub(component).dofmap().dofs()] = component
+    # locate target dofs in source mesh
+    cell_ids, bary = locate_points(source_mesh, target_coords)
+    inside = np.where(cell_ids >= 0)[0]
+    if len(inside) < len(cell_ids):
+        print("%i of %i target dofs are outside of the source mesh" % (len(cell_ids) - len(inside), len(cell_ids)))
+    basis_values = evaluate_lagrange_basis(bary[inside], source_element.degree())
+    # source dofs of cells containing target dofs, by component
+    n_cell_dofs = source_funspace.dofmap().max_element_dofs() // n_components
+    source_cell_dofs = get_cell_dofs(source_funspace, cell_ids[inside]).reshape(len(inside), n_components, n_cell_dofs)
+    columns = source_cell_dofs[np.arange(len(inside)), target_components[inside], :]
+    rows = np.repeat(inside, basis_values.shape[1])
+    matrix = csr_matrix((basis_values.flatten(), (rows, columns.flatten())),
+                        shape=(target_funspace.dim(), source_funspace.dim()))
+    matrix.eliminate_zeros()
+    return matrix
+
+
 # ==============================================================================
 # FUNCTIONS FOR IMPORTING 3D MESH DATA
 # ==============================================================================
@@ -578,24 +848,68 @@ def read_vtk_convert_to_fenics(path_to_vtk):
     mesh_fenics, subdomains = convert_meshio_to_fenics_mesh(mesh_mio)
     return mesh_fenics, subdomains
 
-def remove_mesh_subdomain(fenics_mesh, subdomains, lower_thr, upper_thr, temp_dir=config.output_dir_temp):
+def extract_submesh(fenics_mesh, subdomains, lower_thr, upper_thr, boundaries=None):
+    """
+    Creates new fenics mesh containing only cells with subdomain id in [lower_thr, upper_thr].
+    Vertices are renumbered compactly, subdomain and boundary markers are carried over.
+    :param fenics_mesh: fenics mesh
+    :param subdomains: fenics meshfunction dim
+    :param lower_thr: lowest subdomain id to keep
+    :param upper_thr: highest subdomain id to keep
+    :param boundaries: fenics meshfunction dim-1, optional
+    :return: mesh, subdomains, boundaries, vertex_map, cell_map;
+             maps have length of parent entities and contain child index or -1 if entity was removed
+    """
+    tdim = fenics_mesh.topology().dim()
+    if tdim not in (2, 3):
+        raise ValueError("Do not understand mesh of topological dimension '%i'" % tdim)
+    subdomain_ids = subdomains.array()
+    cell_selection = np.where((subdomain_ids >= lower_thr) & (subdomain_ids <= upper_thr))[0]
+    # -- create new mesh
+    cell_markers = fenics.MeshFunction("size_t", fenics_mesh, tdim)
+    cell_markers.set_all(0)
+    cell_markers.array()[cell_selection] = 1
+    mesh = fenics.SubMesh(fenics_mesh, cell_markers, 1)
+    parent_vertices = np.asarray(mesh.data().array('parent_vertex_indices', 0), dtype=np.int64)
+    parent_cells = np.asarray(mesh.data().array('parent_cell_indices', tdim), dtype=np.int64)
+    # -- maps parent -> child
+    vertex_map = -np.ones(fenics_mesh.num_vertices(), dtype=np.int64)
+    vertex_map[parent_vertices] = np.arange(mesh.num_vertices())
+    cell_map = -np.ones(fenics_mesh.num_cells(), dtype=np.int64)
+    cell_map[parent_cells] = np.arange(mesh.num_cells())
+    # -- subdomains
+    subdomains_sub = fenics.MeshFunction("size_t", mesh, tdim)
+    subdomains_sub.set_all(0)
+    subdomains_sub.array()[:] = subdomain_ids[parent_cells].astype(np.uint64)
+    # -- boundaries, identified by sorted parent vertex ids of each marked facet
+    boundaries_sub = None
+    if boundaries is not None:
+        boundaries_sub = fenics.MeshFunction("size_t", mesh, tdim - 1)
+        boundaries_sub.set_all(0)
+        boundary_ids = boundaries.array()
+        marked_facets = np.where(boundary_ids != 0)[0]
+        if len(marked_facets) > 0:
+            fenics_mesh.init(tdim - 1, 0)
+            mesh.init(tdim - 1, 0)
+            facets_parent = fenics_mesh.topology()(tdim - 1, 0)().reshape((-1, tdim))[marked_facets]
+            facets_child = parent_vertices[mesh.topology()(tdim - 1, 0)().reshape((-1, tdim))]
+            facets = np.sort(np.vstack([facets_parent, facets_child]), axis=1)
+            _, facet_index = np.unique(facets, axis=0, return_inverse=True)
+            facet_index = facet_index.flatten()
+            values = np.zeros(facet_index.max() + 1, dtype=boundary_ids.dtype)
+            values[facet_index[:len(marked_facets)]] = boundary_ids[marked_facets]
+            boundaries_sub.array()[:] = values[facet_index[len(marked_facets):]]
+    return mesh, subdomains_sub, boundaries_sub, vertex_map, cell_map
+
+
+def remove_mesh_subdomain(fenics_mesh, subdomains, lower_thr, upper_thr, temp_dir=None):
     """
     Creates new fenics mesh containing only subdomains lower_thr to upper_thr.
+    See `extract_submesh`; temp_dir is kept for backward compatibility only.
     :return: fenics mesh and subdomains
     """
-    path_to_temp_vtk = os.path.join(temp_dir, 'mesh.vtu')
-    fu.ensure_dir_exists(path_to_temp_vtk)
-    path_to_temp_vtk_thresh = os.path.join(temp_dir, 'mesh_thresh.vtu')
-    # 1) convert fenics mesh and subdomains to vtk mesh using meshio
-    mio_mesh = convert_fenics_mesh_to_meshio(fenics_mesh, subdomains=subdomains)
-    mio.write(path_to_temp_vtk, mio_mesh)
-    # 2) load mesh using vtk
-    mesh_vtk = vtu.read_vtk_data(path_to_temp_vtk)
-    # 3) apply threshold filter to vtk mesh to remove subdomain
-    mesh_vtk_thresh = vtu.threshold_vtk_data(mesh_vtk, 'cell', 'ElementBlockIds', lower_thr=lower_thr, upper_thr=upper_thr)
-    # 4) convert vtk mesh to meshio and convert to fenics mesh
-    mio_mesh_thresh = convert_vtk_mesh_to_meshio(mesh_vtk_thresh)
-    mesh_thresh, subdomains_thresh = convert_meshio_to_fenics_mesh(mio_mesh_thresh)
+    mesh_thresh, subdomains_thresh, _, _, _ = extract_submesh(fenics_mesh, subdomains,
+                                                              lower_thr=lower_thr, upper_thr=upper_thr)
     return mesh_thresh, subdomains_thresh
 
 
@@ -603,6 +917,57 @@ def remove_mesh_subdomain(fenics_mesh, subdomains, lower_thr, upper_thr, temp_di
 # POSTPROCESSING VTU OUTPUT
 # ==============================================================================
 
+VTU_MERGE_NAMES = ['concentration', 'proliferation', 'growth', 'displacement']
+
+# reference mesh shared by merge worker processes, set once per process by `_init_merge_worker`
+_merge_reference_mesh = None
+
+
+def _init_merge_worker(mio_mesh_reference):
+    global _merge_reference_mesh
+    _merge_reference_mesh = mio_mesh_reference
+
+
+def _read_point_data_timestep(base_path, timestep, names, remove=False):
+    """
+    Reads point data arrays of all fields in `names` for a single time step.
+    :return: dictionary {name: point_array}
+    """
+    point_data = {}
+    for name in names:
+        path_to_vtu = os.path.join(base_path, name, create_file_name(name, timestep))
+        if os.path.exists(path_to_vtu):
+            mio_mesh = mio.read(path_to_vtu)
+            if name in mio_mesh.point_data.keys():
+                point_data[name] = mio_mesh.point_data[name]
+                if remove:
+                    remove_vtu(path_to_vtu)
+        else:
+            print("   - File '%s' not found"%(path_to_vtu))
+    return point_data
+
+
+def _write_merged_timestep(base_path, timestep, mio_mesh_reference, point_data):
+    mio_mesh_merged = copy.copy(mio_mesh_reference)
+    mio_mesh_merged.point_data = dict(mio_mesh_reference.point_data)
+    mio_mesh_merged.point_data.update(point_data)
+    path_to_merged = os.path.join(base_path, 'merged', create_file_name("all", timestep))
+    print("   - Saving joint file to '%s'" % (path_to_merged))
+    fu.ensure_dir_exists(path_to_merged)
+    mio.write(path_to_merged, mio_mesh_merged)
+
+
+def _merge_vtus_worker(args):
+    base_path, timestep, names, remove, write = args
+    print("-- Creating joint vtu for timestep %d" % timestep)
+    point_data = _read_point_data_timestep(base_path, timestep, names, remove=remove)
+    if write:
+        _write_merged_timestep(base_path, timestep, _merge_reference_mesh, point_data)
+        return timestep, None
+    else:
+        return timestep, point_data
+
+
 def merge_vtus_timestep(base_path, timestep, remove=False, reference_file_path=None):
     """
     This function merges data arrays from multiple vtu files into single vtu file.
@@ -613,30 +978,67 @@ def merge_vtus_timestep(base_path, timestep, remove=False, reference_file_path=N
     :param remove: boolean flag indicating whether original files should be removed
     :param reference_file_path: path to file that includes labelmap
     """
-    print("-- Creating joint vtu for timestep %d" % timestep)
+    merge_vtus(base_path, [timestep], remove=remove, reference_file_path=reference_file_path)
+
+
+def merge_vtus(base_path, timesteps, remove=False, reference_file_path=None, names=None, n_processes=1,
+               single_file=False, times=None):
+    """
+    This function merges data arrays from multiple vtu files for all time steps in `timesteps`.
+    The reference mesh is read only once; reading and writing of time steps is distributed over `n_processes`
+    worker processes.
+    :param base_path: path to directory where simulation results are stored
+    :param timesteps: list of time steps
+    :param remove: boolean flag indicating whether original files should be removed
+    :param reference_file_path: path to file that includes labelmap
+    :param names: names of fields to be merged, defaults to VTU_MERGE_NAMES
+    :param n_processes: number of worker processes
+    :param single_file: if True, all time steps are written to single xdmf time series 'merged/all.xdmf'
+    :param times: time values for xdmf time series, defaults to timesteps
+    :return: path to merged file if single_file, else None
+    """
+    if names is None:
+        names = VTU_MERGE_NAMES
     if reference_file_path is None:
         reference_file_path = os.path.join(base_path, "label_map", create_file_name("label_map", 0))
-    if os.path.exists(reference_file_path):
-        mio_mesh_label = mio.read(reference_file_path)
-        names = ['concentration', 'proliferation', 'growth', 'displacement']
-        for name in names:
-            path_to_vtu = os.path.join(base_path, name, create_file_name(name, timestep))
-            if os.path.exists(path_to_vtu):
-                mio_mesh = mio.read(path_to_vtu)
-                if name in mio_mesh.point_data.keys():
-                    point_array = mio_mesh.point_data[name]
-                    mio_mesh_label.point_data[name] = point_array
-                    if remove:
-                        remove_vtu(path_to_vtu)
-            else:
-                print("   - File '%s' not found"%(path_to_vtu))
-        # save joint vtu
-        path_to_merged = os.path.join(base_path, 'merged', create_file_name("all", timestep))
-        print("   - Saving joint file to '%s'" % (path_to_merged))
-        fu.ensure_dir_exists(path_to_merged)
-        mio.write(path_to_merged, mio_mesh_label)
-    else:
+    if not os.path.exists(reference_file_path):
         print("   - Could not find reference file '%s'... skipping"%(reference_file_path))
+        return None
+    mio_mesh_label = mio.read(reference_file_path)
+    args_list = [(base_path, timestep, names, remove, not single_file) for timestep in timesteps]
+    if n_processes > 1:
+        # spawned workers do not inherit fenics / PETSc / MPI state of the calling process
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(n_processes, initializer=_init_merge_worker, initargs=(mio_mesh_label,))
+        try:
+            results = pool.imap(_merge_vtus_worker, args_list)
+            path_to_merged = _collect_merged_results(base_path, mio_mesh_label, results, single_file, times)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_merge_worker(mio_mesh_label)
+        results = map(_merge_vtus_worker, args_list)
+        path_to_merged = _collect_merged_results(base_path, mio_mesh_label, results, single_file, times)
+    return path_to_merged
+
+
+def _collect_merged_results(base_path, mio_mesh_reference, results, single_file, times=None):
+    if not single_file:
+        for _ in results:
+            pass
+        return None
+    path_to_merged = os.path.join(base_path, 'merged', 'all.xdmf')
+    print("   - Saving joint time series to '%s'" % (path_to_merged))
+    fu.ensure_dir_exists(path_to_merged)
+    with mio.XdmfTimeSeriesWriter(path_to_merged) as writer:
+        writer.write_points_cells(mio_mesh_reference.points, mio_mesh_reference.cells)
+        for i, (timestep, point_data) in enumerate(results):
+            point_data_all = dict(mio_mesh_reference.point_data)
+            point_data_all.update(point_data)
+            time = timestep if times is None else times[i]
+            writer.write_data(time, point_data=point_data_all, cell_data=mio_mesh_reference.cell_data)
+    return path_to_merged
 
 
 def create_file_name(name, step):
@@ -646,12 +1048,13 @@ def create_file_name(name, step):
 def remove_vtu(path_to_file):
     os.remove(path_to_file)
 
-def merge_VTUs(base_path, delta_t, t_max, remove=False, reference=None):
+def merge_VTUs(base_path, delta_t, t_max, remove=False, reference=None, n_processes=1, single_file=False):
     """
-    This function merges all VTU outputs of a simulation run using `merge_vtus_timestep`.
+    This function merges all VTU outputs of a simulation run using `merge_vtus`.
     """
-    for timestep in range(len(np.arange(0, t_max, delta_t)) + 1):
-        merge_vtus_timestep(base_path, timestep, remove=remove, reference_file_path=reference)
+    timesteps = list(range(len(np.arange(0, t_max, delta_t)) + 1))
+    merge_vtus(base_path, timesteps, remove=remove, reference_file_path=reference, n_processes=n_processes,
+               single_file=single_file, times=[step * delta_t for step in timesteps])
 
 
 
@@ -659,6 +1062,54 @@ def merge_VTUs(base_path, delta_t, t_max, remove=False, reference=None):
 # ==============================================================================
 # FENICS MESH IO for parallell processing
 # ==============================================================================
+# Meshes read by `read_mesh_hdf5` and function spaces created by `load_function_mesh` are kept in a process-level
+# LRU cache of size config.MESH_CACHE_SIZE, keyed on (file path, modification time, file size, MPI communicator).
+# Cached objects are shared between callers and must not be modified in place (e.g. by ALE.move);
+# read with cached=False to obtain an independent mesh.
+
+# {(path, mtime, size, comm key): {'mesh': ..., 'subdomains': ..., 'boundaries': ..., 'functionspaces': {}}}
+_mesh_cache = collections.OrderedDict()
+
+
+def get_mpi_comm_key(mpi_comm):
+    if hasattr(mpi_comm, 'py2f'):
+        # mpi4py communicator
+        return fenics.MPI.size(mpi_comm), mpi_comm.py2f()
+    return fenics.MPI.size(mpi_comm), None
+
+
+def mpi_sum_array(mpi_comm, array):
+    """
+    Elementwise sum of local arrays over all processes, as single reduction of the whole array.
+    """
+    array = np.asarray(array, dtype=float)
+    if fenics.MPI.size(mpi_comm) == 1:
+        return array
+    if hasattr(mpi_comm, 'Allreduce'):
+        # mpi4py communicator
+        from mpi4py import MPI
+        result = np.empty_like(array)
+        mpi_comm.Allreduce(np.ascontiguousarray(array), result, op=MPI.SUM)
+        return result
+    return np.array([fenics.MPI.sum(mpi_comm, float(value)) for value in array.flat]).reshape(array.shape)
+
+
+def _get_mesh_cache_key(path_to_file, mpi_comm):
+    stat = os.stat(path_to_file)
+    return os.path.abspath(path_to_file), stat.st_mtime_ns, stat.st_size, get_mpi_comm_key(mpi_comm)
+
+
+def clear_mesh_cache(path_to_file=None):
+    """
+    Removes cached meshes and function spaces of path_to_file, or all entries if no path is given.
+    """
+    if path_to_file is None:
+        _mesh_cache.clear()
+    else:
+        path_to_file = os.path.abspath(path_to_file)
+        for key in [key for key in _mesh_cache.keys() if key[0] == path_to_file]:
+            del _mesh_cache[key]
+
 
 def save_mesh_hdf5(mesh_in, path_to_file, subdomains=None, boundaries=None):
     """
@@ -670,6 +1121,7 @@ def save_mesh_hdf5(mesh_in, path_to_file, subdomains=None, boundaries=None):
     :param boundaries: fenics meshfunction dim-1
     :return:
     """
+    clear_mesh_cache(path_to_file)
     hdf = fenics.HDF5File(mesh_in.mpi_comm(), path_to_file, "w")
     hdf.write(mesh_in, "/mesh")
     if subdomains is not None:
@@ -678,14 +1130,42 @@ def save_mesh_hdf5(mesh_in, path_to_file, subdomains=None, boundaries=None):
         hdf.write(boundaries, "boundaries")
     hdf.close()
 
-def read_mesh_hdf5(path_to_file):
+def read_mesh_hdf5(path_to_file, cached=None, mpi_comm=None):
     """
     Reads mesh from hdf5 file to fenics mesh format
     :param path_to_file: path to file
+    :param cached: if True, returns shared mesh from process-level cache; defaults to config.MESH_CACHE_SIZE > 0
+    :param mpi_comm: MPI communicator of mesh, defaults to COMM_WORLD
     :return: mesh, subdomain meshfunction, boundary meshfunction
     """
+    entry = _read_mesh_hdf5_cached(path_to_file, cached=cached, mpi_comm=mpi_comm)
+    return entry['mesh'], entry['subdomains'], entry['boundaries']
+
+
+def _read_mesh_hdf5_cached(path_to_file, cached=None, mpi_comm=None):
+    if cached is None:
+        cached = config.MESH_CACHE_SIZE > 0
+    if not cached:
+        return _read_mesh_hdf5(path_to_file, mpi_comm)
+    if mpi_comm is None:
+        mpi_comm = fenics.Mesh().mpi_comm()
+    key = _get_mesh_cache_key(path_to_file, mpi_comm)
+    if key in _mesh_cache:
+        _mesh_cache.move_to_end(key)
+    else:
+        clear_mesh_cache(path_to_file)
+        _mesh_cache[key] = _read_mesh_hdf5(path_to_file, mpi_comm)
+        while len(_mesh_cache) > max(config.MESH_CACHE_SIZE, 1):
+            _mesh_cache.popitem(last=False)
+    return _mesh_cache[key]
+
+
+def _read_mesh_hdf5(path_to_file, mpi_comm=None):
     # mesh
-    mesh = fenics.Mesh()
+    if mpi_comm is None:
+        mesh = fenics.Mesh()
+    else:
+        mesh = fenics.Mesh(mpi_comm)
     hdf = fenics.HDF5File(mesh.mpi_comm(),  path_to_file, "r")
     if fenics.is_version("=2018.1.x") and config.USE_ADJOINT:
         hdf.read(mesh, "/mesh", False, annotate=False)
@@ -710,7 +1190,7 @@ def read_mesh_hdf5(path_to_file):
     else:
         boundaries.set_all(0)
     hdf.close()
-    return mesh, subdomains, boundaries
+    return {'mesh': mesh, 'subdomains': subdomains, 'boundaries': boundaries, 'functionspaces': {}}
 
 
 def save_functions_hdf5(function_dict, path_to_file, time_step=None):
@@ -782,21 +1262,224 @@ def save_function_mesh(function, path_to_hdf5_function, labelfunction=None, subd
     save_functions_hdf5({"function": function}, path_to_hdf5_function, time_step=None)
 
 
-def load_function_mesh(path_to_hdf5_function, functionspace='function', degree=1):
+def load_function_mesh(path_to_hdf5_function, functionspace='function', degree=1, cached=None):
+    """
+    Loads function and its mesh saved by `save_function_mesh`.
+    Mesh and function space are shared with other callers if cached, see `read_mesh_hdf5`.
+    """
     if path_to_hdf5_function.endswith('.h5'):
         path_to_hdf5_mesh = path_to_hdf5_function[:-3] + '_mesh.h5'
     else:
         print("Provide path to '.h5' file")
     if os.path.exists(path_to_hdf5_mesh):
-        mesh, subdomains, boundaries = read_mesh_hdf5(path_to_hdf5_mesh)
+        entry = _read_mesh_hdf5_cached(path_to_hdf5_mesh, cached=cached)
+        mesh, subdomains, boundaries = entry['mesh'], entry['subdomains'], entry['boundaries']
     else:
         print("Could not find mesh file: '%s'" % path_to_hdf5_mesh)
     if os.path.exists(path_to_hdf5_function):
-        if functionspace == 'function':
-            functionspace = fenics.FunctionSpace(mesh, "Lagrange", degree)
-        elif functionspace == 'vector':
-            functionspace = fenics.VectorFunctionSpace(mesh, "Lagrange", degree)
+        if functionspace in ['function', 'vector']:
+            functionspace = _get_cached_functionspace(entry, functionspace, degree)
         function = read_function_hdf5("function", functionspace, path_to_hdf5_function)
     return function, mesh, subdomains, boundaries
 
 
+def _get_cached_functionspace(entry, function_type, degree):
+    functionspace_key = (function_type, degree)
+    if functionspace_key not in entry['functionspaces']:
+        if function_type == 'function':
+            entry['functionspaces'][functionspace_key] = fenics.FunctionSpace(entry['mesh'], "Lagrange", degree)
+        elif function_type == 'vector':
+            entry['functionspaces'][functionspace_key] = fenics.VectorFunctionSpace(entry['mesh'], "Lagrange", degree)
+        else:
+            raise ValueError("Don't understand function type '%s'" % function_type)
+    return entry['functionspaces'][functionspace_key]
+
+
+def read_functionspace_hdf5(path_to_mesh, function_type='function', degree=1, cached=None):
+    """
+    Returns Lagrange function space over mesh stored in hdf5 file.
+    If cached, repeated calls return the same function space instance, see `read_mesh_hdf5`.
+    :param function_type: 'function' or 'vector'
+    """
+    entry = _read_mesh_hdf5_cached(path_to_mesh, cached=cached)
+    return _get_cached_functionspace(entry, function_type, degree)
+
+
+# ==============================================================================
+# RAW VECTOR TIME SERIES IO
+# ==============================================================================
+# Time series of functions over a single function space are stored as
+#   /mesh/coordinates, /mesh/cells, /mesh/subdomains       (written once)
+#   /<name>/values                                         (steps x dofs, chunked & compressed)
+#   /<name>/cell_dofs, /<name>/subspace_dofs/<subspace_id> (dofmap, written once)
+#   /<name>.attrs: element, recording_steps, times, time_steps
+# These files can only be read with the same mesh and function space, in serial.
+
+def get_cell_dofs(functionspace, cell_ids=None):
+    """
+    Returns dofmap of functionspace as array n_cells x n_dofs_per_cell.
+    :param cell_ids: only tabulate dofs of these cells (may contain repeated ids), defaults to all cells
+    :return: array len(cell_ids) x n_dofs_per_cell
+    """
+    dofmap = functionspace.dofmap()
+    if cell_ids is None:
+        unique_ids = np.arange(functionspace.mesh().num_cells())
+        inverse = None
+    else:
+        # dofmap is queried once per distinct cell
+        unique_ids, inverse = np.unique(np.asarray(cell_ids, dtype=np.int64), return_inverse=True)
+    cell_dofs = np.empty((len(unique_ids), dofmap.max_element_dofs()), dtype=np.int64)
+    for i, cell_id in enumerate(unique_ids):
+        cell_dofs[i, :] = dofmap.cell_dofs(int(cell_id))
+    if inverse is not None:
+        cell_dofs = cell_dofs[inverse.flatten()]
+    return cell_dofs
+
+
+def _check_serial(mesh):
+    if fenics.MPI.size(mesh.mpi_comm()) > 1:
+        raise RuntimeError("Raw time series format is only supported in serial runs")
+
+
+def save_time_series_raw(path_to_file, name, functionspace, vectors, recording_steps, times, time_steps=None,
+                         subspace_names=None, subdomains=None, compression='gzip'):
+    """
+    Saves time series of dof vectors over single functionspace into hdf5 file.
+    Mesh is written once per file, dofmap and element signature once per time series.
+    Existing time series of same name is replaced.
+    :param path_to_file: path to hdf5 file
+    :param name: name of time series
+    :param functionspace: fenics function space
+    :param vectors: array n_steps x n_dofs, or list of dof vectors
+    :param recording_steps: list of recording steps
+    :param times: list of simulation times
+    :param time_steps: list of time steps
+    :param subspace_names: dictionary {subspace_id : subspace_name}
+    :param subdomains: fenics meshfunction dim
+    :param compression: h5py compression filter
+    """
+    import h5py
+    mesh = functionspace.mesh()
+    _check_serial(mesh)
+    values = np.asarray(vectors, dtype=float).reshape((len(recording_steps), functionspace.dim()))
+    fu.ensure_dir_exists(path_to_file)
+    with h5py.File(path_to_file, 'a') as hdf:
+        if 'mesh' not in hdf:
+            mesh_group = hdf.create_group('mesh')
+            mesh_group.create_dataset('coordinates', data=mesh.coordinates())
+            mesh_group.create_dataset('cells', data=mesh.cells())
+            mesh_group.attrs['cell_type'] = mesh.ufl_cell().cellname()
+            if subdomains is not None:
+                mesh_group.create_dataset('subdomains', data=subdomains.array())
+        if name in hdf:
+            del hdf[name]
+        ts_group = hdf.create_group(name)
+        ts_group.attrs['element'] = str(functionspace.ufl_element())
+        ts_group.attrs['recording_steps'] = np.asarray(recording_steps, dtype=int)
+        ts_group.attrs['times'] = np.asarray(times, dtype=float)
+        if time_steps is not None:
+            ts_group.attrs['time_steps'] = np.asarray(time_steps, dtype=float)
+        ts_group.create_dataset('cell_dofs', data=get_cell_dofs(functionspace))
+        for subspace_id, dofs in get_dofs_by_subspace(functionspace).items():
+            dataset = ts_group.create_dataset('subspace_dofs/%i' % subspace_id, data=np.asarray(dofs, dtype=int))
+            if subspace_names is not None:
+                dataset.attrs['name'] = subspace_names.get(subspace_id, '')
+        ts_group.create_dataset('values', data=values, maxshape=(None, values.shape[1]),
+                                chunks=(1, values.shape[1]), compression=compression)
+
+
+def append_time_series_raw(path_to_file, name, vector, recording_step, time, time_step=None):
+    """
+    Appends single dof vector to existing time series created by `save_time_series_raw`.
+    """
+    import h5py
+    with h5py.File(path_to_file, 'a') as hdf:
+        ts_group = hdf[name]
+        dataset = ts_group['values']
+        n_steps = dataset.shape[0]
+        dataset.resize(n_steps + 1, axis=0)
+        dataset[n_steps, :] = np.asarray(vector, dtype=float)
+        ts_group.attrs['recording_steps'] = np.append(ts_group.attrs['recording_steps'], recording_step)
+        ts_group.attrs['times'] = np.append(ts_group.attrs['times'], time)
+        if 'time_steps' in ts_group.attrs:
+            ts_group.attrs['time_steps'] = np.append(ts_group.attrs['time_steps'], time_step)
+
+
+def read_time_series_raw_info(path_to_file, name):
+    """
+    Reads meta information of time series without reading dof values.
+    :return: dictionary with keys 'element', 'recording_steps', 'times', 'time_steps', 'n_dofs', 'subspaces'
+    """
+    import h5py
+    with h5py.File(path_to_file, 'r') as hdf:
+        ts_group = hdf[name]
+        element = ts_group.attrs['element']
+        if isinstance(element, bytes):
+            element = element.decode()
+        info = {'element': element,
+                'recording_steps': np.array(ts_group.attrs['recording_steps']),
+                'times': np.array(ts_group.attrs['times']),
+                'n_dofs': ts_group['values'].shape[1],
+                'subspaces': {}}
+        if 'time_steps' in ts_group.attrs:
+            info['time_steps'] = np.array(ts_group.attrs['time_steps'])
+        else:
+            info['time_steps'] = info['times']
+        if 'subspace_dofs' in ts_group:
+            for subspace_id, dataset in ts_group['subspace_dofs'].items():
+                info['subspaces'][int(subspace_id)] = dataset.attrs.get('name', '')
+    return info
+
+
+def read_time_series_raw(path_to_file, name, steps=slice(None), subspace_id=None, subspace_name=None):
+    """
+    Reads dof values of time series without creating fenics functions.
+    :param path_to_file: path to hdf5 file
+    :param name: name of time series
+    :param steps: index, slice or list of indices along the time-step axis of the stored series
+    :param subspace_id: only return dofs of this subspace
+    :param subspace_name: only return dofs of this subspace
+    :return: array n_steps x n_dofs (or n_dofs_subspace); 1D array if `steps` is a single index
+    """
+    import h5py
+    with h5py.File(path_to_file, 'r') as hdf:
+        ts_group = hdf[name]
+        if isinstance(steps, (list, tuple, np.ndarray)):
+            # h5py requires increasing indices
+            steps_unique, steps_inverse = np.unique(steps, return_inverse=True)
+            values = ts_group['values'][list(steps_unique), :][steps_inverse]
+        else:
+            values = ts_group['values'][steps]
+        if (subspace_id is None) and (subspace_name is not None):
+            for subspace_id_str, dataset in ts_group['subspace_dofs'].items():
+                if dataset.attrs.get('name', '') == subspace_name:
+                    subspace_id = int(subspace_id_str)
+        if subspace_id is not None:
+            dofs = ts_group['subspace_dofs/%i' % subspace_id][()]
+            values = values[..., dofs]
+    return values
+
+
+def read_mesh_raw(path_to_file):
+    """
+    Reads mesh information stored by `save_time_series_raw`.
+    :return: vertex coordinates, cell connectivity, subdomain array (or None)
+    """
+    import h5py
+    with h5py.File(path_to_file, 'r') as hdf:
+        mesh_group = hdf['mesh']
+        coordinates = mesh_group['coordinates'][()]
+        cells = mesh_group['cells'][()]
+        subdomains = None
+        if 'subdomains' in mesh_group:
+            subdomains = mesh_group['subdomains'][()]
+    return coordinates, cells, subdomains
+
+
+def assign_vector_to_function(function, vector):
+    """
+    Sets dof values of fenics function from array.
+    """
+    function.vector().set_local(np.asarray(vector, dtype=float))
+    function.vector().apply('insert')
+    return function
@@ -1,23 +1,180 @@
+import hashlib
+import json
+import multiprocessing
 import os
 import shlex
 import subprocess
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+from glimslib import config
 import glimslib.utils.file_utils as fu
 
-def ants_apply_transforms(input_img, reference_img, output_file, transforms, interpolation='Linear', dim=3):
+
+# == Execution of ANTs commands: thread control & result cache
+
+def get_number_of_threads(n_threads=None):
+    """
+    Returns number of ITK threads for a registration call: n_threads if given, else config.ITK_NUMBER_OF_THREADS,
+    else None (ITK default).
+    """
+    if n_threads is None:
+        n_threads = config.ITK_NUMBER_OF_THREADS
+    return n_threads
+
+
+def _get_env(n_threads=None):
+    env = os.environ.copy()
+    n_threads = get_number_of_threads(n_threads)
+    if n_threads:
+        env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(n_threads)
+    return env
+
+
+def hash_file(path, block_size=2 ** 20):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_cache_key(cmd, input_files, output_paths):
+    """
+    Computes cache key from command and content of input files.
+    Input and output paths are replaced by placeholders in the command, so that the same operation on identical
+    files results in the same key, independently of file locations.
+    :param cmd: command string
+    :param input_files: list of input file paths
+    :param output_paths: list of output paths / prefixes that appear in command
+    """
+    placeholders = {}
+    for i, path in enumerate(input_files):
+        placeholders[path] = '<input_%i>' % i
+    for i, path in enumerate(output_paths):
+        placeholders[path] = '<output_%i>' % i
+    cmd_normalized = cmd
+    for path in sorted(placeholders.keys(), key=len, reverse=True):
+        cmd_normalized = cmd_normalized.replace(path, placeholders[path])
+    content = {'cmd': cmd_normalized,
+               'inputs': [hash_file(path) for path in input_files]}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _restore_from_cache(path_to_cache_entry, output_files):
+    with open(os.path.join(path_to_cache_entry, 'outputs.json'), 'r') as f:
+        cached_roles = json.load(f)
+    if not set(output_files.keys()).issuperset(cached_roles):
+        return False
+    for role in cached_roles:
+        fu.ensure_dir_exists(os.path.dirname(output_files[role]))
+        shutil.copyfile(os.path.join(path_to_cache_entry, role), output_files[role])
+    return True
+
+
+def _add_to_cache(path_to_cache_entry, output_files):
+    existing = {role: path for role, path in output_files.items() if os.path.exists(path)}
+    if not existing:
+        return
+    cache_dir = os.path.dirname(path_to_cache_entry)
+    fu.ensure_dir_exists(cache_dir)
+    # populate temporary directory first, then rename: concurrent readers never see incomplete entries
+    path_tmp = tempfile.mkdtemp(dir=cache_dir)
+    for role, path in existing.items():
+        shutil.copyfile(path, os.path.join(path_tmp, role))
+    with open(os.path.join(path_tmp, 'outputs.json'), 'w') as f:
+        json.dump(sorted(existing.keys()), f)
+    try:
+        os.rename(path_tmp, path_to_cache_entry)
+    except OSError:  # entry has been created concurrently
+        shutil.rmtree(path_tmp, ignore_errors=True)
+
+
+def run_ants_command(cmd, input_files, output_files, output_paths=None, n_threads=None, use_cache=None,
+                     cache_dir=None, post_process=None):
+    """
+    Runs ANTs command in subprocess, with result cache.
+    Outputs are cached under a key computed from the command and the content of all input files.
+    If a cache entry exists, cached outputs are copied to the requested output paths and the command is not run.
+    :param cmd: command string
+    :param input_files: list of input file paths
+    :param output_files: dict {role: path} of output files produced by command (after post_process)
+    :param output_paths: list of output paths / prefixes appearing in cmd; defaults to values of output_files
+    :param n_threads: value of ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS for this call
+    :param use_cache: enable / disable cache, defaults to config.USE_REGISTRATION_CACHE
+    :param cache_dir: cache directory, defaults to config.output_dir_registration_cache
+    :param post_process: function executed after successful command execution, before outputs are cached
+    :return: return code of command, 0 if outputs were restored from cache
+    """
+    if use_cache is None:
+        use_cache = config.USE_REGISTRATION_CACHE
+    if cache_dir is None:
+        cache_dir = config.output_dir_registration_cache
+    if output_paths is None:
+        output_paths = list(output_files.values())
+    input_files = [path for path in input_files if path]
+    path_to_cache_entry = None
+    if use_cache and all(os.path.isfile(path) for path in input_files):
+        key = get_cache_key(cmd, input_files, output_paths)
+        path_to_cache_entry = os.path.join(cache_dir, key)
+        if os.path.isdir(path_to_cache_entry) and _restore_from_cache(path_to_cache_entry, output_files):
+            print("ANTS outputs restored from cache: %s" % path_to_cache_entry)
+            return 0
+    print("ANTS command: %s" % cmd)
+    for path in output_paths:
+        fu.ensure_dir_exists(os.path.dirname(path))
+    args = shlex.split(cmd)
+    process = subprocess.Popen(args, env=_get_env(n_threads))
+    process.wait()
+    if process.returncode == 0:
+        if post_process is not None:
+            post_process()
+        if path_to_cache_entry is not None:
+            _add_to_cache(path_to_cache_entry, output_files)
+    return process.returncode
+
+
+def run_concurrently(tasks, n_workers=None, n_threads=None):
+    """
+    Runs independent registration tasks concurrently in a bounded pool of workers.
+    Each task runs its ANTs command in a separate subprocess; the available cores are shared among the workers.
+    :param tasks: list of (function, kwargs dict), e.g. [(ants_apply_transforms, {...}), ...]
+    :param n_workers: maximum number of concurrent tasks, defaults to config.REGISTRATION_WORKERS
+    :param n_threads: number of ITK threads per task, defaults to cpu_count / n_workers
+    :return: list of results, in order of tasks
+    """
+    if n_workers is None:
+        n_workers = config.REGISTRATION_WORKERS
+    n_workers = max(1, min(n_workers, len(tasks)))
+    if n_threads is None:
+        n_threads = get_number_of_threads()
+    if n_threads is None:
+        n_threads = max(1, multiprocessing.cpu_count() // n_workers)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = []
+        for function, kwargs in tasks:
+            kwargs = dict(kwargs)
+            kwargs.setdefault('n_threads', n_threads)
+            futures.append(executor.submit(function, **kwargs))
+        return [future.result() for future in futures]
+
+
+# == ANTs operations
+
+def ants_apply_transforms(input_img, reference_img, output_file, transforms, interpolation='Linear', dim=3,
+                          n_threads=None, use_cache=None):
     print("  - Starting ANTS Apply Transforms:")
     print("    - INPUT IMG      : %s"%input_img)
     print("    - REFERENCE IMG  : %s" % reference_img)
     print("    - OUTPUT         : %s" % output_file)
     ants_cmd = build_ants_apply_transforms_command(input_img, reference_img, output_file, transforms, interpolation, dim)
-    print("ANTS command: %s"%ants_cmd)
-    fu.ensure_dir_exists(os.path.dirname(output_file))
-    args = shlex.split(ants_cmd)
-    process = subprocess.Popen(args, env=os.environ.copy())
-    process.wait()
-    #return process.returncode
-    print("ANTS apply transforms terminated with return code: '%s'"%process.returncode)
+    returncode = run_ants_command(ants_cmd,
+                                  input_files=[input_img, reference_img, *transforms],
+                                  output_files={'output': output_file},
+                                  n_threads=n_threads, use_cache=use_cache)
+    print("ANTS apply transforms terminated with return code: '%s'"%returncode)
+    return returncode
 
 
 def build_ants_apply_transforms_command(input_img, reference_img, output_file, transforms, interpolation='Linear', dim=3):
@@ -69,53 +226,74 @@ def build_ants_registration_command(fixed_img, moving_img, output_prefix, regist
 
 
 def register_ants(fixed_img, moving_img, output_prefix, path_to_transform=None, registration_type='Rigid',
-                  image_ext='mha', fixed_mask=None, moving_mask=None, verbose=0, dim=3):
+                  image_ext='mha', fixed_mask=None, moving_mask=None, verbose=0, dim=3,
+                  n_threads=None, use_cache=None):
     print("  - Starting ANTS registration:")
     print("    - FIXED IMG : %s"%fixed_img)
     print("    - MOVING IMG: %s" % moving_img)
     print("    - OUTPUT    : %s" % output_prefix)
     ants_cmd = build_ants_registration_command(fixed_img, moving_img, output_prefix, registration_type, image_ext,
                                                fixed_mask, moving_mask, verbose, dim=dim)
-    print("ANTS command: %s"%ants_cmd)
-    fu.ensure_dir_exists(os.path.dirname(output_prefix))
-    args = shlex.split(ants_cmd)
-    process = subprocess.Popen(args)
-    process.wait()
-    if process.returncode==0 and path_to_transform!=None:
+    output_files = {'warped': output_prefix + '.' + image_ext,
+                    'affine': output_prefix + '0GenericAffine.mat'}
+    if registration_type == 'Syn':
+        output_files['warp'] = output_prefix + '1Warp.nii.gz'
+        output_files['inverse_warp'] = output_prefix + '1InverseWarp.nii.gz'
+    path_to_transform_ants = None
+    if path_to_transform != None:
         #-- rename trafo file
         if registration_type=='Rigid' or registration_type=='Affine':
             path_to_transform_ants = output_prefix+'0GenericAffine.mat'
-            shutil.move(path_to_transform_ants, path_to_transform)
+            output_files['affine'] = path_to_transform
         if registration_type=='Syn':
             path_to_transform_ants = output_prefix + '1Warp.nii.gz'
+            output_files['warp'] = path_to_transform
+
+    def post_process():
+        if path_to_transform_ants is not None:
             shutil.move(path_to_transform_ants, path_to_transform)
-    print("Registration terminated with return code: '%s'"%process.returncode)
 
-    return process.returncode
+    returncode = run_ants_command(ants_cmd,
+                                  input_files=[fixed_img, moving_img, fixed_mask, moving_mask],
+                                  output_files=output_files,
+                                  output_paths=[output_prefix],
+                                  n_threads=n_threads, use_cache=use_cache, post_process=post_process)
+    print("Registration terminated with return code: '%s'"%returncode)
 
+    return returncode
 
-def register_ants_synquick(fixed_img, moving_img, output_prefix, registration='s', fixed_mask=None, dim=3):
+
+def register_ants_synquick(fixed_img, moving_img, output_prefix, registration='s', fixed_mask=None, dim=3,
+                           n_threads=None, use_cache=None):
     """
     registration:
         - r -> rigid
         - a -> rigid, affine
         - s -> rigid, affine, syn
     """
+    n_threads = get_number_of_threads(n_threads)
     ants_params_dict = {'d' : dim,
                         'f': fixed_img,
                         'm': moving_img,
                         't': registration,
                         'o': output_prefix,
-                        'n': 4,
+                        'n': n_threads if n_threads else 4,
                         'j': 1,
                         'z': 0 }
     if fixed_mask:
         ants_params_dict['x'] = fixed_mask
     ants_params_str = ' -'.join([' '.join([key, str(value)]) for key, value in ants_params_dict.items()])
     ants_cmd = "%s -"%'antsRegistrationSyNQuick.sh' + ants_params_str
-    print("ANTS command SYNquick: %s" % ants_cmd)
-    fu.ensure_dir_exists(os.path.dirname(output_prefix))
-    args = shlex.split(ants_cmd)
-    process = subprocess.Popen(args, env=os.environ.copy())
-    process.wait()
-    print("ANTS terminated with return code: '%s'" % process.returncode)
+    output_files = {'affine': output_prefix + '0GenericAffine.mat',
+                    'warped': output_prefix + 'Warped.nii.gz',
+                    'inverse_warped': output_prefix + 'InverseWarped.nii.gz'}
+    if registration == 's':
+        output_files['warp'] = output_prefix + '1Warp.nii.gz'
+        output_files['inverse_warp'] = output_prefix + '1InverseWarp.nii.gz'
+    returncode = run_ants_command(ants_cmd,
+                                  input_files=[fixed_img, moving_img, fixed_mask],
+                                  output_files=output_files,
+                                  output_paths=[output_prefix],
+                                  n_threads=n_threads, use_cache=use_cache)
+    print("ANTS terminated with return code: '%s'" % returncode)
+    return returncode
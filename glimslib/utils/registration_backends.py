@@ -0,0 +1,371 @@
+"""
+Registration backends with common interface.
+
+Backends register and resample in-memory `sitk.Image` objects and return transforms as list of `sitk.Transform`
+in ANTs order, i.e. the last transform of the list is applied first to a point in the fixed image domain.
+Images and transforms may also be given as file paths.
+
+- `ANTsRegistrationBackend`: calls ANTs binaries via `image_registration_utils` (file based)
+- `SimpleITKRegistrationBackend`: in-process registration using SimpleITK's registration framework
+
+The backend used by the image based optimization workflow is selected by `config.REGISTRATION_BACKEND`.
+"""
+
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+
+import SimpleITK as sitk
+
+from glimslib import config
+import glimslib.utils.file_utils as fu
+import glimslib.utils.image_registration_utils as reg
+
+INTERPOLATORS = {'Linear': sitk.sitkLinear,
+                 'NearestNeighbor': sitk.sitkNearestNeighbor,
+                 'GenericLabel': sitk.sitkLabelGaussian,
+                 'MultiLabel': sitk.sitkLabelGaussian,
+                 'BSpline': sitk.sitkBSpline}
+
+DISPLACEMENT_FIELD_EXTENSIONS = ('.nii', '.nii.gz', '.mha', '.mhd', '.nrrd')
+
+
+def read_image(image):
+    if isinstance(image, sitk.Image):
+        return image
+    return sitk.ReadImage(image)
+
+
+def read_transform(transform):
+    """
+    Reads transform from file; displacement field images are converted to DisplacementFieldTransform.
+    """
+    if isinstance(transform, sitk.Transform):
+        return transform
+    if transform.endswith(DISPLACEMENT_FIELD_EXTENSIONS):
+        field = sitk.ReadImage(transform, sitk.sitkVectorFloat64)
+        return sitk.DisplacementFieldTransform(field)
+    return sitk.ReadTransform(transform)
+
+
+def compose_transforms(transforms, dim):
+    """
+    Creates single transform from list of transforms in ANTs order.
+    """
+    if hasattr(sitk, 'CompositeTransform'):
+        composite = sitk.CompositeTransform(dim)
+    else:
+        composite = sitk.Transform(dim, sitk.sitkComposite)
+    for transform in transforms:
+        composite.AddTransform(read_transform(transform))
+    return composite
+
+
+def transforms_to_displacement_field(transforms, reference_img):
+    """
+    Evaluates list of transforms (ANTs order) on the grid of the reference image.
+    :return: sitk vector image of displacements
+    """
+    reference_img = read_image(reference_img)
+    transform = compose_transforms(transforms, reference_img.GetDimension())
+    to_field = sitk.TransformToDisplacementFieldFilter()
+    to_field.SetReferenceImage(reference_img)
+    to_field.SetOutputPixelType(sitk.sitkVectorFloat64)
+    return to_field.Execute(transform)
+
+
+def _set_number_of_threads(process_object, n_threads):
+    # thread budget is set per filter / registration method, so that concurrent calls do not interfere
+    if n_threads and hasattr(process_object, 'SetNumberOfThreads'):
+        process_object.SetNumberOfThreads(n_threads)
+
+
+class RegistrationBackend(ABC):
+    """
+    Common interface of registration backends.
+    """
+
+    def __init__(self, n_threads=None):
+        """
+        :param n_threads: number of threads available to each registration / resampling call
+        """
+        self.n_threads = reg.get_number_of_threads(n_threads)
+
+    @abstractmethod
+    def register(self, fixed_img, moving_img, registration_type='Rigid', fixed_mask=None, moving_mask=None):
+        """
+        Registers moving image to fixed image.
+        :param registration_type: 'Rigid', 'Affine' or 'Syn'
+        :return: warped moving image, list of transforms (ANTs order)
+        """
+        pass
+
+    @abstractmethod
+    def apply_transforms(self, input_img, reference_img, transforms, interpolation='Linear', n_threads=None):
+        """
+        Resamples input image on grid of reference image.
+        :param transforms: list of transforms (ANTs order)
+        :param interpolation: 'Linear', 'NearestNeighbor', 'GenericLabel', 'MultiLabel' or 'BSpline'
+        :param n_threads: number of threads for this call, defaults to the backend's n_threads
+        :return: resampled image
+        """
+        pass
+
+    def register_files(self, fixed_img, moving_img, output_prefix, path_to_transform=None,
+                       registration_type='Rigid', image_ext='mha', fixed_mask=None, moving_mask=None, **kwargs):
+        """
+        File-based registration with the same signature and outputs as `image_registration_utils.register_ants`:
+        warped image `<output_prefix>.<image_ext>`, linear transform '<output_prefix>0GenericAffine.mat' and for
+        'Syn' registration the warp field '<output_prefix>1Warp.nii.gz'.
+        If path_to_transform is given, the main transform (warp field for 'Syn') is moved there.
+        """
+        warped, transforms = self.register(fixed_img, moving_img, registration_type=registration_type,
+                                           fixed_mask=fixed_mask, moving_mask=moving_mask)
+        fu.ensure_dir_exists(os.path.dirname(output_prefix))
+        sitk.WriteImage(warped, output_prefix + '.' + image_ext)
+        path_affine = output_prefix + '0GenericAffine.mat'
+        if registration_type == 'Syn':
+            warp, affine = transforms
+            path_warp = path_to_transform if path_to_transform else output_prefix + '1Warp.nii.gz'
+            sitk.WriteImage(sitk.DisplacementFieldTransform(warp).GetDisplacementField(), path_warp)
+        else:
+            affine = transforms[0]
+            if path_to_transform:
+                path_affine = path_to_transform
+        sitk.WriteTransform(affine, path_affine)
+        return 0
+
+    def apply_transforms_files(self, input_img, reference_img, output_file, transforms, interpolation='Linear',
+                               **kwargs):
+        """
+        File-based resampling with the same signature as `image_registration_utils.ants_apply_transforms`.
+        """
+        image = self.apply_transforms(input_img, reference_img, transforms, interpolation=interpolation,
+                                      n_threads=kwargs.get('n_threads'))
+        fu.ensure_dir_exists(os.path.dirname(output_file))
+        sitk.WriteImage(image, output_file)
+        return 0
+
+
+class ANTsRegistrationBackend(RegistrationBackend):
+    """
+    Registration with ANTs binaries; in-memory images and transforms are exchanged through temporary files.
+    """
+
+    @staticmethod
+    def _to_file(image, path):
+        if isinstance(image, sitk.Image):
+            sitk.WriteImage(image, path)
+            return path
+        return image
+
+    @staticmethod
+    def _transform_to_files(transform, tmp_dir, index):
+        if not isinstance(transform, sitk.Transform):
+            return [transform]
+        if transform.GetName() == 'CompositeTransform':
+            transforms = [sitk.CompositeTransform(transform).GetNthTransform(i)
+                          for i in range(sitk.CompositeTransform(transform).GetNumberOfTransforms())]
+            paths = []
+            for i, sub_transform in enumerate(transforms):
+                paths.extend(ANTsRegistrationBackend._transform_to_files(sub_transform, tmp_dir, '%s_%i' % (index, i)))
+            return paths
+        if transform.GetName() == 'DisplacementFieldTransform':
+            path = os.path.join(tmp_dir, 'transform_%s.nii.gz' % index)
+            sitk.WriteImage(sitk.DisplacementFieldTransform(transform).GetDisplacementField(), path)
+        else:
+            path = os.path.join(tmp_dir, 'transform_%s.mat' % index)
+            sitk.WriteTransform(transform, path)
+        return [path]
+
+    def register(self, fixed_img, moving_img, registration_type='Rigid', fixed_mask=None, moving_mask=None):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fixed_img = self._to_file(fixed_img, os.path.join(tmp_dir, 'fixed.nii.gz'))
+            moving_img = self._to_file(moving_img, os.path.join(tmp_dir, 'moving.nii.gz'))
+            fixed_mask = self._to_file(fixed_mask, os.path.join(tmp_dir, 'fixed_mask.nii.gz'))
+            moving_mask = self._to_file(moving_mask, os.path.join(tmp_dir, 'moving_mask.nii.gz'))
+            dim = sitk.ReadImage(fixed_img).GetDimension()
+            output_prefix = os.path.join(tmp_dir, 'registered_')
+            returncode = reg.register_ants(fixed_img, moving_img, output_prefix, registration_type=registration_type,
+                                           image_ext='nii.gz', fixed_mask=fixed_mask, moving_mask=moving_mask,
+                                           dim=dim, n_threads=self.n_threads)
+            if returncode != 0:
+                raise RuntimeError("ANTs registration failed with return code %s" % returncode)
+            warped = sitk.ReadImage(output_prefix + '.nii.gz')
+            transforms = [read_transform(output_prefix + '0GenericAffine.mat')]
+            if registration_type == 'Syn':
+                transforms.insert(0, read_transform(output_prefix + '1Warp.nii.gz'))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return warped, transforms
+
+    def apply_transforms(self, input_img, reference_img, transforms, interpolation='Linear', n_threads=None):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            input_img = self._to_file(input_img, os.path.join(tmp_dir, 'input.nii.gz'))
+            reference_img = self._to_file(reference_img, os.path.join(tmp_dir, 'reference.nii.gz'))
+            transform_paths = []
+            for i, transform in enumerate(transforms):
+                transform_paths.extend(self._transform_to_files(transform, tmp_dir, i))
+            output_file = os.path.join(tmp_dir, 'output.nii.gz')
+            dim = sitk.ReadImage(reference_img).GetDimension()
+            reg.ants_apply_transforms(input_img, reference_img, output_file, transform_paths,
+                                      interpolation=interpolation, dim=dim,
+                                      n_threads=n_threads if n_threads else self.n_threads)
+            image = sitk.ReadImage(output_file)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return image
+
+    def register_files(self, fixed_img, moving_img, output_prefix, path_to_transform=None,
+                       registration_type='Rigid', image_ext='mha', fixed_mask=None, moving_mask=None, **kwargs):
+        return reg.register_ants(fixed_img, moving_img, output_prefix, path_to_transform=path_to_transform,
+                                 registration_type=registration_type, image_ext=image_ext,
+                                 fixed_mask=fixed_mask, moving_mask=moving_mask,
+                                 n_threads=kwargs.pop('n_threads', self.n_threads), **kwargs)
+
+    def apply_transforms_files(self, input_img, reference_img, output_file, transforms, interpolation='Linear',
+                               **kwargs):
+        return reg.ants_apply_transforms(input_img, reference_img, output_file, transforms,
+                                         interpolation=interpolation,
+                                         n_threads=kwargs.pop('n_threads', self.n_threads), **kwargs)
+
+
+class SimpleITKRegistrationBackend(RegistrationBackend):
+    """
+    In-process registration with SimpleITK's registration framework.
+    Settings follow the ANTs commands in `image_registration_utils`:
+    - Rigid / Affine: Mattes mutual information, 4 resolution levels
+    - Syn: greedy diffeomorphic-style registration of a displacement field with ANTs neighborhood correlation
+      metric and Gaussian regularization of the update field, after center of mass alignment
+    """
+
+    def __init__(self, n_threads=None, shrink_factors=(8, 4, 2, 1), smoothing_sigmas=(3, 2, 1, 0),
+                 linear_iterations=500, syn_iterations=100, syn_update_field_variance=3.0,
+                 syn_total_field_variance=0.0, sampling_percentage=0.25, seed=1):
+        """
+        :param n_threads: number of threads used during registration and resampling
+        :param shrink_factors: shrink factors of resolution levels
+        :param smoothing_sigmas: smoothing sigmas (in voxels) of resolution levels
+        :param linear_iterations: maximum number of optimizer iterations per level for Rigid / Affine
+        :param syn_iterations: maximum number of optimizer iterations per level for Syn
+        :param syn_update_field_variance: variance of Gaussian smoothing of update field
+        :param syn_total_field_variance: variance of Gaussian smoothing of total displacement field
+        :param sampling_percentage: fraction of voxels sampled by mutual information metric
+        :param seed: seed for random sampling
+        """
+        super().__init__(n_threads=n_threads)
+        self.shrink_factors = list(shrink_factors)
+        self.smoothing_sigmas = list(smoothing_sigmas)
+        self.linear_iterations = linear_iterations
+        self.syn_iterations = syn_iterations
+        self.syn_update_field_variance = syn_update_field_variance
+        self.syn_total_field_variance = syn_total_field_variance
+        self.sampling_percentage = sampling_percentage
+        self.seed = seed
+
+    def _create_registration_method(self, metric, fixed_mask=None, moving_mask=None):
+        method = sitk.ImageRegistrationMethod()
+        _set_number_of_threads(method, self.n_threads)
+        if metric == 'MI':
+            method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=32)
+            method.SetMetricSamplingStrategy(method.RANDOM)
+            method.SetMetricSamplingPercentage(self.sampling_percentage, self.seed)
+        elif metric == 'CC':
+            method.SetMetricAsANTSNeighborhoodCorrelation(radius=4)
+        if fixed_mask is not None:
+            method.SetMetricFixedMask(read_image(fixed_mask))
+        if moving_mask is not None:
+            method.SetMetricMovingMask(read_image(moving_mask))
+        method.SetInterpolator(sitk.sitkLinear)
+        method.SetShrinkFactorsPerLevel(self.shrink_factors)
+        method.SetSmoothingSigmasPerLevel(self.smoothing_sigmas)
+        method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOff()
+        return method
+
+    @staticmethod
+    def _create_linear_transform(fixed, moving, registration_type, initializer):
+        dim = fixed.GetDimension()
+        if registration_type == 'Affine':
+            transform = sitk.AffineTransform(dim)
+        elif dim == 2:
+            transform = sitk.Euler2DTransform()
+        else:
+            transform = sitk.Euler3DTransform()
+        return sitk.CenteredTransformInitializer(fixed, moving, transform, initializer)
+
+    def _register_linear(self, fixed, moving, registration_type, fixed_mask, moving_mask):
+        initial = self._create_linear_transform(fixed, moving, registration_type,
+                                                sitk.CenteredTransformInitializerFilter.MOMENTS)
+        method = self._create_registration_method('MI', fixed_mask, moving_mask)
+        method.SetOptimizerAsRegularStepGradientDescent(learningRate=1.0, minStep=1e-6,
+                                                        numberOfIterations=self.linear_iterations,
+                                                        relaxationFactor=0.5)
+        method.SetOptimizerScalesFromPhysicalShift()
+        method.SetInitialTransform(initial, inPlace=False)
+        transform = method.Execute(fixed, moving)
+        if hasattr(transform, 'Downcast'):
+            transform = transform.Downcast()
+        if transform.GetName() == 'CompositeTransform':
+            transform = sitk.CompositeTransform(transform).GetNthTransform(0)
+        return [transform]
+
+    def _register_syn(self, fixed, moving, fixed_mask, moving_mask):
+        # -- center of mass alignment, corresponding to ANTs' initial moving transform
+        initial = self._create_linear_transform(fixed, moving, 'Rigid',
+                                                sitk.CenteredTransformInitializerFilter.MOMENTS)
+        field = sitk.Image(fixed.GetSize(), sitk.sitkVectorFloat64)
+        field.CopyInformation(fixed)
+        displacement = sitk.DisplacementFieldTransform(field)
+        displacement.SetSmoothingGaussianOnUpdate(varianceForUpdateField=self.syn_update_field_variance,
+                                                  varianceForTotalField=self.syn_total_field_variance)
+        method = self._create_registration_method('CC', fixed_mask, moving_mask)
+        method.SetOptimizerAsGradientDescent(learningRate=1.0, numberOfIterations=self.syn_iterations,
+                                             convergenceMinimumValue=1e-8, convergenceWindowSize=10,
+                                             estimateLearningRate=method.EachIteration)
+        method.SetOptimizerScalesFromPhysicalShift()
+        method.SetMovingInitialTransform(initial)
+        method.SetInitialTransform(displacement, inPlace=True)
+        method.Execute(fixed, moving)
+        return [displacement, initial]
+
+    def register(self, fixed_img, moving_img, registration_type='Rigid', fixed_mask=None, moving_mask=None):
+        fixed = sitk.Cast(read_image(fixed_img), sitk.sitkFloat32)
+        moving_orig = read_image(moving_img)
+        moving = sitk.Cast(moving_orig, sitk.sitkFloat32)
+        if registration_type in ['Rigid', 'Affine']:
+            transforms = self._register_linear(fixed, moving, registration_type, fixed_mask, moving_mask)
+        elif registration_type == 'Syn':
+            transforms = self._register_syn(fixed, moving, fixed_mask, moving_mask)
+        else:
+            raise ValueError("Unknown registration type '%s'" % registration_type)
+        warped = self.apply_transforms(moving_orig, fixed_img, transforms)
+        return warped, transforms
+
+    def apply_transforms(self, input_img, reference_img, transforms, interpolation='Linear', n_threads=None):
+        input_img = read_image(input_img)
+        reference_img = read_image(reference_img)
+        resampler = sitk.ResampleImageFilter()
+        _set_number_of_threads(resampler, n_threads if n_threads else self.n_threads)
+        resampler.SetReferenceImage(reference_img)
+        resampler.SetTransform(compose_transforms(transforms, reference_img.GetDimension()))
+        resampler.SetInterpolator(INTERPOLATORS[interpolation])
+        resampler.SetDefaultPixelValue(0.0)
+        resampler.SetOutputPixelType(input_img.GetPixelID())
+        return resampler.Execute(input_img)
+
+
+REGISTRATION_BACKENDS = {'ants': ANTsRegistrationBackend,
+                         'sitk': SimpleITKRegistrationBackend}
+
+
+def get_registration_backend(name=None, **kwargs):
+    """
+    :param name: 'ants' or 'sitk', defaults to config.REGISTRATION_BACKEND
+    :return: backend instance
+    """
+    if name is None:
+        name = config.REGISTRATION_BACKEND
+    return REGISTRATION_BACKENDS[name](**kwargs)
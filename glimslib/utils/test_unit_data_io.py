@@ -1,5 +1,7 @@
 import os
 from unittest import TestCase
+import numpy as np
+import meshio as mio
 import glimslib.utils.data_io as dio
 from glimslib import fenics_local as fenics, config, visualisation as plott
 import  SimpleITK as sitk
@@ -119,4 +121,167 @@ class FenicsImageInterface(TestCase):
             # path_to_fun_plot = os.path.join(config.output_dir_testing, 'conc_%i.png' % i)
             # plott.show_img_seg_f(function=fun_list[i], show=True, path=path_to_fun_plot)
             # compare function with previous one
-            self.assertLess(fenics.errornorm(fun_list[i - 1], fun_list[i]),1E-5)
\ No newline at end of file
+            self.assertLess(fenics.errornorm(fun_list[i - 1], fun_list[i]),1E-5)
+
+    def test_image_to_function(self):
+        for function, function_type in [(self.conc, 'scalar'), (self.disp, 'vector'),
+                                        (self.conc3, 'scalar'), (self.disp3, 'vector')]:
+            img = dio.create_image_from_fenics_function(function, size_new=None)
+            function_from_img = dio.image_to_function(img, function_type=function_type)
+            self.assertEqual(function_from_img.function_space().mesh().num_vertices(),
+                             function.function_space().mesh().num_vertices())
+            self.assertLess(fenics.errornorm(function, function_from_img), 1E-5)
+
+    def test_rasterize_function(self):
+        for function in [self.conc, self.disp, self.conc3, self.disp3]:
+            img = dio.create_image_from_fenics_function(function, size_new=None)
+            img_rasterized = dio.rasterize_function(function, img)
+            self.assertEqual(img.GetNumberOfComponentsPerPixel(), img_rasterized.GetNumberOfComponentsPerPixel())
+            self.assertLess(np.max(np.abs(sitk.GetArrayFromImage(img) - sitk.GetArrayFromImage(img_rasterized))),
+                            1E-5)
+
+    def test_create_transfer_matrix(self):
+        mesh_target = fenics.RectangleMesh(fenics.Point(-1, -1.5), fenics.Point(1.5, 1), 13, 17)
+        conc_p2 = fenics.project(self.conc, fenics.FunctionSpace(self.conc.function_space().mesh(), "Lagrange", 2))
+        for function in [self.conc, conc_p2, self.disp]:
+            funspace_source = function.function_space()
+            funspace_target = fenics.FunctionSpace(mesh_target, funspace_source.ufl_element())
+            function_expected = fenics.Function(funspace_target)
+            fenics.LagrangeInterpolator.interpolate(function_expected, function)
+            matrix = dio.create_transfer_matrix(funspace_source, funspace_target)
+            values = matrix.dot(function.vector().get_local())
+            self.assertLess(np.max(np.abs(values - function_expected.vector().get_local())), 1E-8)
+
+
+    def test_get_cell_dofs(self):
+        for function in [self.conc, self.disp]:
+            cell_dofs = dio.get_cell_dofs(function.function_space())
+            self.assertEqual(cell_dofs.shape[0], function.function_space().mesh().num_cells())
+            cell_ids = np.array([5, 2, 5, 0])
+            self.assertTrue((dio.get_cell_dofs(function.function_space(), cell_ids) == cell_dofs[cell_ids]).all())
+
+
+class SubmeshExtraction(TestCase):
+
+    def setUp(self):
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), 10, 10)
+        self.subdomains = fenics.MeshFunction("size_t", self.mesh, 2)
+        self.subdomains.set_all(1)
+        fenics.CompiledSubDomain("x[0] > 0.0 - tol", tol=1E-14).mark(self.subdomains, 2)
+        self.boundaries = fenics.MeshFunction("size_t", self.mesh, 1)
+        self.boundaries.set_all(0)
+        fenics.CompiledSubDomain("on_boundary && near(x[0], 2.0)").mark(self.boundaries, 3)
+
+    def test_extract_submesh(self):
+        mesh, subdomains, boundaries, vertex_map, cell_map = dio.extract_submesh(self.mesh, self.subdomains,
+                                                                                 lower_thr=2, upper_thr=2,
+                                                                                 boundaries=self.boundaries)
+        self.assertEqual(mesh.num_cells(), (self.subdomains.array() == 2).sum())
+        self.assertEqual(mesh.num_cells(), (cell_map >= 0).sum())
+        self.assertEqual(mesh.num_vertices(), (vertex_map >= 0).sum())
+        self.assertTrue((subdomains.array() == 2).all())
+        self.assertEqual((boundaries.array() == 3).sum(), (self.boundaries.array() == 3).sum())
+        coords_parent = self.mesh.coordinates()[vertex_map >= 0]
+        coords_child = mesh.coordinates()[vertex_map[vertex_map >= 0]]
+        self.assertTrue((coords_parent == coords_child).all())
+        self.assertAlmostEqual(fenics.assemble(1 * fenics.dx(domain=mesh)), 8.0)
+
+    def test_extract_submesh_unsupported_dim(self):
+        mesh = fenics.UnitIntervalMesh(4)
+        subdomains = fenics.MeshFunction("size_t", mesh, 1)
+        subdomains.set_all(1)
+        with self.assertRaises(ValueError):
+            dio.extract_submesh(mesh, subdomains, lower_thr=1, upper_thr=1)
+
+    def test_remove_mesh_subdomain(self):
+        mesh, subdomains = dio.remove_mesh_subdomain(self.mesh, self.subdomains, lower_thr=1, upper_thr=1)
+        self.assertTrue((subdomains.array() == 1).all())
+        self.assertAlmostEqual(fenics.assemble(1 * fenics.dx(domain=mesh)), 8.0)
+
+
+class MergeVTUs(TestCase):
+
+    def setUp(self):
+        self.base_path = os.path.join(config.output_dir_testing, 'test_data_io', 'merge_vtus')
+        self.timesteps = [0, 1]
+        points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0]], dtype=float)
+        cells = {'triangle': np.array([[0, 1, 2], [1, 3, 2]])}
+        self.label_map = np.array([1.0, 2.0, 3.0, 4.0])
+        self._write_vtu(points, cells, 'label_map', 0, self.label_map)
+        for timestep in self.timesteps:
+            self._write_vtu(points, cells, 'concentration', timestep, self._concentration(timestep))
+
+    def _write_vtu(self, points, cells, name, timestep, values):
+        mio_mesh = mio.Mesh(points, cells)
+        mio_mesh.point_data = {name: values}
+        path_to_vtu = os.path.join(self.base_path, name, dio.create_file_name(name, timestep))
+        fu.ensure_dir_exists(path_to_vtu)
+        mio.write(path_to_vtu, mio_mesh)
+
+    @staticmethod
+    def _concentration(timestep):
+        return 0.25 * (timestep + 1) * np.arange(4, dtype=float)
+
+    def test_merge_vtus(self):
+        for n_processes in [1, 2]:
+            path_to_merged = dio.merge_vtus(self.base_path, self.timesteps, names=['concentration'],
+                                            n_processes=n_processes)
+            self.assertIsNone(path_to_merged)
+            for timestep in self.timesteps:
+                mio_mesh = mio.read(os.path.join(self.base_path, 'merged', dio.create_file_name('all', timestep)))
+                self.assertTrue(np.allclose(mio_mesh.point_data['label_map'], self.label_map))
+                self.assertTrue(np.allclose(mio_mesh.point_data['concentration'], self._concentration(timestep)))
+
+    def test_merge_vtus_single_file(self):
+        for n_processes in [1, 2]:
+            path_to_merged = dio.merge_vtus(self.base_path, self.timesteps, names=['concentration'],
+                                            n_processes=n_processes, single_file=True, times=[0.0, 0.5])
+            self.assertEqual(path_to_merged, os.path.join(self.base_path, 'merged', 'all.xdmf'))
+            reader = mio.XdmfTimeSeriesReader(path_to_merged)
+            points, cells = reader.read_points_cells()
+            self.assertEqual(points.shape[0], 4)
+            self.assertEqual(reader.num_steps, len(self.timesteps))
+            for k, timestep in enumerate(self.timesteps):
+                time, point_data, _ = reader.read_data(k)
+                self.assertAlmostEqual(time, [0.0, 0.5][k])
+                self.assertTrue(np.allclose(point_data['label_map'], self.label_map))
+                self.assertTrue(np.allclose(point_data['concentration'], self._concentration(timestep)))
+
+
+class MeshCache(TestCase):
+
+    def setUp(self):
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), 10, 10)
+        self.function = fenics.project(fenics.Expression('x[0]', degree=1),
+                                       fenics.FunctionSpace(self.mesh, "Lagrange", 1))
+        self.test_path = os.path.join(config.output_dir_testing, 'test_data_io', 'mesh_cache')
+        fu.ensure_dir_exists(self.test_path)
+        self.path_to_function = os.path.join(self.test_path, 'function.h5')
+        dio.save_function_mesh(self.function, self.path_to_function)
+
+    def tearDown(self):
+        dio.clear_mesh_cache()
+
+    def test_load_function_mesh_cached(self):
+        function_1, mesh_1, _, _ = dio.load_function_mesh(self.path_to_function, cached=True)
+        function_2, mesh_2, _, _ = dio.load_function_mesh(self.path_to_function, cached=True)
+        self.assertEqual(mesh_1.id(), mesh_2.id())
+        self.assertEqual(function_1.function_space().id(), function_2.function_space().id())
+        self.assertLess(fenics.errornorm(self.function, function_2), 1E-10)
+        # uncached read returns independent mesh
+        function_3, mesh_3, _, _ = dio.load_function_mesh(self.path_to_function, cached=False)
+        self.assertNotEqual(mesh_1.id(), mesh_3.id())
+        # writing mesh file invalidates cache
+        dio.save_function_mesh(self.function, self.path_to_function)
+        function_4, mesh_4, _, _ = dio.load_function_mesh(self.path_to_function, cached=True)
+        self.assertNotEqual(mesh_1.id(), mesh_4.id())
+
+    def test_read_functionspace_hdf5_cached(self):
+        path_to_mesh = self.path_to_function[:-3] + '_mesh.h5'
+        funspace_1 = dio.read_functionspace_hdf5(path_to_mesh, function_type='vector', degree=2, cached=True)
+        funspace_2 = dio.read_functionspace_hdf5(path_to_mesh, function_type='vector', degree=2, cached=True)
+        self.assertEqual(funspace_1.id(), funspace_2.id())
+        self.assertEqual(funspace_1.ufl_element().degree(), 2)
+        function, _, _, _ = dio.load_function_mesh(self.path_to_function, cached=True)
+        self.assertEqual(function.function_space().id(),
+                         dio.read_functionspace_hdf5(path_to_mesh, cached=True).id())
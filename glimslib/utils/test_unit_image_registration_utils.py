@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import glimslib.utils.image_registration_utils as reg
+
+
+class RegistrationCache(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.output_dir, 'cache')
+        self.path_input = os.path.join(self.output_dir, 'input.txt')
+        self.path_counter = os.path.join(self.output_dir, 'counter.txt')
+        with open(self.path_input, 'w') as f:
+            f.write('image')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _run(self, path_output):
+        cmd = "sh -c 'echo run >> %s; cp %s %s'" % (self.path_counter, self.path_input, path_output)
+        return reg.run_ants_command(cmd, input_files=[self.path_input], output_files={'output': path_output},
+                                    use_cache=True, cache_dir=self.cache_dir)
+
+    def _n_runs(self):
+        with open(self.path_counter, 'r') as f:
+            return len(f.readlines())
+
+    def test_run_ants_command_cached(self):
+        path_output_1 = os.path.join(self.output_dir, 'out_1', 'output.txt')
+        path_output_2 = os.path.join(self.output_dir, 'out_2', 'output.txt')
+        self.assertEqual(self._run(path_output_1), 0)
+        self.assertEqual(self._run(path_output_2), 0)
+        self.assertEqual(self._n_runs(), 1)
+        with open(path_output_2, 'r') as f:
+            self.assertEqual(f.read(), 'image')
+        # changed input content invalidates cache
+        with open(self.path_input, 'w') as f:
+            f.write('other image')
+        self._run(path_output_2)
+        self.assertEqual(self._n_runs(), 2)
+
+    def test_run_concurrently(self):
+        def square(value, n_threads=None):
+            return value ** 2, n_threads
+
+        results = reg.run_concurrently([(square, {'value': i}) for i in range(4)], n_workers=2, n_threads=3)
+        self.assertEqual(results, [(0, 3), (1, 3), (4, 3), (9, 3)])
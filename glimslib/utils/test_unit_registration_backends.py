@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import SimpleITK as sitk
+
+import glimslib.utils.registration_backends as regb
+
+
+def create_test_image(shift=(0, 0)):
+    y, x = np.mgrid[0:100, 0:100]
+    array = np.exp(-((x - 50 - shift[0]) ** 2 + (y - 50 - shift[1]) ** 2) / 200.) \
+            + 0.5 * np.exp(-((x - 30 - shift[0]) ** 2 + (y - 60 - shift[1]) ** 2) / 50.)
+    return sitk.GetImageFromArray(array.astype(np.float32))
+
+
+class SimpleITKBackend(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.fixed = create_test_image()
+        self.moving = create_test_image(shift=(5, -3))
+        self.backend = regb.get_registration_backend('sitk', n_threads=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _error(self, image):
+        return np.abs(sitk.GetArrayFromImage(image) - sitk.GetArrayFromImage(self.fixed)).mean()
+
+    def test_register(self):
+        error_initial = self._error(self.moving)
+        for registration_type in ['Rigid', 'Affine', 'Syn']:
+            warped, transforms = self.backend.register(self.fixed, self.moving, registration_type=registration_type)
+            self.assertLess(self._error(warped), 0.5 * error_initial)
+            # resampling with returned transforms reproduces warped image
+            resampled = self.backend.apply_transforms(self.moving, self.fixed, transforms)
+            self.assertAlmostEqual(self._error(resampled), self._error(warped))
+
+    def test_register_files(self):
+        output_prefix = os.path.join(self.output_dir, 'registered')
+        path_to_warp = os.path.join(self.output_dir, 'warp.nii.gz')
+        self.backend.register_files(self.fixed, self.moving, output_prefix, path_to_transform=path_to_warp,
+                                    registration_type='Syn', image_ext='nii')
+        self.assertTrue(os.path.exists(output_prefix + '.nii'))
+        path_output = os.path.join(self.output_dir, 'resampled.nii')
+        self.backend.apply_transforms_files(self.moving, self.fixed, path_output,
+                                            transforms=[path_to_warp, output_prefix + '0GenericAffine.mat'])
+        self.assertAlmostEqual(self._error(sitk.ReadImage(path_output)),
+                               self._error(sitk.ReadImage(output_prefix + '.nii')), places=4)
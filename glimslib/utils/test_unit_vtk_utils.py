@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+import numpy as np
+import vtk
+from vtk.numpy_interface import dataset_adapter as dsa
+
+import glimslib.utils.vtk_utils as vtu
+
+
+class VTKVolume(TestCase):
+
+    def setUp(self):
+        # unit cube split into 6 tetrahedra, 2 subdomains of 3 tetrahedra each
+        points = vtk.vtkPoints()
+        for coord in [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]:
+            points.InsertNextPoint(coord)
+        self.grid = vtk.vtkUnstructuredGrid()
+        self.grid.SetPoints(points)
+        for tet in [(0, 1, 2, 6), (0, 2, 3, 6), (0, 3, 7, 6), (0, 7, 4, 6), (0, 4, 5, 6), (0, 5, 1, 6)]:
+            id_list = vtk.vtkIdList()
+            for point_id in tet:
+                id_list.InsertNextId(point_id)
+            self.grid.InsertNextCell(vtk.VTK_TETRA, id_list)
+        grid_wrapped = dsa.WrapDataObject(self.grid)
+        grid_wrapped.CellData.append(np.array([1, 1, 1, 2, 2, 2]), 'ElementBlockIds')
+        grid_wrapped.CellData.append(np.array([0, 0.2, 0.4, 0.6, 0.8, 1.0]), 'concentration')
+
+    def test_compute_vtk_volume(self):
+        self.assertAlmostEqual(vtu.compute_vtk_volume(self.grid), 1.0)
+        measures = vtu.compute_vtk_cell_measures(self.grid)
+        self.assertTrue(np.allclose(measures, 1.0 / 6))
+
+    def test_compute_vtk_volume_ignores_boundary_cells(self):
+        grid = vtk.vtkUnstructuredGrid()
+        grid.DeepCopy(self.grid)
+        id_list = vtk.vtkIdList()
+        for point_id in (0, 1, 2):
+            id_list.InsertNextId(point_id)
+        grid.InsertNextCell(vtk.VTK_TRIANGLE, id_list)
+        measures = vtu.compute_vtk_cell_measures(grid)
+        self.assertAlmostEqual(measures[-1], 0.0)
+        self.assertAlmostEqual(vtu.compute_vtk_volume(grid), 1.0)
+
+    def test_compute_simplex_measures_unsupported(self):
+        with self.assertRaises(ValueError):
+            vtu.compute_simplex_measures(np.zeros((2, 3)), np.array([[0, 1]]))
+
+    def test_compute_vtk_volume_by_group(self):
+        volume_dict = vtu.compute_vtk_volume_by_group(self.grid, group_array_name='ElementBlockIds',
+                                                      threshold_array_name='concentration',
+                                                      thresholds=[0.0, 0.5])
+        self.assertAlmostEqual(volume_dict[(1, 0.0)], 0.5)
+        self.assertAlmostEqual(volume_dict[(2, 0.0)], 0.5)
+        self.assertAlmostEqual(volume_dict[(1, 0.5)], 0.0)
+        self.assertAlmostEqual(volume_dict[(2, 0.5)], 0.5)
+
+    def test_compute_vtk_volume_unknown_method(self):
+        with self.assertRaises(ValueError):
+            vtu.compute_vtk_volume(self.grid, method='unknown')
+        with self.assertRaises(ValueError):
+            vtu.compute_vtk_volume_by_group(self.grid, method='unknown')
@@ -34,22 +34,127 @@ def threshold_vtk_data(data_vtu_in, array_type, array_name, lower_thr=None, uppe
     return data_vtu_out
 
 def compute_vtk_volume(data_vtu_in, method="vtk"):
-    volume = 0
     if method == "vtk":
-        quality = vtk.vtkMeshQuality()
-        for cell_id in range(data_vtu_in.GetNumberOfCells()):
-            cell_curr = data_vtu_in.GetCell(cell_id)
-            vol_curr = quality.TetVolume(cell_curr)
-            volume = volume + vol_curr
+        volume = compute_vtk_cell_measures(data_vtu_in).sum()
     elif method == "abaqus":
+        volume = 0
         if data_vtu_in.GetCellData().HasArray("EVOL"):
-            cell_volume_array = data_vtu_in.GetCellData().GetArray("EVOL")
-            for cell_id in range(cell_volume_array.GetNumberOfTuples()):
-                vol_curr = cell_volume_array.GetValue(cell_id)
-                volume = volume + vol_curr
+            volume = get_vtk_array_as_numpy(data_vtu_in, 'cell', "EVOL").sum()
+    else:
+        raise ValueError("Unknown method '%s'" % method)
     print("Volume from '%s': %f" % (method, volume))
     return volume
 
+def get_vtk_array_as_numpy(data_vtu_in, array_type, array_name):
+    """
+    Returns cell or point data array as numpy array.
+    """
+    data_wrapped = dsa.WrapDataObject(data_vtu_in)
+    if array_type == "cell":
+        return np.asarray(data_wrapped.CellData[array_name])
+    elif array_type == "point":
+        return np.asarray(data_wrapped.PointData[array_name])
+
+def get_vtk_points_and_cells(data_vtu_in, cell_type=vtk.VTK_TETRA):
+    """
+    Extracts point coordinates and connectivity of all cells of given type as numpy arrays.
+    :param data_vtu_in: vtkUnstructuredGrid
+    :param cell_type: vtk cell type, e.g. vtk.VTK_TETRA or vtk.VTK_TRIANGLE
+    :return: points (n_points x 3), cell ids, connectivity (n_cells x n_vertices_per_cell)
+    """
+    data_wrapped = dsa.WrapDataObject(data_vtu_in)
+    points = np.asarray(data_wrapped.Points)
+    cell_types = np.asarray(data_wrapped.CellTypes)
+    cell_locations = np.asarray(data_wrapped.CellLocations)
+    cells_flat = np.asarray(data_wrapped.Cells)
+    cell_ids = np.where(cell_types == cell_type)[0]
+    if len(cell_ids) == 0:
+        return points, cell_ids, np.zeros((0, 0), dtype=int)
+    # legacy cell array layout: [n_vertices, id_0, ..., id_n, n_vertices, ...]
+    n_vertices = cells_flat[cell_locations[cell_ids[0]]]
+    offsets = cell_locations[cell_ids][:, np.newaxis] + 1 + np.arange(n_vertices)
+    connectivity = cells_flat[offsets]
+    return points, cell_ids, connectivity
+
+def compute_simplex_measures(points, connectivity):
+    """
+    Computes volume of tetrahedra or area of triangles in single vectorized operation.
+    :param points: n_points x 3 array
+    :param connectivity: n_cells x 4 (tetrahedra) or n_cells x 3 (triangles)
+    :return: array of cell measures
+    """
+    if connectivity.shape[0] == 0:
+        return np.zeros(0)
+    vertices = points[connectivity]
+    edges = vertices[:, 1:, :] - vertices[:, :1, :]
+    if connectivity.shape[1] == 4:
+        return np.abs(np.linalg.det(edges)) / 6.0
+    elif connectivity.shape[1] == 3:
+        return 0.5 * np.linalg.norm(np.cross(edges[:, 0, :], edges[:, 1, :]), axis=1)
+    else:
+        raise ValueError("Do not understand cells with %i vertices" % connectivity.shape[1])
+
+def compute_vtk_cell_measures(data_vtu_in):
+    """
+    Computes measure of each cell of the top topological dimension in vtk mesh, i.e. of tetrahedra, or of triangles
+    if the mesh contains no tetrahedra. Other cells, e.g. boundary triangles of a tetrahedral mesh, are assigned 0.
+    :return: array of length n_cells
+    """
+    measures = np.zeros(data_vtu_in.GetNumberOfCells())
+    for cell_type in [vtk.VTK_TETRA, vtk.VTK_TRIANGLE]:
+        points, cell_ids, connectivity = get_vtk_points_and_cells(data_vtu_in, cell_type=cell_type)
+        if len(cell_ids) > 0:
+            measures[cell_ids] = compute_simplex_measures(points, connectivity)
+            break
+    return measures
+
+def compute_vtk_volume_by_group(data_vtu_in, group_array_name=None, threshold_array_name=None,
+                                threshold_array_type='cell', thresholds=None, method="vtk"):
+    """
+    Computes volume of vtk mesh per subdomain and per threshold in a single pass.
+    :param data_vtu_in: vtkUnstructuredGrid
+    :param group_array_name: name of cell array that identifies subdomains, e.g. 'ElementBlockIds'
+    :param threshold_array_name: name of array to be thresholded, point arrays are averaged per cell
+    :param threshold_array_type: 'cell' or 'point'
+    :param thresholds: list of thresholds, volume of cells with value >= threshold is computed
+    :param method: 'vtk' computes volumes from geometry, 'abaqus' uses 'EVOL' cell array
+    :return: dictionary {(group_id, threshold): volume}; group_id / threshold are None if not requested
+    """
+    if method == "vtk":
+        measures = compute_vtk_cell_measures(data_vtu_in)
+    elif method == "abaqus":
+        measures = get_vtk_array_as_numpy(data_vtu_in, 'cell', "EVOL").astype(float)
+    else:
+        raise ValueError("Unknown method '%s'" % method)
+    if group_array_name is not None:
+        groups = get_vtk_array_as_numpy(data_vtu_in, 'cell', group_array_name).astype(int).flatten()
+        group_ids = np.unique(groups)
+        group_index = np.searchsorted(group_ids, groups)
+    else:
+        group_ids = [None]
+        group_index = np.zeros(len(measures), dtype=int)
+    if threshold_array_name is not None and thresholds is not None:
+        values = get_vtk_array_as_numpy(data_vtu_in, threshold_array_type, threshold_array_name)
+        if threshold_array_type == 'point':
+            _, cell_ids, connectivity = get_vtk_points_and_cells(data_vtu_in, cell_type=vtk.VTK_TETRA)
+            if len(cell_ids) == 0:
+                _, cell_ids, connectivity = get_vtk_points_and_cells(data_vtu_in, cell_type=vtk.VTK_TRIANGLE)
+            values_cell = np.full(len(measures), -np.inf)
+            values_cell[cell_ids] = values[connectivity].mean(axis=1)
+            values = values_cell
+    else:
+        thresholds = [None]
+    volume_dict = {}
+    for threshold in thresholds:
+        if threshold is None:
+            weights = measures
+        else:
+            weights = np.where(values.flatten() >= threshold, measures, 0)
+        volumes = np.bincount(group_index, weights=weights, minlength=len(group_ids))
+        for i, group_id in enumerate(group_ids):
+            volume_dict[(group_id, threshold)] = volumes[i]
+    return volume_dict
+
 def read_vtk_data(_path_to_file):
     if os.path.exists(_path_to_file):
         extension = fu.get_file_extension(_path_to_file)
@@ -0,0 +1,148 @@
+"""Provides rendering of plot frames in worker processes and stitching of frames into movies.
+
+Plot jobs are keyword arguments of `plotting.show_img_seg_f` whose fenics functions have been replaced by picklable
+`helpers.FunctionData` objects, so that workers do not need access to the simulation.
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+import glimslib.utils.file_utils as fu
+
+
+def _init_render_worker():
+    from matplotlib import pyplot as plt
+    plt.switch_backend('Agg')
+
+
+def _render_frame_worker(kwargs):
+    from matplotlib import pyplot as plt
+    from glimslib.visualisation import plotting as plott
+    figures = set(plt.get_fignums())
+    plott.show_img_seg_f(show=False, **kwargs)
+    for figure in set(plt.get_fignums()) - figures:
+        plt.close(figure)
+    return kwargs.get('path')
+
+
+class FrameRenderer:
+    """
+    Renders plot jobs in a pool of worker processes with non-interactive backend.
+    With n_processes=1, jobs are rendered in the calling process on submission.
+
+    Use as context manager:
+        with FrameRenderer(n_processes=4) as renderer:
+            renderer.submit(function=FunctionData(f), path='frame_0001.png')
+        paths = renderer.paths
+    """
+
+    def __init__(self, n_processes=None):
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        self.n_processes = n_processes
+        self._pool = None
+        self._results = []
+        self.paths = []
+
+    def submit(self, **kwargs):
+        """
+        :param kwargs: keyword arguments of `plotting.show_img_seg_f`, with FunctionData instead of fenics functions
+        """
+        if self.n_processes > 1:
+            if self._pool is None:
+                # spawned workers do not inherit fenics / MPI state or open figures of the parent process
+                context = multiprocessing.get_context('spawn')
+                self._pool = context.Pool(self.n_processes, initializer=_init_render_worker)
+            self._results.append(self._pool.apply_async(_render_frame_worker, (kwargs,)))
+        else:
+            self.paths.append(_render_frame_worker(kwargs))
+
+    def join(self):
+        """
+        Waits for all submitted jobs to finish.
+        :return: list of paths of rendered frames, in order of submission
+        """
+        if self._pool is not None:
+            try:
+                self.paths.extend([result.get() for result in self._results])
+            finally:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+                self._results = []
+        return self.paths
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.join()
+        else:
+            self.terminate()
+        return False
+
+
+def stitch_frames(paths, output_path, fps=5, dpi=100):
+    """
+    Combines image files into a movie; frames are cropped or padded to the size of the first frame.
+    :param paths: list of image paths, in order
+    :param output_path: path of movie, '.gif' (requires pillow) or '.mp4' (requires ffmpeg)
+    """
+    from matplotlib import animation
+    from matplotlib import pyplot as plt
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == '.gif':
+        writer = animation.PillowWriter(fps=fps)
+    elif extension == '.mp4':
+        writer = animation.FFMpegWriter(fps=fps)
+    else:
+        raise ValueError("Movie format '%s' not supported, use '.gif' or '.mp4'" % extension)
+    first = plt.imread(paths[0])
+    # even frame size for video codecs
+    height, width = first.shape[0] - first.shape[0] % 2, first.shape[1] - first.shape[1] % 2
+    fig = plt.figure(figsize=(width / float(dpi), height / float(dpi)), dpi=dpi)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.axis('off')
+    img = ax.imshow(first[:height, :width])
+    fu.ensure_dir_exists(output_path)
+    with writer.saving(fig, output_path, dpi):
+        for path in paths:
+            frame = plt.imread(path)[:height, :width]
+            if frame.shape[:2] != (height, width):
+                padded = np.ones((height, width) + frame.shape[2:], dtype=frame.dtype)
+                padded[:frame.shape[0], :frame.shape[1]] = frame
+                frame = padded
+            img.set_data(frame)
+            writer.grab_frame()
+    plt.close(fig)
+    print("  - Saved movie to '%s'" % output_path)
+    return output_path
+
+
+def stitch_frames_by_directory(paths, movie_format='mp4', fps=5):
+    """
+    Stitches frames in each directory into a movie '<directory>.<movie_format>', frames sorted by file name.
+    Directories with a single frame are skipped.
+    :return: list of movie paths
+    """
+    paths_by_dir = {}
+    for path in paths:
+        if path is not None:
+            paths_by_dir.setdefault(os.path.dirname(path), []).append(path)
+    movie_paths = []
+    for directory, dir_paths in sorted(paths_by_dir.items()):
+        if len(dir_paths) < 2:
+            continue
+        movie_path = os.path.normpath(directory) + '.' + movie_format
+        movie_paths.append(stitch_frames(sorted(dir_paths), movie_path, fps=fps))
+    return movie_paths
@@ -57,6 +57,149 @@ def mesh2triang(mesh):
     return tri.Triangulation(xy[:, 0], xy[:, 1], mesh.cells())
 
 
+class MeshData:
+    """
+    Picklable copy of mesh coordinates and cells that can replace a fenics mesh in the plotting functions.
+    """
+
+    def __init__(self, mesh, coordinates=None):
+        """
+        :param mesh: fenics mesh
+        :param coordinates: vertex coordinates to be used instead of those of `mesh`, optional
+        """
+        self._id = mesh.id()
+        if coordinates is None:
+            coordinates = mesh.coordinates()
+        self._coordinates = np.array(coordinates, dtype=float)
+        self._cells = np.array(mesh.cells())
+
+    def id(self):
+        return self._id
+
+    def coordinates(self):
+        return self._coordinates
+
+    def cells(self):
+        return self._cells
+
+    def num_vertices(self):
+        return self._coordinates.shape[0]
+
+    def num_cells(self):
+        return self._cells.shape[0]
+
+
+class FunctionData:
+    """
+    Picklable vertex values of a fenics function, as needed for plotting.
+    Used to hand plot data to worker processes, see `glimslib.visualisation.frames`.
+    """
+
+    def __init__(self, function, mesh_data=None):
+        """
+        :param function: fenics function
+        :param mesh_data: MeshData instance, defaults to copy of function's mesh
+        """
+        mesh = function.function_space().mesh()
+        if mesh_data is None:
+            mesh_data = MeshData(mesh)
+        self.mesh = mesh_data
+        self.values = function.compute_vertex_values(mesh)
+        self.value_dim = function.function_space().element().value_dimension(0)
+        self.name = function.name()
+
+
+def get_vertex_data(f):
+    """
+    Returns mesh (fenics mesh or MeshData), vertex values and value dimension of fenics function or FunctionData.
+    """
+    if isinstance(f, FunctionData):
+        return f.mesh, f.values, f.value_dim
+    mesh = f.function_space().mesh()
+    return mesh, f.compute_vertex_values(mesh), f.function_space().element().value_dimension(0)
+
+
+# Triangulations and raster samplers are cached per mesh; entries are rebuilt if the mesh coordinates changed.
+# {mesh id: (mesh, coordinates, triangulation)}
+_triangulation_cache = {}
+# {(mesh id, n_pixels, extent): (mesh, coordinates, RasterSampler)}
+_raster_sampler_cache = {}
+
+
+def _get_cached(cache, key, mesh, create):
+    coordinates = mesh.coordinates()
+    if key in cache:
+        _, coordinates_cached, item = cache[key]
+        if np.array_equal(coordinates, coordinates_cached):
+            return item
+    item = create()
+    cache[key] = (mesh, coordinates.copy(), item)
+    return item
+
+
+def get_triangulation(mesh):
+    """
+    Returns triangulation of 2D mesh, created once per mesh.
+    """
+    return _get_cached(_triangulation_cache, mesh.id(), mesh, lambda: mesh2triang(mesh))
+
+
+def get_raster_sampler(mesh, n_pixels=500, extent=None):
+    """
+    Returns RasterSampler of 2D mesh, created once per mesh, resolution and extent.
+    """
+    key = (mesh.id(), n_pixels, tuple(extent) if extent is not None else None)
+    return _get_cached(_raster_sampler_cache, key, mesh, lambda: RasterSampler(mesh, n_pixels, extent))
+
+
+def clear_plot_caches():
+    _triangulation_cache.clear()
+    _raster_sampler_cache.clear()
+
+
+class RasterSampler:
+    """
+    Sparse matrix that samples (piecewise linear) vertex values of a 2D mesh on a regular pixel grid.
+    Rasterizing a field is a single mat-vec product, independent of the plotting backend's handling of the mesh.
+    """
+
+    def __init__(self, mesh, n_pixels=500, extent=None):
+        """
+        :param n_pixels: number of pixels along the longer side of extent
+        :param extent: (x_min, x_max, y_min, y_max), defaults to bounding box of mesh
+        """
+        from scipy.sparse import csr_matrix
+        import glimslib.utils.data_io as dio
+        coordinates = mesh.coordinates()
+        if extent is None:
+            extent = (coordinates[:, 0].min(), coordinates[:, 0].max(),
+                      coordinates[:, 1].min(), coordinates[:, 1].max())
+        self.extent = tuple(extent)
+        spacing = max(extent[1] - extent[0], extent[3] - extent[2]) / float(n_pixels)
+        nx = max(1, int(np.ceil((extent[1] - extent[0]) / spacing)))
+        ny = max(1, int(np.ceil((extent[3] - extent[2]) / spacing)))
+        # pixel centers
+        self.x = extent[0] + (np.arange(nx) + 0.5) * (extent[1] - extent[0]) / nx
+        self.y = extent[2] + (np.arange(ny) + 0.5) * (extent[3] - extent[2]) / ny
+        self.shape = (ny, nx)
+        xv, yv = np.meshgrid(self.x, self.y)
+        cell_ids, bary = dio.locate_points(mesh, np.vstack([xv.ravel(), yv.ravel()]).T)
+        self.inside = cell_ids >= 0
+        pixels = np.where(self.inside)[0]
+        vertices = mesh.cells()[cell_ids[pixels]]
+        self.matrix = csr_matrix((bary[pixels].ravel(), (np.repeat(pixels, vertices.shape[1]), vertices.ravel())),
+                                 shape=(nx * ny, mesh.num_vertices()))
+
+    def sample(self, vertex_values):
+        """
+        :param vertex_values: values at mesh vertices, e.g. from function.compute_vertex_values(mesh)
+        :return: array of shape (ny, nx), nan outside of mesh
+        """
+        values = self.matrix.dot(vertex_values)
+        values[~self.inside] = np.nan
+        return values.reshape(self.shape)
+
+
 def interpolate_over_grid(x, y, u, v, n=100, return_coords='linspace', method='cubic'):
     """
     Interpolates 2D vector field data with (values u, v, at positions x, y) over grid with n nodes.
@@ -151,17 +294,15 @@ def exclude_from_data(data, min_f, max_f,
         ref = exclude_around[0]
         eps = exclude_around[1]
         if data_type=='standard':
-            mask1 = np.ma.make_mask(np.where(data > ref - eps, 1, 0))
-            mask2 = np.ma.make_mask(np.where(data < ref - eps, 1, 0))
+            mask_around = np.ma.make_mask(np.where(np.abs(data - ref) <= eps, 1, 0))
         elif data_type=='triangulation':
-            mask_below = np.logical_or.reduce((np.where(data > ref - eps, 1, 0).T))
-            mask_above = np.logical_or.reduce((np.where(data < ref - eps, 1, 0).T))
-        mask_above_below = np.logical_or(mask_below, mask_above)
-        mask_list.append(mask_above_below)
+            # exclude triangles with any vertex value close to ref
+            mask_around = np.logical_or.reduce((np.where(np.abs(data - ref) <= eps, 1, 0).T))
+        mask_list.append(mask_around)
 
     if len(mask_list)>1:
         mask = mask_list[0]
-        for i in range(1, len(mask_list)-1):
+        for i in range(1, len(mask_list)):
             mask = np.logical_or(mask,mask_list[i] )
     elif len(mask_list)==1:
         mask = mask_list[0]
@@ -50,9 +50,8 @@ def plot_fenics_function_vector(ax, f, mode='quiver', plot_nth=None,
     Subfunction for plotting FENICS 2D vectorfields,
     returns plot axis.
     """
-    mesh = f.function_space().mesh()
-    gdim = mesh.geometry().dim()
-    w0 = f.compute_vertex_values(mesh)
+    mesh, w0, _ = vh.get_vertex_data(f)
+    gdim = mesh.coordinates().shape[1]
     nv = mesh.num_vertices()
     if len(w0) != gdim * nv:
         raise AttributeError('Vector length must match geometric dimension.')
@@ -122,24 +121,43 @@ def plot_fenics_function_scalar(ax, f, showmesh=True,
                                 range_f=None, cmap='gist_earth', norm=None, norm_ref=None, n_cmap_levels=None,
                                 exclude_below=None, exclude_above=None, exclude_min_max=False, exclude_around=None,
                                 plot_nth=None, shading='flat', alpha=1,
+                                render_mode='mesh', n_pixels=500, contours=None, contour_color='k',
                                 **kwargs):
     """
     Subfunction for plotting FENICS 2D scalar field,
     returns plot axis.
+
+    :param render_mode: 'mesh' for tripcolor plot of mesh, 'raster' for imshow of field rasterized on regular grid;
+            rendering time in 'raster' mode is independent of mesh size
+    :param n_pixels: number of pixels along longer side of mesh bounding box in 'raster' mode
+    :param contours: number of contour levels or list of levels to overlay, optional
     """
-    mesh    = f.function_space().mesh()
-    nv      = mesh.num_vertices()
-    gdim    = mesh.geometry().dim()
-    mesh_coordinates = mesh.coordinates().reshape((nv, gdim))
-    triangulation = mesh2triang(mesh)
-    values = np.asarray([f(point) if len(mesh.bounding_box_tree().compute_collisions(Point(point)))>0 # check if point in domain
-                                      else np.nan                                        # assign nan otherwise
-                                for point in mesh_coordinates])
+    mesh, values, _ = vh.get_vertex_data(f)
     #-- colormap and range settings
     min_f, max_f, colormap, norm = get_ranges_colormap(values,
                                                        range=range_f, cmap=cmap, norm=norm, norm_ref=norm_ref,
                                                        n_cmap_levels=n_cmap_levels)
-
+    if render_mode == 'raster':
+        sampler = vh.get_raster_sampler(mesh, n_pixels=n_pixels)
+        data = sampler.sample(values)
+        #-- exclude data from plotting
+        mask = exclude_from_data(data, min_f, max_f,
+                                 exclude_below=exclude_below, exclude_above=exclude_above,
+                                 exclude_min_max=exclude_min_max, exclude_around=exclude_around,
+                                 data_type='standard')
+        data_masked = np.ma.masked_array(data, mask=np.logical_or(mask, np.isnan(data)))
+        #-- plot, keep axis orientation if axes already contain data
+        limits = (ax.get_xlim(), ax.get_ylim()) if ax.has_data() else None
+        plot = ax.imshow(data_masked, extent=sampler.extent, origin='lower', cmap=colormap, norm=norm,
+                         vmin=min_f, vmax=max_f, alpha=alpha, interpolation='nearest', **kwargs)
+        if contours is not None:
+            ax.contour(sampler.x, sampler.y, data_masked, levels=contours, colors=contour_color, linewidths=0.5)
+        if limits is not None:
+            ax.set_xlim(*limits[0])
+            ax.set_ylim(*limits[1])
+        return plot
+
+    triangulation = vh.get_triangulation(mesh)
     #-- exclude data from plotting
     data = values[triangulation.triangles]
     mask = exclude_from_data(data, min_f, max_f,
@@ -155,6 +173,8 @@ def plot_fenics_function_scalar(ax, f, showmesh=True,
     else:
         plot = ax.tripcolor(triangulation, values, cmap=colormap, norm=norm, shading=shading,
                            vmin=min_f, vmax=max_f, alpha=alpha, edgecolors="none", linewidth=0.0, **kwargs)
+    if contours is not None:
+        ax.tricontour(triangulation, values, levels=contours, colors=contour_color, linewidths=0.5)
     return plot
 
 
@@ -164,14 +184,11 @@ def plot_fenics_function(ax, f, mode='quiver', **kwargs):
     Subfunction for plotting FENICS 2D vector or scalarfield,
     returns plot axis.
     """
-    mesh = f.function_space().mesh()
-    gdim = mesh.geometry().dim()
-    tdim = mesh.topology().dim()
-    w0 = f.compute_vertex_values(mesh)
-    #nv = mesh.num_vertices()
-    value_dim = f.function_space().element().value_dimension(0)
-    #if len(w0) != gdim * nv:
-    #    raise AttributeError('Vector length must match geometric dimension.')
+    if not isinstance(f, vh.FunctionData):
+        f = vh.FunctionData(f)
+    mesh = f.mesh
+    gdim = mesh.coordinates().shape[1]
+    value_dim = f.value_dim
 
     if gdim == 2:
         # -- scalar
@@ -183,12 +200,13 @@ def plot_fenics_function(ax, f, mode='quiver', **kwargs):
         elif value_dim == 2:
             if 'showmesh' in kwargs:
                 kwargs.pop('showmesh')
-            if 'shading' in kwargs:
-                kwargs.pop('shading')
+            for key in ['shading', 'render_mode', 'n_pixels', 'contours', 'contour_color']:
+                if key in kwargs:
+                    kwargs.pop(key)
             plot = plot_fenics_function_vector(ax, f, mode=mode, **kwargs)
             return plot
         else:
-            print("Plot function not defined for value dimension > 2. Here: %i" % tdim)
+            print("Plot function not defined for value dimension > 2. Here: %i" % value_dim)
 
     else:
         print("Plot function not defined for geometric dimension %i" % gdim)
@@ -297,7 +315,7 @@ def plot(plot_object_list, dpi=100, plot_range=None, margin=0.02, cbarwidth=0.05
         params = kwargs.copy()
         params.update(plot_object_dict)
         #-- plot
-        if type(plot_object)==Function:
+        if type(plot_object)==Function or isinstance(plot_object, vh.FunctionData):
             plot = plot_fenics_function(ax, plot_object, **params)
         elif type(plot_object)==sitk.Image:
             plot = plot_sitk_image(ax, plot_object, **params)
@@ -344,7 +362,8 @@ def show_img_seg_f(image=None, segmentation=None, function=None, contour=False,
                    plot_range=None,
                    show_axes=True, show_cbar=True, show_title=True, show_ticks=True,
                    cbar_size='5%', cbar_pad=0.05, cbar_fontsize=None,
-                   add_plot_object_pre=None, add_plot_object_post=None):
+                   add_plot_object_pre=None, add_plot_object_post=None,
+                   render_mode='mesh', n_pixels=500, contours=None):
     """
     Convenience function providing default settings for certain types of plots
     """
@@ -377,7 +396,10 @@ def show_img_seg_f(image=None, segmentation=None, function=None, contour=False,
                            'alpha': alpha_f,
                            'norm': norm,
                            'norm_ref': cmap_ref,
-                           'color': color
+                           'color': color,
+                           'render_mode': render_mode,
+                           'n_pixels': n_pixels,
+                           'contours': contours
                            }
 
         plot_list.append(plot_obj_function)
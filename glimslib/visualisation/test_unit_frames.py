@@ -0,0 +1,42 @@
+import os
+import shutil
+from unittest import TestCase
+
+from glimslib import fenics_local as fenics, config
+from glimslib.visualisation import helpers as vh
+from glimslib.visualisation import frames as vf
+
+
+class TestFrames(TestCase):
+
+    def setUp(self):
+        self.test_path = os.path.join(config.output_dir_testing, 'test_frames')
+        shutil.rmtree(self.test_path, ignore_errors=True)
+        mesh = fenics.RectangleMesh(fenics.Point(-2, -2), fenics.Point(2, 2), 10, 10)
+        V = fenics.FunctionSpace(mesh, 'Lagrange', 1)
+        self.functions = [fenics.interpolate(fenics.Expression('a * x[0]', a=a, degree=1), V) for a in [1, 2, 3]]
+
+    def _render(self, n_processes, sub_dir):
+        with vf.FrameRenderer(n_processes=n_processes) as renderer:
+            for i, function in enumerate(self.functions):
+                renderer.submit(function=vh.FunctionData(function), showmesh=False, dpi=50,
+                                path=os.path.join(self.test_path, sub_dir, 'frame_%04d.png' % i))
+        return renderer.paths
+
+    def test_render_frames(self):
+        for n_processes in [1, 2]:
+            sub_dir = 'frames_%i' % n_processes
+            paths = self._render(n_processes, sub_dir)
+            self.assertEqual(paths, [os.path.join(self.test_path, sub_dir, 'frame_%04d.png' % i)
+                                     for i in range(len(self.functions))])
+            self.assertTrue(all([os.path.exists(path) for path in paths]))
+
+    def test_stitch_frames(self):
+        paths = self._render(1, 'frames')
+        path_to_movie = vf.stitch_frames(paths, os.path.join(self.test_path, 'movie.gif'))
+        self.assertTrue(os.path.exists(path_to_movie))
+        movie_paths = vf.stitch_frames_by_directory(paths + [None], movie_format='gif')
+        self.assertEqual(movie_paths, [os.path.join(self.test_path, 'frames.gif')])
+        self.assertTrue(os.path.exists(movie_paths[0]))
+        with self.assertRaises(ValueError):
+            vf.stitch_frames(paths, os.path.join(self.test_path, 'movie.avi'))
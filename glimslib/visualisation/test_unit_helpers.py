@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+import numpy as np
+
+from glimslib import fenics_local as fenics
+from glimslib.visualisation import helpers as vh
+
+
+class TestExcludeFromData(TestCase):
+
+    def setUp(self):
+        self.data = np.array([0.0, 0.05, 0.5, 1.0])
+        # triangles as rows of vertex values
+        self.data_triangulation = np.array([[0.0, 0.5, 0.6], [0.5, 0.6, 0.7], [0.6, 0.7, 1.0]])
+
+    def test_exclude_around(self):
+        mask = vh.exclude_from_data(self.data, 0.0, 1.0, exclude_around=[0.0, 0.1])
+        self.assertEqual(list(mask), [True, True, False, False])
+        mask = vh.exclude_from_data(self.data_triangulation, 0.0, 1.0, exclude_around=[0.0, 0.1],
+                                    data_type='triangulation')
+        self.assertEqual(list(mask), [True, False, False])
+
+    def test_exclude_min_max_and_around(self):
+        mask = vh.exclude_from_data(self.data, 0.0, 0.8, exclude_min_max=True, exclude_around=[0.0, 0.1])
+        self.assertEqual(list(mask), [True, True, False, True])
+        mask = vh.exclude_from_data(self.data_triangulation, 0.0, 0.8, exclude_min_max=True,
+                                    exclude_around=[0.0, 0.1], data_type='triangulation')
+        self.assertEqual(list(mask), [True, False, True])
+
+    def test_exclude_nothing(self):
+        mask = vh.exclude_from_data(self.data, 0.0, 1.0)
+        self.assertFalse(np.any(mask))
+
+
+class TestRasterSampler(TestCase):
+
+    def setUp(self):
+        self.mesh = fenics.RectangleMesh(fenics.Point(-2, -1), fenics.Point(2, 1), 10, 5)
+        V = fenics.FunctionSpace(self.mesh, 'Lagrange', 1)
+        self.function = fenics.interpolate(fenics.Expression('x[0] + 2 * x[1]', degree=1), V)
+
+    def test_sample(self):
+        sampler = vh.RasterSampler(self.mesh, n_pixels=40)
+        self.assertEqual(sampler.shape, (20, 40))
+        values = sampler.sample(self.function.compute_vertex_values(self.mesh))
+        xv, yv = np.meshgrid(sampler.x, sampler.y)
+        # P1 field is linear, so sampled values are exact
+        self.assertTrue(np.allclose(values, xv + 2 * yv))
+
+    def test_sample_outside(self):
+        sampler = vh.RasterSampler(self.mesh, n_pixels=20, extent=(-3, 3, -1, 1))
+        values = sampler.sample(self.function.compute_vertex_values(self.mesh))
+        outside = np.abs(sampler.x) > 2
+        self.assertTrue(np.all(np.isnan(values[:, outside])))
+        xv, yv = np.meshgrid(sampler.x, sampler.y)
+        self.assertTrue(np.allclose(values[:, ~outside], (xv + 2 * yv)[:, ~outside]))